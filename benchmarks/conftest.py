@@ -0,0 +1,70 @@
+"""Benchmarks for the detection and risk pipelines, run with pytest-benchmark:
+
+    pytest benchmarks --benchmark-autosave
+    pytest benchmarks --benchmark-compare
+
+Record scales are set with PACMAN_BENCH_SCALES (default 1000,100000, add 1000000 for the full
+suite) and a recorded OBIS API page can be used instead of synthetic pages with PACMAN_OBIS_PAGE.
+Each benchmark stores record counts, throughput and peak traced memory in extra_info.
+"""
+
+import os
+import tracemalloc
+import pytest
+from pacmandetections import DetectionEngine
+from pacmandetections.assessment import AssessmentCache, speedy_handles
+from pacmandetections.sources import OBISAPISource
+from fixtures import BENCHMARK_CELL, MiniSpeedy, synthetic_page, recorded_page, start_stub_portal
+
+
+def scales() -> list[int]:
+    return [int(scale) for scale in os.getenv("PACMAN_BENCH_SCALES", "1000,100000").split(",")]
+
+
+def run(benchmark, func, records: int, rounds: int = 3):
+    """Benchmark func and record throughput and peak memory."""
+
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = benchmark.pedantic(func, rounds=rounds, iterations=1, warmup_rounds=0)
+    benchmark.extra_info["records"] = records
+    benchmark.extra_info["peak_memory_mb"] = peak / 1e6
+
+    # no stats are collected with --benchmark-disable
+
+    if benchmark.stats is not None:
+        benchmark.extra_info["records_per_second"] = records / benchmark.stats.stats.mean
+    return result
+
+
+@pytest.fixture(scope="session", params=scales(), ids=lambda scale: f"{scale}")
+def obis_page(request):
+    return recorded_page() or synthetic_page(request.param)
+
+
+@pytest.fixture(scope="session")
+def occurrences(obis_page):
+    source = OBISAPISource()
+    return [source.occurrence_from_result(dict(result)) for result in obis_page if result.get("genusid")]
+
+
+@pytest.fixture(scope="session")
+def speedy_data(tmp_path_factory):
+    data_dir = str(tmp_path_factory.mktemp("speedy_data"))
+    speedy_handles[(data_dir, 7)] = MiniSpeedy(data_dir)
+    return data_dir
+
+
+@pytest.fixture()
+def engine(speedy_data):
+    return DetectionEngine(h3=BENCHMARK_CELL, sources=[], speedy_data=speedy_data, assessment_cache=AssessmentCache())
+
+
+@pytest.fixture(scope="session")
+def portal():
+    server = start_stub_portal()
+    yield f"http://127.0.0.1:{server.server_port}/api"
+    server.shutdown()
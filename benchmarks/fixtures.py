@@ -0,0 +1,139 @@
+import gzip
+import json
+import os
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import h3
+import pandas as pd
+from pacmandetections.util import atomic_write
+
+
+def load_wrims_ids() -> list[int]:
+    with open(os.path.join(os.path.dirname(__file__), "..", "pacmandetections", "data", "wrims_aphiaids.txt")) as f:
+        return [int(line.split("\t")[0]) for line in f]
+
+
+BENCHMARK_CELL = "859b41b3fffffff"
+
+
+def synthetic_page(records: int, annotations: int = 3, seed: int = 1) -> list[dict]:
+    """Generate an OBIS API result page with eDNA records and identificationRemarks annotations."""
+
+    rnd = random.Random(seed)
+    wrims = load_wrims_ids()
+    taxa = wrims[0:200] + list(range(1, 200))
+    datasets = [(f"dataset-{i}", f"eDNA dataset {i}") for i in range(20)]
+    genes = ["COI", "18S", "16S", "12S"]
+    sequences = ["".join(rnd.choice("ACGT") for _ in range(300)) for _ in range(100)]
+    lat, lon = h3.h3_to_geo(BENCHMARK_CELL)
+
+    page = []
+    for i in range(records):
+        dataset_id, dataset_name = rnd.choice(datasets)
+        remarks = {
+            "annotations": [
+                {
+                    "scientificNameID": f"urn:lsid:marinespecies.org:taxname:{rnd.choice(taxa)}",
+                    "identity": rnd.choice([0.95, 0.98, 0.99, 0.995, 1.0]),
+                    "query_cover": 100,
+                    "method": rnd.choice(["VSEARCH", "BLAST"])
+                }
+                for _ in range(rnd.randint(0, annotations))
+            ]
+        }
+        page.append({
+            "id": f"{i:08d}-0000-0000-0000-000000000000",
+            "scientificName": "Synthetic species",
+            "speciesid": rnd.choice(taxa),
+            "genusid": 1,
+            "eventDate": rnd.choice(["2023-05-01", "2023-05-02T10:15:00Z", "2023-06-11T08:00:00+02:00"]),
+            "decimalLongitude": lon + rnd.uniform(-0.05, 0.05),
+            "decimalLatitude": lat + rnd.uniform(-0.05, 0.05),
+            "materialSampleID": f"sample-{rnd.randint(0, records // 10)}",
+            "datasetID": dataset_id,
+            "datasetName": dataset_name,
+            "organismQuantity": str(rnd.randint(1, 1000)),
+            "identificationRemarks": json.dumps(remarks),
+            "dna": [{"target_gene": rnd.choice(genes), "DNA_sequence": rnd.choice(sequences)}]
+        })
+    return page
+
+
+def recorded_page() -> list[dict] | None:
+    """Load a recorded OBIS API page (JSON or gzipped JSON, the results array or the full response) from PACMAN_OBIS_PAGE."""
+
+    path = os.getenv("PACMAN_OBIS_PAGE")
+    if not path:
+        return None
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        data = json.load(f)
+    return data["results"] if isinstance(data, dict) else data
+
+
+class MiniSpeedy:
+    """Miniature stand-in for a Speedy handle, with deterministic summaries and thermal envelopes around the benchmark cell.
+
+    Summaries are written to Parquet files in data_dir on first use and read from there, so the data directory
+    has files for speedy_data_version and the assessment benchmarks include reading summaries from disk.
+    """
+
+    def __init__(self, data_dir: str, rings: int = 20):
+        self.data_dir = data_dir
+        self.cells = sorted(h3.k_ring(BENCHMARK_CELL, rings))
+
+    def get_summary(self, aphiaid: int, resolution: int = 5, as_geopandas: bool = False) -> pd.DataFrame:
+        file = os.path.join(self.data_dir, f"summary_{aphiaid}_{resolution}.parquet")
+        if not os.path.exists(file):
+            with atomic_write(file, "wb") as f:
+                self.generate_summary(aphiaid).to_parquet(f)
+        return pd.read_parquet(file)
+
+    def generate_summary(self, aphiaid: int) -> pd.DataFrame:
+        rnd = random.Random(aphiaid)
+        cells = [cell for cell in self.cells if rnd.random() < 0.3]
+        return pd.DataFrame({
+            "h3": cells,
+            "source_obis": True,
+            "source_gbif": [rnd.random() < 0.5 for _ in cells],
+            "records": [rnd.randint(1, 100) for _ in cells],
+            "min_year": [rnd.randint(1950, 2000) for _ in cells],
+            "max_year": [rnd.randint(2000, 2024) for _ in cells],
+            "establishmentMeans_native": [rnd.random() < 0.2 for _ in cells],
+            "establishmentMeans_introduced": [rnd.random() < 0.1 for _ in cells],
+            "invasiveness_invasive": [rnd.random() < 0.05 for _ in cells],
+            "invasiveness_concern": [rnd.random() < 0.05 for _ in cells]
+        })
+
+    def get_thermal_envelope(self, aphiaid: int, resolution: int = 5, as_geopandas: bool = False) -> pd.DataFrame | None:
+        rnd = random.Random(-aphiaid)
+        if rnd.random() < 0.2:
+            return None
+        return pd.DataFrame({"h3": [cell for cell in self.cells if rnd.random() < 0.5]})
+
+
+class StubPortalHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = b"[]" if self.path.startswith("/api/priority_list") else b"{}"
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        self.send_response(201)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_portal() -> ThreadingHTTPServer:
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubPortalHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
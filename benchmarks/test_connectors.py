@@ -0,0 +1,16 @@
+from pacmandetections.connectors import PortalDetectionConnector
+from conftest import run
+
+
+def test_submit_detections(benchmark, engine, occurrences, portal):
+    detections = engine.detections_from_occurrences(occurrences)[0:1000]
+    connector = PortalDetectionConnector(endpoint=portal)
+    summary = run(benchmark, lambda: connector.submit(detections), len(detections))
+    assert summary.failed == 0
+
+
+def test_submit_detections_bulk(benchmark, engine, occurrences, portal):
+    detections = engine.detections_from_occurrences(occurrences)[0:1000]
+    connector = PortalDetectionConnector(endpoint=portal, bulk=True)
+    summary = run(benchmark, lambda: connector.submit(detections), len(detections))
+    assert summary.failed == 0
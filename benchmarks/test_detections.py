@@ -0,0 +1,26 @@
+from pacmandetections.assessment import AssessmentCache, assess_many, speedy_data_version
+from pacmandetections.columnar import ColumnarDetectionEngine
+from fixtures import BENCHMARK_CELL
+from conftest import run
+
+
+def test_filter_and_group(benchmark, engine, occurrences):
+    engine.detections_from_occurrences(occurrences)
+    run(benchmark, lambda: engine.detections_from_occurrences(occurrences), len(occurrences))
+
+
+def test_filter_and_group_columnar(benchmark, speedy_data, occurrences):
+    engine = ColumnarDetectionEngine(h3=BENCHMARK_CELL, sources=[], speedy_data=speedy_data, assessment_cache=AssessmentCache())
+    engine.detections_from_occurrences(occurrences)
+    run(benchmark, lambda: engine.detections_from_occurrences(occurrences), len(occurrences))
+
+
+def test_assessment(benchmark, engine, occurrences):
+    aphiaids = set(evidence.AphiaID for evidence in engine.candidate_evidence(occurrences))
+    run(benchmark, lambda: assess_many(engine.speedy_data, aphiaids, [BENCHMARK_CELL], 5, AssessmentCache()), len(aphiaids))
+
+
+def test_assessment_persistent(benchmark, engine, occurrences, tmp_path):
+    aphiaids = set(evidence.AphiaID for evidence in engine.candidate_evidence(occurrences))
+    cache = AssessmentCache(path=str(tmp_path / "assessments.db"), version=speedy_data_version(engine.speedy_data))
+    run(benchmark, lambda: assess_many(engine.speedy_data, aphiaids, [BENCHMARK_CELL], 5, cache), len(aphiaids))
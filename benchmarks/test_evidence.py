@@ -0,0 +1,38 @@
+import json
+import re
+import dateutil.parser
+from pacmandetections.model import Evidence
+
+
+def reference_evidence_for_occurrence(occurrence) -> list[Evidence]:
+    """Evidence extraction with stdlib JSON, a dateutil parse per evidence and an uncompiled LSID regex."""
+
+    def get_day():
+        return dateutil.parser.isoparse(occurrence.eventDate).strftime("%Y-%m-%d")
+
+    evidences = [Evidence(occurrence.AphiaID, occurrence.target_gene, occurrence.organismQuantity, None, None, None, get_day(), occurrence, None)]
+
+    if occurrence.identificationRemarks is not None:
+        try:
+            remarks = json.loads(occurrence.identificationRemarks)
+            for annotation in remarks.get("annotations", []):
+                if "scientificNameID" in annotation:
+                    match = re.match(r"urn:lsid:marinespecies\.org:taxname:(\d+)", annotation["scientificNameID"])
+                    evidences.append(Evidence(
+                        int(match.group(1)) if match else None, occurrence.target_gene, occurrence.organismQuantity,
+                        annotation.get("identity"), annotation.get("query_cover"), annotation.get("method"), get_day(), occurrence, None
+                    ))
+        except json.JSONDecodeError:
+            pass
+
+    return evidences
+
+
+def test_evidence_reference(benchmark, occurrences):
+    benchmark(lambda: [reference_evidence_for_occurrence(occurrence) for occurrence in occurrences])
+
+
+def test_evidence(benchmark, occurrences, engine):
+    result = benchmark(lambda: [engine.evidence_for_occurrence(occurrence) for occurrence in occurrences])
+    assert [[(e.AphiaID, e.date, e.identity) for e in evidences] for evidences in result] == \
+        [[(e.AphiaID, e.date, e.identity) for e in reference_evidence_for_occurrence(occurrence)] for occurrence in occurrences]
@@ -0,0 +1,27 @@
+from datetime import date
+from pacmandetections.cache import PageCache
+from pacmandetections.sources import OBISAPISource
+from conftest import run
+
+
+def test_parse_page(benchmark, obis_page):
+    source = OBISAPISource()
+    run(benchmark, lambda: [source.occurrence_from_result(dict(result)) for result in obis_page], len(obis_page))
+
+
+def test_fetch_cached_pages(benchmark, obis_page, tmp_path):
+
+    # replay the page from an offline page cache, split in API sized pages within a single month window
+
+    cache = PageCache(str(tmp_path), offline=True)
+    source = OBISAPISource(cache=cache)
+    wkt = "POLYGON ((0 0, 1 0, 1 1, 0 0))"
+    after = 0
+    for i in range(0, len(obis_page), 10000):
+        page = obis_page[i:i + 10000]
+        cache.put(cache.key(wkt, "2023-01-01", "2023-01-31", after), page)
+        after = page[-1]["id"]
+    cache.put(cache.key(wkt, "2023-01-01", "2023-01-31", after), [])
+
+    result = run(benchmark, lambda: list(source.fetch(wkt, date(2023, 1, 1), date(2023, 1, 31))), len(obis_page))
+    assert len(result) == len(obis_page)
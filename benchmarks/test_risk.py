@@ -0,0 +1,36 @@
+import pytest
+from pacmandetections.risk import RiskEngine
+from pacmandetections.assessment import get_speedy
+from pacmandetections.util import cell_polygon
+from fixtures import BENCHMARK_CELL, load_wrims_ids
+from conftest import run
+
+
+class StubPriorityRiskEngine(RiskEngine):
+
+    def fetch_priority_lists(self):
+        self.priority_taxa = set()
+
+
+@pytest.fixture()
+def risk_engine(speedy_data):
+    return StubPriorityRiskEngine(cell_polygon(BENCHMARK_CELL).buffer(0.5), area=1, speedy_data=speedy_data)
+
+
+@pytest.fixture(scope="session")
+def taxa():
+    return load_wrims_ids()[0:200]
+
+
+def test_summarize(benchmark, risk_engine, taxa):
+    speedy = get_speedy(risk_engine.speedy_data)
+    inputs = [(speedy.get_summary(taxon), speedy.get_thermal_envelope(taxon)) for taxon in taxa]
+    run(benchmark, lambda: [risk_engine.summarize(summary, envelope) for summary, envelope in inputs], len(taxa))
+
+
+def test_calculate_risk(benchmark, risk_engine, taxa):
+    run(benchmark, lambda: [risk_engine.calculate_risk(taxon) for taxon in taxa], len(taxa), rounds=1)
+
+
+def test_calculate_all(benchmark, risk_engine, taxa):
+    run(benchmark, lambda: risk_engine.calculate_all(taxa), len(taxa))
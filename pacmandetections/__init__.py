@@ -1,29 +1,54 @@
 from shapely import Geometry, Polygon
-from h3 import h3_to_geo_boundary, h3_get_resolution
+from h3 import h3_get_resolution
 from datetime import datetime, timedelta
-import importlib.resources
-from speedy import Speedy
-import os
 import json
-from pacmandetections.util import aphiaid_from_lsid
+from pacmandetections.util import aphiaid_from_lsid, cell_polygon, cells_for_points, intern, json_loads
 import logging
 from termcolor import colored
 from pacmandetections.model import Detection, EstablishmentMeans, Source, Occurrence, Confidence, Assessment, Invasiveness, Media, Evidence
 from pacmandetections.sources import OBISAPISource
+from pacmandetections.state import DetectionState
+from pacmandetections.assessment import AssessmentCache, default_assessment_cache, assess_many
+from pacmandetections.establishment import EstablishmentIndex
+from pacmandetections.metrics import metrics
+from pacmandetections.geometry import AreaCache, default_area_cache, envelope
+from pacmandetections.taxa import WrimsRegistry, wrims_registry
 from termcolor import colored
 import re
 from itertools import chain
 from collections import defaultdict
+from dataclasses import replace
+
+
+def fetch_occurrences(sources: list[Source], shape: Geometry, days: int, start_date: datetime = None) -> list[Occurrence]:
+    """Fetch occurrences for a shape from sources, by default going back days."""
+
+    occurrences = []
+    end_date = datetime.today()
+    if start_date is None:
+        start_date = end_date - timedelta(days=days)
+
+    for source in sources:
+        logging.info(f"Fetching data from {source}")
+        with metrics.timer("fetch"):
+            source_occurrences = list(source.fetch(shape, start_date, end_date))
+        metrics.count("occurrences_fetched", len(source_occurrences))
+        if (len(source_occurrences)):
+            color = "green"
+        else:
+            color = "red"
+        logging.info(colored(f"Found {len(source_occurrences)} species occurrences between {start_date} and {end_date}", color))
+        occurrences.extend(source_occurrences)
+
+    return occurrences
 
 
 class DetectionEngine:
 
-    def __init__(self, h3: Geometry | str, days: int = 365, sources: list[Source] = [OBISAPISource()], area: int = None, speedy_data: str = None):
+    def __init__(self, h3: Geometry | str, days: int = 365, sources: list[Source] = [OBISAPISource()], area: int = None, speedy_data: str = None, wrims: WrimsRegistry = None, assessment_cache: AssessmentCache = None, establishment_index: EstablishmentIndex = None):
 
         if isinstance(h3, str):
-            coords = h3_to_geo_boundary(h3)
-            flipped = tuple(coord[::-1] for coord in coords)
-            self.shape = Polygon(flipped)
+            self.shape = cell_polygon(h3)
         else:
             if not isinstance(h3, Polygon):
                 raise ValueError("h3 must be a shapely Polygon or a H3 string")
@@ -35,20 +60,41 @@ class DetectionEngine:
         self.sources = sources
         self.area = area
         self.speedy_data = speedy_data
+        self.assessment_cache = assessment_cache if assessment_cache is not None else default_assessment_cache
+        self.establishment_index = establishment_index
 
         logging.info(f"Initializing detection engine for cell {self.h3} (resolution {self.resolution}) going back {self.days} days")
 
-        self.load_wrims_ids()
+        if wrims is not None:
+            self.wrims = wrims
+        else:
+            self.load_wrims_ids()
 
     def load_wrims_ids(self) -> None:
+        self.wrims = wrims_registry()
+
+    def parse_annotations(self, occurrence: Occurrence) -> list[dict]:
+        """Parse identificationRemarks annotations which refer to a taxon."""
+
+        annotations = []
+
+        if occurrence.identificationRemarks is not None:
+            try:
+                remarks = json_loads(occurrence.identificationRemarks)
+                if "annotations" in remarks:
+                    for annotation in remarks["annotations"]:
+                        # TODO: annotations currently do not have scientificNameID!
+                        if "scientificNameID" in annotation:
+                            annotations.append(annotation)
+            except json.JSONDecodeError:
+                pass
 
-        with importlib.resources.open_text("pacmandetections.data", "wrims_aphiaids.txt") as f:
-            lines = [line.strip().split("\t") for line in f.readlines()]
-            self.wrims = {int(line[0].strip()): line[1] for line in lines}
+        return annotations
 
     def evidence_for_occurrence(self, occurrence: Occurrence) -> list[Evidence]:
 
         evidences = []
+        day = occurrence.get_day()
 
         # main identification
 
@@ -59,7 +105,7 @@ class DetectionEngine:
             identity=None,
             query_cover=None,
             method=None,
-            date=occurrence.get_day(),
+            date=day,
             occurrence=occurrence,
             alternatives=None
         )
@@ -67,72 +113,28 @@ class DetectionEngine:
 
         # identificationRemarks
 
-        if occurrence.identificationRemarks is not None:
-            try:
-                remarks = json.loads(occurrence.identificationRemarks)
-                if "annotations" in remarks:
-                    for annotation in remarks["annotations"]:
-                        # TODO: annotations currently do not have scientificNameID!
-                        if "scientificNameID" in annotation:
-                            aphiaid = aphiaid_from_lsid(annotation["scientificNameID"])
-                            evidence = Evidence(
-                                AphiaID=aphiaid,
-                                target_gene=occurrence.target_gene,
-                                organismQuantity=occurrence.organismQuantity,
-                                identity=annotation.get("identity"),
-                                query_cover=annotation.get("query_cover"),
-                                method=annotation.get("method"),
-                                date=occurrence.get_day(),
-                                occurrence=occurrence,
-                                alternatives=None
-                            )
-                            evidences.append(evidence)
-            except json.JSONDecodeError:
-                pass
+        for annotation in self.parse_annotations(occurrence):
+            evidence = Evidence(
+                AphiaID=aphiaid_from_lsid(annotation["scientificNameID"]),
+                target_gene=occurrence.target_gene,
+                organismQuantity=occurrence.organismQuantity,
+                identity=annotation.get("identity"),
+                query_cover=annotation.get("query_cover"),
+                method=intern(annotation.get("method")),
+                date=day,
+                occurrence=occurrence,
+                alternatives=None
+            )
+            evidences.append(evidence)
 
         return evidences
 
     def perform_assessment(self, aphiaid: int) -> Assessment:
+        return self.perform_assessments({aphiaid})[aphiaid]
 
-        establishmentMeans = None
-
-        sp = Speedy(h3_resolution=7, data_dir=os.path.expanduser(self.speedy_data), cache_summary=True)
-        summary = sp.get_summary(aphiaid, resolution=self.resolution, as_geopandas=False)
-
-        summary_cell = summary[summary["h3"] == self.h3]
-        assert len(summary_cell) <= 1
-
-        if len(summary_cell) == 0:
-            establishmentMeans = EstablishmentMeans.UNCERTAIN
-        elif summary_cell["establishmentMeans_introduced"].any():
-            establishmentMeans = EstablishmentMeans.INTRODUCED
-        elif summary_cell["establishmentMeans_native"].any():
-            establishmentMeans = EstablishmentMeans.NATIVE
-        else:
-            establishmentMeans = EstablishmentMeans.UNCERTAIN
-
-        return Assessment(
-            establishmentMeans=establishmentMeans,
-        )
-
-    def fetch_occurrences(self):
+    def fetch_occurrences(self, start_date: datetime = None):
         """Fetch occurrences from the registered sources."""
-
-        occurrences = []
-        end_date = datetime.today()
-        start_date = end_date - timedelta(days=self.days)
-
-        for source in self.sources:
-            logging.info(f"Fetching data from {source}")
-            source_occurrences = list(source.fetch(self.shape, start_date, end_date))
-            if (len(source_occurrences)):
-                color = "green"
-            else:
-                color = "red"
-            logging.info(colored(f"Found {len(source_occurrences)} species occurrences between {start_date} and {end_date}", color))
-            occurrences.extend(source_occurrences)
-
-        return occurrences
+        return fetch_occurrences(self.sources, self.shape, self.days, start_date)
 
     def keep_evidence(self, evidence: Evidence, check_wrims=True, assessments: dict[int, Assessment] = None) -> bool:
         if check_wrims and evidence.AphiaID not in self.wrims:
@@ -143,29 +145,47 @@ class DetectionEngine:
             return False
         return True
 
-    def sort_evidence(self, evidences: list[Evidence]) -> list[Evidence]:
-        return sorted(
-            evidences,
-            key=lambda x: (
-                x.identity is None,
-                -x.identity if x.identity is not None else float("-inf"),
-                x.organismQuantity is None,
-                -x.organismQuantity if x.organismQuantity is not None else float("-inf")
-            )
+    def evidence_sort_key(self, evidence: Evidence) -> tuple:
+        return (
+            evidence.identity is None,
+            -evidence.identity if evidence.identity is not None else float("-inf"),
+            evidence.organismQuantity is None,
+            -evidence.organismQuantity if evidence.organismQuantity is not None else float("-inf")
         )
 
+    def sort_evidence(self, evidences: list[Evidence]) -> list[Evidence]:
+        return sorted(evidences, key=self.evidence_sort_key)
+
     def generate(self):
         """Generate detections."""
 
         occurrences = self.fetch_occurrences()
+        return self.detections_from_occurrences(occurrences)
+
+    def detections_from_occurrences(self, occurrences: list[Occurrence]) -> list[Detection]:
+        """Generate detections from occurrences which have already been fetched for this cell."""
+
+        evidences = self.collect_evidence(occurrences)
+        return self.detections_from_evidence(evidences)
+
+    def perform_assessments(self, aphiaids: set[int]) -> dict[int, Assessment]:
+        """Perform assessments for a set of taxa in a single pass."""
+
+        return assess_many(self.speedy_data, aphiaids, [self.h3], self.resolution, self.assessment_cache, self.establishment_index)[self.h3]
+
+    def candidate_evidence(self, occurrences: list[Occurrence]) -> list[Evidence]:
+        """Extract evidence from occurrences and apply the identity and WRiMS filters."""
 
         # get evidence
 
-        evidences = list(chain.from_iterable(self.evidence_for_occurrence(occurrence) for occurrence in occurrences))
+        with metrics.timer("evidence"):
+            evidences = list(chain.from_iterable(self.evidence_for_occurrence(occurrence) for occurrence in occurrences))
+        metrics.count("evidence_extracted", len(evidences))
 
         # first filtering pass (percent identity)
 
         evidences = [evidence for evidence in evidences if self.keep_evidence(evidence, check_wrims=False, assessments=None)]
+        metrics.count("evidence_kept_identity", len(evidences))
 
         # after first filtering, determine alternative identifications per evidence
         # count aphiaids per occurrence, then add count to evidences
@@ -181,88 +201,364 @@ class DetectionEngine:
         # second filtering pass (WRiMS)
 
         evidences = [evidence for evidence in evidences if self.keep_evidence(evidence, check_wrims=True, assessments=None)]
+        metrics.count("evidence_kept_wrims", len(evidences))
+
+        return evidences
+
+    def collect_evidence(self, occurrences: list[Occurrence], assessments: dict[int, Assessment] = None) -> list[Evidence]:
+        """Extract evidence from occurrences and apply the identity, WRiMS and establishment means filters."""
+
+        evidences = self.candidate_evidence(occurrences)
 
         # collect risk assessments
 
-        aphiaids = set(evidence.AphiaID for evidence in evidences)
-        assessments = dict()
-        for i, aphiaid in enumerate(aphiaids):
-            logging.info(colored(f"Performing assessment for AphiaID {aphiaid} ({i + 1} / {len(aphiaids)})", "blue"))
-            assessments[aphiaid] = self.perform_assessment(aphiaid)
+        if assessments is None:
+            aphiaids = set(evidence.AphiaID for evidence in evidences)
+            with metrics.timer("assessment"):
+                assessments = self.perform_assessments(aphiaids)
 
-        # third filtering pass and group by detection key
+        # third filtering pass (establishment means)
 
         evidences = [evidence for evidence in evidences if self.keep_evidence(evidence, check_wrims=True, assessments=assessments)]
+        metrics.count("evidence_kept_establishment", len(evidences))
+
+        return evidences
+
+    def detections_from_evidence(self, evidences: list[Evidence]) -> list[Detection]:
+        """Group filtered evidence by detection key and generate detections."""
+
+        with metrics.timer("grouping"):
+
+            # group by detection key
 
-        # group by detection key
+            grouped_evidence = self.group_evidence(evidences)
+
+            # generate detections
+
+            detections = list()
+
+            for detection_key in grouped_evidence:
+                evidences = self.sort_evidence(grouped_evidence[detection_key])
+                detections.append(self.create_detection(evidences))
+
+            # extract media from occurrence
+
+            for detection in detections:
+                self.extract_media(detection)
+
+        metrics.count("detections", len(detections))
+
+        return detections
+
+    def group_evidence(self, evidences: list[Evidence]) -> dict[str, list[Evidence]]:
 
         grouped_evidence = defaultdict(list)
         for evidence in evidences:
             grouped_evidence[evidence.get_key()].append(evidence)
+        return grouped_evidence
 
-        # generate detections
+    def create_detection(self, evidences: list[Evidence]) -> Detection:
+        """Create a detection from sorted evidence sharing a detection key."""
 
-        detections = list()
+        # collect occurrences
 
-        for detection_key in grouped_evidence:
+        occurrence_ids = set()
+        occurrences = []
+        for evidence in evidences:
+            if evidence.occurrence.id not in occurrence_ids:
+                occurrences.append(evidence.occurrence)
+                occurrence_ids.add(evidence.occurrence.id)
+
+        # create detection
+
+        detection = Detection(
+            h3=self.h3,
+            area=self.area,
+            taxon=evidences[0].AphiaID,
+            scientificName=self.wrims[evidences[0].AphiaID],
+            date=evidences[0].date,
+            target_gene=evidences[0].target_gene,
+            best_identity=evidences[0].identity,
+            best_organismQuantity=evidences[0].organismQuantity,
+            best_query_cover=evidences[0].query_cover,
+            best_alternatives=evidences[0].alternatives,
+            occurrences=occurrences,
+            confidence=None,
+            media=None
+        )
 
-            evidences = self.sort_evidence(grouped_evidence[detection_key])
-
-            # collect occurrences
-
-            occurrence_ids = set()
-            occurrences = []
-            for evidence in evidences:
-                if evidence.occurrence.id not in occurrence_ids:
-                    occurrences.append(evidence.occurrence)
-                    occurrence_ids.add(evidence.occurrence.id)
-
-            # create detection
-
-            detection = Detection(
-                h3=self.h3,
-                area=self.area,
-                taxon=evidences[0].AphiaID,
-                scientificName=self.wrims[evidences[0].AphiaID],
-                date=evidences[0].date,
-                target_gene=evidences[0].target_gene,
-                best_identity=evidences[0].identity,
-                best_organismQuantity=evidences[0].organismQuantity,
-                best_query_cover=evidences[0].query_cover,
-                best_alternatives=evidences[0].alternatives,
-                occurrences=occurrences,
-                confidence=None,
-                media=None
-            )
+        self.assign_confidence(detection)
 
-            # calculate confidence
-
-            if not detection.target_gene:
-                detection.confidence = Confidence.HIGH
-            elif detection.target_gene == "COI":
-                if detection.best_organismQuantity < 10 or detection.best_alternatives > 2 or detection.best_identity is None:
-                    detection.confidence = Confidence.LOW
-                else:
-                    detection.confidence = Confidence.MEDIUM
-            elif detection.target_gene == "18S":
-                if detection.best_organismQuantity < 10 or detection.best_alternatives > 2 or detection.best_identity is None:
-                    detection.confidence = Confidence.LOW
-                else:
-                    detection.confidence = Confidence.MEDIUM
+        return detection
+
+    def assign_confidence(self, detection: Detection) -> None:
+
+        if not detection.target_gene:
+            detection.confidence = Confidence.HIGH
+        elif detection.target_gene == "COI":
+            if detection.best_organismQuantity < 10 or detection.best_alternatives > 2 or detection.best_identity is None:
+                detection.confidence = Confidence.LOW
             else:
+                detection.confidence = Confidence.MEDIUM
+        elif detection.target_gene == "18S":
+            if detection.best_organismQuantity < 10 or detection.best_alternatives > 2 or detection.best_identity is None:
                 detection.confidence = Confidence.LOW
+            else:
+                detection.confidence = Confidence.MEDIUM
+        else:
+            detection.confidence = Confidence.LOW
 
+    def extract_media(self, detection: Detection) -> None:
+
+        media = set()
+        for occurrence in detection.occurrences:
+            if occurrence.associatedMedia is not None:
+                urls = re.findall(r'(https?://[^\s]+)', occurrence.associatedMedia)
+                media.update(urls)
+        if len(media) > 0:
+            detection.media = [Media(thumbnail=url) for url in list(media)]
+
+    def merge_detections(self, evidences: list[Evidence], state: DetectionState) -> list[Detection]:
+        """Merge new evidence into the detections stored for this cell, returning new or changed detections."""
+
+        grouped_evidence = self.group_evidence(evidences)
+        detections = list()
+
+        for detection_key in grouped_evidence:
+
+            evidences = grouped_evidence[detection_key]
+            previous = state.get_detection(self.h3, detection_key)
+
+            # the best evidence of the stored detection competes with the new evidence
+
+            if previous is not None:
+                evidences = evidences + [Evidence(
+                    AphiaID=previous.taxon,
+                    target_gene=previous.target_gene,
+                    organismQuantity=previous.best_organismQuantity,
+                    identity=previous.best_identity,
+                    query_cover=previous.best_query_cover,
+                    method=None,
+                    date=previous.date,
+                    occurrence=previous.occurrences[0],
+                    alternatives=previous.best_alternatives
+                )]
+
+            detection = self.create_detection(self.sort_evidence(evidences))
+
+            if previous is not None:
+                previous_ids = set(occurrence.id for occurrence in previous.occurrences)
+                detection.occurrences = previous.occurrences + [occurrence for occurrence in detection.occurrences if occurrence.id not in previous_ids]
+
+            self.extract_media(detection)
+
+            if state.put_detection(self.h3, detection_key, detection):
+                detections.append(detection)
+
+        return detections
+
+    def generate_incremental(self, state: DetectionState) -> list[Detection]:
+        """Generate detections from occurrences since the cell watermark, returning new or changed detections."""
+
+        watermark = state.get_watermark(self.h3)
+        start_date = datetime.fromisoformat(watermark) if watermark is not None else None
+
+        fetched = datetime.today().date().isoformat()
+        occurrences = self.fetch_occurrences(start_date=start_date)
+        if watermark is not None:
+            occurrences = [occurrence for occurrence in occurrences if occurrence.get_day() >= watermark]
+        evidences = self.collect_evidence(occurrences)
+        detections = self.merge_detections(evidences, state)
+
+        # cells without occurrences are watermarked with the fetch date, so they are not fetched in full again
+
+        days = [occurrence.get_day() for occurrence in occurrences]
+        state.set_watermark(self.h3, max(days) if len(days) > 0 else fetched)
+
+        logging.info(colored(f"Found {len(detections)} new or changed detections for cell {self.h3} since {watermark}", "blue"))
+
+        return detections
+
+    def generate_streaming(self) -> list[Detection]:
+        """Generate detections while consuming sources incrementally.
+
+        Records are consumed one at a time and only occurrences passing the identity and WRiMS filters are kept, without
+        DNA_sequence and identificationRemarks, together with the best evidence per detection key. Memory grows with the
+        number of matching occurrences, not with all records or their evidence lists.
+        """
+
+        end_date = datetime.today()
+        start_date = end_date - timedelta(days=self.days)
+
+        # per detection key: best evidence and, per occurrence, the position of its best evidence
+
+        best_evidence = dict()
+        key_occurrences = defaultdict(dict)
+        position = 0
+
+        for source in self.sources:
+            logging.info(f"Streaming data from {source}")
+            records = 0
+
+            for occurrence in source.fetch(self.shape, start_date, end_date):
+                records += 1
+
+                # first filtering pass (percent identity) and alternatives, per occurrence
+
+                evidences = [evidence for evidence in self.evidence_for_occurrence(occurrence) if self.keep_evidence(evidence, check_wrims=False, assessments=None)]
+                alternatives = len(set(evidence.AphiaID for evidence in evidences))
+
+                # second filtering pass (WRiMS)
+
+                evidences = [evidence for evidence in evidences if self.keep_evidence(evidence, check_wrims=True, assessments=None)]
+                if len(evidences) == 0:
+                    continue
+
+                compact = replace(occurrence, DNA_sequence=None, identificationRemarks=None)
+
+                for evidence in evidences:
+                    evidence.alternatives = alternatives
+                    evidence.occurrence = compact
+                    key = evidence.get_key()
+                    order = (self.evidence_sort_key(evidence), position)
+                    position += 1
+
+                    if key not in best_evidence or order < best_evidence[key][0]:
+                        best_evidence[key] = (order, evidence)
+                    if compact.id not in key_occurrences[key] or order < key_occurrences[key][compact.id][0]:
+                        key_occurrences[key][compact.id] = (order, compact)
+
+            metrics.count("occurrences_fetched", records)
+            logging.info(colored(f"Streamed {records} species occurrences between {start_date} and {end_date}", "green" if records > 0 else "red"))
+
+        # third filtering pass (establishment means)
+
+        with metrics.timer("assessment"):
+            assessments = self.perform_assessments(set(evidence.AphiaID for _, evidence in best_evidence.values()))
+
+        detections = list()
+
+        for key, (_, evidence) in best_evidence.items():
+            if not self.keep_evidence(evidence, check_wrims=True, assessments=assessments):
+                continue
+            detection = self.create_detection([evidence])
+            detection.occurrences = [occurrence for _, occurrence in sorted(key_occurrences[key].values(), key=lambda item: item[0])]
+            self.extract_media(detection)
             detections.append(detection)
 
-        # extract media from occurrence
+        metrics.count("detections", len(detections))
+
+        return detections
+
+
+class BatchDetectionEngine:
+    """Generates detections for many cells with a single occurrence fetch per source."""
+
+    def __init__(self, cells: list[str] | Geometry, resolution: int = 5, days: int = 365, sources: list[Source] = [OBISAPISource()], area: int = None, speedy_data: str = None, assessment_cache: AssessmentCache = None, area_cache: AreaCache = None, establishment_index: EstablishmentIndex = None):
+
+        area_cache = area_cache if area_cache is not None else default_area_cache
+
+        if isinstance(cells, Geometry):
+            polygons = area_cache.polygons(cells, resolution, area)
+            self.cells = list(area_cache.cells(cells, resolution, area))
+        else:
+            self.cells = list(cells)
+            resolutions = set(h3_get_resolution(cell) for cell in self.cells)
+            if len(resolutions) > 1:
+                raise ValueError("cells must all have the same resolution")
+            if len(resolutions) == 1:
+                resolution = resolutions.pop()
+            polygons = [cell_polygon(cell) for cell in self.cells]
+
+        self.resolution = resolution
+        self.days = days
+        self.sources = sources
+        self.area = area
+        self.speedy_data = speedy_data
+        self.wrims = wrims_registry()
+        self.assessment_cache = assessment_cache
+        self.establishment_index = establishment_index
+
+        # the envelope keeps the query geometry small, occurrences outside the cells are dropped when assigning cells
+
+        self.shape = envelope(polygons)
 
-        for detection in detections:
-            media = set()
-            for occurrence in detection.occurrences:
-                if occurrence.associatedMedia is not None:
-                    urls = re.findall(r'(https?://[^\s]+)', occurrence.associatedMedia)
-                    media.update(urls)
-            if len(media) > 0:
-                detection.media = [Media(thumbnail=url) for url in list(media)]
+        logging.info(f"Initializing batch detection engine for {len(self.cells)} cells (resolution {self.resolution}) going back {self.days} days")
+
+    def fetch_occurrences(self, start_date: datetime = None) -> list[Occurrence]:
+        """Fetch occurrences for the envelope of all cells from the registered sources."""
+        return fetch_occurrences(self.sources, self.shape, self.days, start_date)
+
+    def assign_cells(self, occurrences: list[Occurrence]) -> dict[str, list[Occurrence]]:
+        """Group occurrences by the cell they fall in, dropping occurrences outside of the cells."""
+
+        latitudes = [occurrence.decimalLatitude for occurrence in occurrences]
+        longitudes = [occurrence.decimalLongitude for occurrence in occurrences]
+        occurrence_cells = cells_for_points(latitudes, longitudes, self.resolution)
+
+        cells = set(self.cells)
+        cell_occurrences = defaultdict(list)
+        for occurrence, cell in zip(occurrences, occurrence_cells):
+            if cell in cells:
+                cell_occurrences[cell].append(occurrence)
+
+        return cell_occurrences
+
+    def generate(self, state: DetectionState = None) -> dict[str, list[Detection]]:
+        """Generate detections, grouped by cell. With a state, only new or changed detections since the cell watermarks are returned."""
+
+        # with a state, fetch from the earliest watermark and drop occurrences before each cell's watermark, cells
+        # which were never processed need the full window
+
+        watermarks = {cell: state.get_watermark(cell) for cell in self.cells} if state is not None else dict()
+        start_date = None
+        if len(watermarks) > 0 and all(watermark is not None for watermark in watermarks.values()):
+            start_date = datetime.fromisoformat(min(watermarks.values()))
+
+        fetched = datetime.today().date().isoformat()
+        occurrences = self.fetch_occurrences(start_date=start_date)
+        cell_occurrences = self.assign_cells(occurrences)
+
+        if state is not None:
+            for cell, watermark in watermarks.items():
+                if watermark is not None and cell in cell_occurrences:
+                    cell_occurrences[cell] = [occurrence for occurrence in cell_occurrences[cell] if occurrence.get_day() >= watermark]
+
+        # candidate evidence per cell
+
+        engines = dict()
+        cell_evidences = dict()
+
+        for cell in cell_occurrences:
+            engines[cell] = DetectionEngine(h3=cell, days=self.days, sources=[], area=self.area, speedy_data=self.speedy_data, wrims=self.wrims, assessment_cache=self.assessment_cache, establishment_index=self.establishment_index)
+            cell_evidences[cell] = engines[cell].candidate_evidence(cell_occurrences[cell])
+
+        # assess all candidate taxa for all cells at once
+
+        aphiaids = set(evidence.AphiaID for evidences in cell_evidences.values() for evidence in evidences)
+        with metrics.timer("assessment"):
+            assessments = assess_many(self.speedy_data, aphiaids, list(cell_evidences.keys()), self.resolution, self.assessment_cache, self.establishment_index) if len(aphiaids) > 0 else dict()
+
+        # filter and generate detections per cell
+
+        detections = dict()
+
+        for i, cell in enumerate(self.cells):
+            logging.info(colored(f"Generating detections for cell {cell} ({i + 1} / {len(self.cells)})", "blue"))
+            if cell not in cell_evidences:
+                detections[cell] = []
+                if state is not None:
+                    state.set_watermark(cell, fetched)
+                continue
+            engine = engines[cell]
+            cell_assessments = assessments.get(cell, dict())
+            evidences = [evidence for evidence in cell_evidences[cell] if engine.keep_evidence(evidence, check_wrims=True, assessments=cell_assessments)]
+            metrics.count("evidence_kept_establishment", len(evidences))
+            if state is not None:
+                detections[cell] = engine.merge_detections(evidences, state)
+                days = [occurrence.get_day() for occurrence in cell_occurrences[cell]]
+                state.set_watermark(cell, max(days) if len(days) > 0 else fetched)
+            else:
+                detections[cell] = engine.detections_from_evidence(evidences)
 
         return detections
@@ -1,52 +1,202 @@
-from pacmandetections import DetectionEngine
+from pacmandetections import BatchDetectionEngine
 from pacmandetections.risk import RiskEngine
+from pacmandetections.runner import ParallelDetectionRunner
+from pacmandetections.assessment import AssessmentCache, speedy_data_version
+from pacmandetections.sources import OBISAPISource, ShardedOBISAPISource, ParquetOccurrenceSource, GBIFSource
+from pacmandetections.cache import PageCache
+from pacmandetections.state import DetectionState
 from pacmandetections.connectors import PortalDetectionConnector, PortalRiskAnalysisConnector
+from pacmandetections.metrics import metrics, profile
+from pacmandetections.geometry import AreaCache
+from pacmandetections.jobs import JobStore, JobStatus
+from pacmandetections.ledger import SubmissionLedger
+from pacmandetections.portal import PortalMetadataClient
+from pacmandetections.establishment import load_current_index
+from pacmandetections.taxa import wrims_registry
+from contextlib import nullcontext
+from datetime import timedelta
+from typing import Generator
+import traceback
 from dotenv import load_dotenv
+import argparse
 import logging
-import importlib.resources
 import geopandas as gpd
-from h3pandas.util.shapely import polyfill
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
 
 
-def detections():
+def job_chunks(store: JobStore, run: str, units: list, chunk_size: int, retry_failed: bool = False) -> Generator[list[str], None, None]:
+    """Register the work units of a run and lease them in chunks, or yield all units at once without a job store."""
+
+    if store is None:
+        yield [str(unit) for unit in units]
+        return
+
+    if retry_failed:
+        logging.info(f"Retrying {store.retry_failed(run)} failed units for {run}")
+    added = store.add(run, units)
+    logging.info(f"Added {added} units to {run}")
+
+    while len(chunk := store.lease(run, limit=chunk_size)) > 0:
+        yield chunk
+
+    counts = store.counts(run)
+    logging.info(f"Finished leasing {run}: {counts[JobStatus.DONE]} done, {counts[JobStatus.FAILED]} failed, {counts[JobStatus.LEASED]} leased by other workers")
+
+
+def record_units(store: JobStore, run: str, units: list, failed: list = [], error: str = None) -> None:
+    if store is None:
+        return
+    failed = set(str(unit) for unit in failed)
+    store.complete(run, [unit for unit in units if str(unit) not in failed])
+    if len(failed) > 0:
+        store.fail(run, list(failed), error)
+
+
+def detections(workers: int = None, assessment_cache: str = None, page_cache: str = None, page_ttl: float = 12, closed_ttl: float = 14, offline: bool = False, incremental: str = None, fetch_workers: int = None, columnar: bool = False, streaming: bool = False, parquet: str = None, gbif: str = None, area_cache: str = None, jobs: str = None, retry_failed: bool = False, chunk_size: int = 100, ledger: str = None, portal_cache: str = None, establishment_index: str = None, assessment_ttl: int = None, run_id: str = None, lease_timeout: float = 1):
 
     load_dotenv()
-    connector = PortalDetectionConnector()
+    speedy_data = "~/Desktop/werk/speedy/speedy_data"
+    assessment_cache_ttl = timedelta(days=assessment_ttl) if assessment_ttl else None
+    speedy_version = speedy_data_version(speedy_data) if assessment_cache or establishment_index else None
+    assessment_cache_version = speedy_version if assessment_cache else None
+    cache = PageCache(page_cache, ttl=timedelta(hours=page_ttl), closed_ttl=timedelta(days=closed_ttl), offline=offline) if page_cache else None
+    if parquet:
+        sources = [ParquetOccurrenceSource(parquet)]
+    elif fetch_workers:
+        sources = [ShardedOBISAPISource(cache=cache, max_workers=fetch_workers)]
+    else:
+        sources = [OBISAPISource(cache=cache)]
+    if gbif:
+        sources.append(GBIFSource(gbif))
+    connector = PortalDetectionConnector(ledger=SubmissionLedger(ledger) if ledger else None, portal=PortalMetadataClient(path=portal_cache, offline=offline))
 
     area = connector.fetch_area(1)
     gs = gpd.GeoSeries.from_wkt([area.get("wkt")])
-    cells = list(polyfill(gs[0], 5, geo_json=True))
+    cells = AreaCache(area_cache).cells(gs[0], 5, area=1)
 
-    for cell in ["859b41b3fffffff"]:
-        engine = DetectionEngine(h3=cell, speedy_data="~/Desktop/werk/speedy/speedy_data", days=365*5, area=1)
-        detections = engine.generate()
-        connector.submit(detections)
+    store = JobStore(jobs, lease_timeout=timedelta(hours=lease_timeout)) if jobs else None
+    run = f"detections:1:{run_id}"
 
+    index = load_current_index(establishment_index, speedy_version) if establishment_index else None
+    if index is None:
+        establishment_index = None
 
-def risk():
+    # the process pool is created once and kept warm across leased chunks
 
-    load_dotenv()
+    runner = ParallelDetectionRunner(workers=workers, sources=sources, speedy_data=speedy_data, days=365*5, area=1, assessment_cache_path=assessment_cache, assessment_cache_ttl=assessment_cache_ttl, assessment_cache_version=assessment_cache_version, state_path=incremental, columnar=columnar, streaming=streaming, establishment_index_path=establishment_index) if workers else None
+
+    with runner if runner is not None else nullcontext():
+        for chunk in job_chunks(store, run, cells, chunk_size, retry_failed):
+            if runner is not None:
+                for result in runner.run(chunk):
+                    if result.error is not None:
+                        record_units(store, run, [result.cell], failed=[result.cell], error=result.error)
+                        continue
+                    summary = connector.submit(result.detections)
+                    record_units(store, run, [result.cell], failed=[result.cell] if summary.failed > 0 else [], error=summary.errors[0] if summary.errors else None)
+            else:
+                engine = BatchDetectionEngine(cells=chunk, sources=sources, speedy_data=speedy_data, days=365*5, area=1, assessment_cache=AssessmentCache(path=assessment_cache, version=assessment_cache_version, ttl=assessment_cache_ttl), establishment_index=index)
+                state = DetectionState(incremental) if incremental else None
+                try:
+                    cell_detections = engine.generate(state=state)
+                except Exception:
+                    if store is None:
+                        raise
+                    logging.error(f"Failed to generate detections for {len(chunk)} cells")
+                    record_units(store, run, chunk, failed=chunk, error=traceback.format_exc())
+                    continue
+                for cell, detections in cell_detections.items():
+                    summary = connector.submit(detections)
+                    record_units(store, run, [cell], failed=[cell] if summary.failed > 0 else [], error=summary.errors[0] if summary.errors else None)
+
+
+def ingest_gbif(store: str, download: str):
 
-    with importlib.resources.open_text("pacmandetections.data", "wrims_aphiaids.txt") as f:
-        lines = [line.strip().split("\t") for line in f.readlines()]
-        wrims = {int(line[0].strip()): line[1] for line in lines}
+    source = GBIFSource(store)
+    source.ingest(download)
+
+
+def risk(area_cache: str = None, jobs: str = None, retry_failed: bool = False, chunk_size: int = 100, ledger: str = None, portal_cache: str = None, offline: bool = False, run_id: str = None, lease_timeout: float = 1):
+
+    load_dotenv()
 
-    engine = RiskEngine(speedy_data="~/Desktop/werk/speedy/speedy_data", area=1, shape="POLYGON ((176.231689 -19.580493, 176.231689 -15.496032, 179.978027 -15.496032, 179.978027 -19.580493, 176.231689 -19.580493))")
+    store = JobStore(jobs, lease_timeout=timedelta(hours=lease_timeout)) if jobs else None
+    run = f"risk:1:{run_id}"
+    connector = PortalRiskAnalysisConnector(ledger=SubmissionLedger(ledger) if ledger else None)
 
-    for taxon_id in wrims.keys():
-        logging.info(f"Calculating risk for {taxon_id}")
-        analysis = engine.calculate_risk(taxon_id)
-        connector = PortalRiskAnalysisConnector()
-        connector.submit([analysis])
+    with RiskEngine(speedy_data="~/Desktop/werk/speedy/speedy_data", area=1, area_cache=AreaCache(area_cache), portal=PortalMetadataClient(path=portal_cache, offline=offline), shape="POLYGON ((176.231689 -19.580493, 176.231689 -15.496032, 179.978027 -15.496032, 179.978027 -19.580493, 176.231689 -19.580493))") as engine:
+        for chunk in job_chunks(store, run, wrims_registry().keys(), chunk_size, retry_failed):
+            try:
+                analyses = engine.calculate_all([int(taxon) for taxon in chunk])
+            except Exception:
+                if store is None:
+                    raise
+                logging.error(f"Failed to calculate risk for {len(chunk)} taxa")
+                record_units(store, run, chunk, failed=chunk, error=traceback.format_exc())
+                continue
+            summary = connector.submit(analyses)
+            record_units(store, run, chunk, failed=[analysis.taxon for analysis in summary.failed_items], error=summary.errors[0] if summary.errors else None)
 
 
 def main():
 
-    # risk()
-    detections()
+    parser = argparse.ArgumentParser(prog="pacmandetections")
+    parser.add_argument("command", nargs="?", choices=["detections", "risk", "gbif"], default="detections")
+    parser.add_argument("--workers", type=int, default=None, help="generate detections per cell in a process pool with this many workers")
+    parser.add_argument("--assessment-cache", default=None, help="SQLite file backing the assessment cache across runs")
+    parser.add_argument("--assessment-ttl", type=int, default=None, help="days after which persisted assessments are recomputed, in addition to recomputing when the Speedy data changes")
+    parser.add_argument("--page-cache", default=None, help="directory for caching OBIS API pages")
+    parser.add_argument("--page-ttl", type=float, default=12, help="hours after which cached pages of recent months are fetched again")
+    parser.add_argument("--closed-ttl", type=float, default=14, help="days after which cached pages of months older than 30 days are fetched again")
+    parser.add_argument("--offline", action="store_true", help="only use cached OBIS API pages and portal snapshots")
+    parser.add_argument("--incremental", default=None, help="SQLite state file, only process occurrences since the last run and submit new or changed detections")
+    parser.add_argument("--fetch-workers", type=int, default=None, help="fetch monthly OBIS API shards concurrently with this many threads")
+    parser.add_argument("--columnar", action="store_true", help="use the columnar evidence pipeline in the process pool runner")
+    parser.add_argument("--streaming", action="store_true", help="generate detections with bounded memory in the process pool runner, without sequences and remarks")
+    parser.add_argument("--parquet", default=None, help="read occurrences from a local OBIS Parquet export instead of the OBIS API")
+    parser.add_argument("--gbif", default=None, help="GBIF store to read occurrences from in addition to OBIS, or to ingest into with the gbif command")
+    parser.add_argument("--download", default=None, help="GBIF occurrence download (DwC-A or SIMPLE_PARQUET) to ingest with the gbif command")
+    parser.add_argument("--area-cache", default=None, help="directory for caching area cells and cell polygons across runs")
+    parser.add_argument("--jobs", default=None, help="SQLite job state file, to resume runs and share work between processes or machines")
+    parser.add_argument("--run", default=None, help="run id in the job state file, runs with the same id are resumed, required with --jobs")
+    parser.add_argument("--lease-timeout", type=float, default=1, help="hours after which units leased by a worker which did not finish them are handed out again")
+    parser.add_argument("--retry-failed", action="store_true", help="retry the failed units of a run in the job state file")
+    parser.add_argument("--chunk-size", type=int, default=100, help="number of cells or taxa leased at once from the job state file")
+    parser.add_argument("--ledger", default=None, help="SQLite submission ledger, only new or changed detections and risk analyses are submitted")
+    parser.add_argument("--portal-cache", default=None, help="directory for snapshots of portal areas and priority lists")
+    parser.add_argument("--establishment-index", default=None, help="establishment index built with pacmandetections.establishment, used instead of Speedy summaries for indexed taxa")
+    parser.add_argument("--metrics-report", default=None, help="write stage timings, counters and cache hit rates to this JSON file")
+    parser.add_argument("--prometheus", default=None, help="write metrics in Prometheus text format to this file")
+    parser.add_argument("--profile", default=None, help="profile the run and write the result to this file")
+    parser.add_argument("--profiler", choices=["cprofile", "pyinstrument"], default="cprofile", help="profiler used with --profile")
+    args = parser.parse_args()
+
+    if args.jobs and not args.run:
+        parser.error("--jobs requires --run, so the run can be resumed")
+    if args.columnar and not args.workers:
+        parser.error("--columnar requires --workers")
+    if args.streaming and not args.workers:
+        parser.error("--streaming requires --workers")
+    if args.streaming and args.incremental:
+        parser.error("--streaming cannot be combined with --incremental")
+
+    with profile(args.profile, args.profiler) if args.profile else nullcontext():
+        with metrics.timer("total"):
+            if args.command == "risk":
+                risk(area_cache=args.area_cache, jobs=args.jobs, retry_failed=args.retry_failed, chunk_size=args.chunk_size, ledger=args.ledger, portal_cache=args.portal_cache, offline=args.offline, run_id=args.run, lease_timeout=args.lease_timeout)
+            elif args.command == "gbif":
+                if not args.gbif or not args.download:
+                    parser.error("the gbif command requires --gbif and --download")
+                ingest_gbif(args.gbif, args.download)
+            else:
+                detections(workers=args.workers, assessment_cache=args.assessment_cache, page_cache=args.page_cache, page_ttl=args.page_ttl, closed_ttl=args.closed_ttl, offline=args.offline, incremental=args.incremental, fetch_workers=args.fetch_workers, columnar=args.columnar, streaming=args.streaming, parquet=args.parquet, gbif=args.gbif, area_cache=args.area_cache, jobs=args.jobs, retry_failed=args.retry_failed, chunk_size=args.chunk_size, ledger=args.ledger, portal_cache=args.portal_cache, establishment_index=args.establishment_index, assessment_ttl=args.assessment_ttl, run_id=args.run, lease_timeout=args.lease_timeout)
+
+    if args.metrics_report:
+        metrics.write_json(args.metrics_report)
+    if args.prometheus:
+        metrics.write_prometheus(args.prometheus)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,256 @@
+from collections import OrderedDict
+from datetime import timedelta
+from speedy import Speedy
+from typing import TYPE_CHECKING, Generator
+import duckdb
+import logging
+import pandas as pd
+import os
+import sqlite3
+import threading
+import time
+from pacmandetections.metrics import metrics
+from pacmandetections.model import Assessment, EstablishmentMeans
+from pacmandetections.util import SQLiteConnection
+
+if TYPE_CHECKING:
+    from pacmandetections.establishment import EstablishmentIndex
+
+
+speedy_handles = dict()
+speedy_versions = dict()
+speedy_lock = threading.Lock()
+
+
+def get_speedy(data_dir: str, h3_resolution: int = 7) -> Speedy:
+    """Get the process wide Speedy handle for a data directory and resolution."""
+
+    key = (os.path.expanduser(data_dir), h3_resolution)
+    with speedy_lock:
+        if key not in speedy_handles:
+            logging.info(f"Creating Speedy handle for {key[0]} (resolution {h3_resolution})")
+            speedy_handles[key] = Speedy(h3_resolution=h3_resolution, data_dir=key[0], cache_summary=True)
+        return speedy_handles[key]
+
+
+def speedy_files(data_dir: str) -> Generator[tuple[str, float], None, None]:
+    """Get the paths relative to a Speedy data directory and the modification times of its files."""
+
+    data_dir = os.path.expanduser(data_dir)
+    for root, _, files in os.walk(data_dir):
+        for name in files:
+            file = os.path.join(root, name)
+            try:
+                yield os.path.relpath(file, data_dir), os.path.getmtime(file)
+            except OSError:
+                continue
+
+
+def speedy_data_version(data_dir: str, refresh: bool = False) -> str | None:
+    """Get a version stamp for a Speedy data directory, the latest modification time of its files.
+
+    Stamps are kept per process, with refresh the data directory is checked again.
+    """
+
+    if data_dir is None:
+        return None
+    data_dir = os.path.expanduser(data_dir)
+    with speedy_lock:
+        if data_dir in speedy_versions and not refresh:
+            return speedy_versions[data_dir]
+
+    latest = max((mtime for _, mtime in speedy_files(data_dir)), default=None)
+    version = None if latest is None else f"{latest:.0f}"
+
+    with speedy_lock:
+        speedy_versions[data_dir] = version
+    return version
+
+
+def drop_unversioned_assessments(conn: sqlite3.Connection) -> None:
+
+    # cache files from before assessments were stamped with the Speedy data version
+
+    columns = [row[1] for row in conn.execute("pragma table_info(assessment)").fetchall()]
+    if len(columns) > 0 and "version" not in columns:
+        conn.execute("drop table assessment")
+
+
+class AssessmentCache:
+    """LRU cache of assessments keyed by AphiaID, H3 cell and resolution, optionally backed by a SQLite file.
+
+    Persisted assessments are stamped with the Speedy data version and creation time, rows from another version
+    or older than ttl are ignored.
+    """
+
+    def __init__(self, maxsize: int = 100000, path: str = None, version: str = None, ttl: timedelta = None):
+        self.maxsize = maxsize
+        self.path = os.path.expanduser(path) if path else None
+        self.version = version
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = SQLiteConnection(self.path, ["create table if not exists assessment (aphiaid integer, h3 text, resolution integer, establishmentMeans text, version text, created real, primary key (aphiaid, h3, resolution))"], setup=drop_unversioned_assessments, timeout=30, check_same_thread=False) if self.path else None
+
+    def connection(self) -> sqlite3.Connection:
+        return self.db.get()
+
+    def min_created(self) -> float:
+        return time.time() - self.ttl.total_seconds() if self.ttl is not None else 0
+
+    def get(self, aphiaid: int, h3: str, resolution: int) -> Assessment | None:
+        return self.get_many([aphiaid], [h3], resolution).get((aphiaid, h3))
+
+    def get_many(self, aphiaids: list[int], cells: list[str], resolution: int) -> dict[tuple[int, str], Assessment]:
+        """Get cached assessments for all combinations of taxa and cells, keyed by (AphiaID, cell)."""
+
+        found = dict()
+        wanted = set()
+
+        with self.lock:
+            for aphiaid in aphiaids:
+                for cell in cells:
+                    key = (aphiaid, cell, resolution)
+                    if key in self.items:
+                        self.items.move_to_end(key)
+                        found[(aphiaid, cell)] = self.items[key]
+                    else:
+                        wanted.add((aphiaid, cell))
+
+            if self.path is not None and len(wanted) > 0:
+                conn = self.connection()
+                wanted_cells = sorted(set(cell for _, cell in wanted))
+                for i in range(0, len(wanted_cells), 500):
+                    batch = wanted_cells[i:i + 500]
+                    rows = conn.execute(
+                        f"select aphiaid, h3, establishmentMeans from assessment where resolution = ? and version is ? and created >= ? and h3 in ({', '.join('?' * len(batch))})",
+                        (resolution, self.version, self.min_created(), *batch)
+                    ).fetchall()
+                    for aphiaid, cell, establishmentMeans in rows:
+                        if (aphiaid, cell) in wanted:
+                            assessment = Assessment(establishmentMeans=EstablishmentMeans(establishmentMeans))
+                            self.remember((aphiaid, cell, resolution), assessment)
+                            found[(aphiaid, cell)] = assessment
+
+            hits = len(found)
+            misses = len(aphiaids) * len(cells) - hits
+            self.hits += hits
+            self.misses += misses
+
+        metrics.count("assessment_cache_hits", hits)
+        metrics.count("assessment_cache_misses", misses)
+        return found
+
+    def put(self, aphiaid: int, h3: str, resolution: int, assessment: Assessment) -> None:
+        self.put_many(resolution, {(aphiaid, h3): assessment})
+
+    def put_many(self, resolution: int, assessments: dict[tuple[int, str], Assessment]) -> None:
+        """Store assessments keyed by (AphiaID, cell), with a single commit."""
+
+        with self.lock:
+            for (aphiaid, cell), assessment in assessments.items():
+                self.remember((aphiaid, cell, resolution), assessment)
+            if self.path is not None and len(assessments) > 0:
+                conn = self.connection()
+                now = time.time()
+                conn.executemany("insert or replace into assessment values (?, ?, ?, ?, ?, ?)", [(aphiaid, cell, resolution, assessment.establishmentMeans.value, self.version, now) for (aphiaid, cell), assessment in assessments.items()])
+                conn.commit()
+
+    def remember(self, key: tuple, assessment: Assessment) -> None:
+        self.items[key] = assessment
+        self.items.move_to_end(key)
+        while len(self.items) > self.maxsize:
+            self.items.popitem(last=False)
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total > 0 else 0.0
+
+
+default_assessment_cache = AssessmentCache()
+
+
+def assess_many(speedy_data: str, aphiaids: set[int], cells: list[str], resolution: int, cache: AssessmentCache = None, index: "EstablishmentIndex" = None) -> dict[str, dict[int, Assessment]]:
+    """Assess establishment means for all combinations of taxa and cells, reading each taxon summary once."""
+
+    cache = cache if cache is not None else default_assessment_cache
+    assessments = {cell: dict() for cell in cells}
+
+    # serve indexed taxa from the establishment index
+
+    if index is not None:
+        indexed = [aphiaid for aphiaid in aphiaids if index.indexed(aphiaid, resolution)]
+        if len(indexed) > 0:
+            for cell, cell_assessments in index.assess_many(cells, indexed).items():
+                assessments[cell].update(cell_assessments)
+            aphiaids = set(aphiaids) - set(indexed)
+
+    # serve from cache where possible
+
+    cached = cache.get_many(list(aphiaids), cells, resolution)
+    missing = set()
+    for aphiaid in aphiaids:
+        for cell in cells:
+            if (assessment := cached.get((aphiaid, cell))) is not None:
+                assessments[cell][aphiaid] = assessment
+            else:
+                missing.add(aphiaid)
+
+    if len(missing) == 0:
+        return assessments
+
+    logging.info(f"Performing assessment for {len(missing)} taxa in {len(cells)} cells")
+
+    # collect summary rows for the requested cells
+
+    sp = get_speedy(speedy_data)
+    cell_set = set(cells)
+    frames = []
+    for aphiaid in missing:
+        with metrics.timer("speedy_summary"):
+            summary = sp.get_summary(aphiaid, resolution=resolution, as_geopandas=False)
+        summary = summary[summary["h3"].isin(cell_set)][["h3", "establishmentMeans_native", "establishmentMeans_introduced"]]
+        if len(summary) > 0:
+            frames.append(summary.assign(AphiaID=aphiaid))
+
+    if len(frames) > 0:
+        summaries = pd.concat(frames, ignore_index=True)
+    else:
+        summaries = pd.DataFrame({"AphiaID": pd.Series(dtype="int64"), "h3": pd.Series(dtype="string"), "establishmentMeans_native": pd.Series(dtype="bool"), "establishmentMeans_introduced": pd.Series(dtype="bool")})
+
+    conn = duckdb.connect()
+    conn.register("summary", summaries)
+    rows = conn.execute("""
+        select
+            AphiaID,
+            h3,
+            coalesce(bool_or(establishmentMeans_introduced), false) as introduced,
+            coalesce(bool_or(establishmentMeans_native), false) as native
+        from summary
+        group by AphiaID, h3
+    """).fetchall()
+    conn.close()
+
+    found = {(int(aphiaid), h3): (introduced, native) for aphiaid, h3, introduced, native in rows}
+
+    new_assessments = dict()
+    for aphiaid in missing:
+        for cell in cells:
+            if aphiaid in assessments[cell]:
+                continue
+            introduced, native = found.get((aphiaid, cell), (False, False))
+            if introduced:
+                establishmentMeans = EstablishmentMeans.INTRODUCED
+            elif native:
+                establishmentMeans = EstablishmentMeans.NATIVE
+            else:
+                establishmentMeans = EstablishmentMeans.UNCERTAIN
+            assessment = Assessment(establishmentMeans=establishmentMeans)
+            new_assessments[(aphiaid, cell)] = assessment
+            assessments[cell][aphiaid] = assessment
+
+    cache.put_many(resolution, new_assessments)
+
+    return assessments
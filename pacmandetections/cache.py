@@ -0,0 +1,65 @@
+from datetime import timedelta
+from pacmandetections.metrics import metrics
+from pacmandetections.util import atomic_write
+import gzip
+import hashlib
+import json
+import logging
+import os
+import time
+
+
+class PageCache:
+    """On-disk cache of OBIS API result pages, stored as gzipped JSON.
+
+    Pages for closed historical windows expire after closed_ttl, pages for windows that may
+    still receive data expire after ttl. Closed windows still expire, records are often
+    published months late (eDNA in particular). In offline mode only cached pages are served.
+    """
+
+    def __init__(self, path: str, ttl: timedelta = timedelta(hours=12), closed_ttl: timedelta = timedelta(days=14), closed_after: timedelta = timedelta(days=30), offline: bool = False):
+        self.path = os.path.expanduser(path)
+        self.ttl = ttl
+        self.closed_ttl = closed_ttl
+        self.closed_after = closed_after
+        self.offline = offline
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, wkt: str, start_date: str, end_date: str, after) -> str:
+        return hashlib.sha1(f"{wkt}|{start_date}|{end_date}|{after}".encode()).hexdigest()
+
+    def file(self, key: str) -> str:
+        return os.path.join(self.path, key[0:2], f"{key}.json.gz")
+
+    def get(self, key: str, closed: bool = False) -> list[dict] | None:
+
+        file = self.file(key)
+        if not os.path.exists(file):
+            self.misses += 1
+            metrics.count("page_cache_misses")
+            return None
+
+        ttl = self.closed_ttl if closed else self.ttl
+        if not self.offline and ttl is not None and time.time() - os.path.getmtime(file) > ttl.total_seconds():
+            self.misses += 1
+            metrics.count("page_cache_misses")
+            return None
+
+        try:
+            with gzip.open(file, "rt", encoding="utf-8") as f:
+                results = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logging.warning(f"Ignoring unreadable cached page {file}")
+            self.misses += 1
+            metrics.count("page_cache_misses")
+            return None
+
+        self.hits += 1
+        metrics.count("page_cache_hits")
+        return results
+
+    def put(self, key: str, results: list[dict]) -> None:
+
+        with atomic_write(self.file(key), "wt", opener=gzip.open, encoding="utf-8") as f:
+            json.dump(results, f)
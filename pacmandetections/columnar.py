@@ -0,0 +1,152 @@
+from pacmandetections import DetectionEngine
+from pacmandetections.metrics import metrics
+from pacmandetections.model import Detection, EstablishmentMeans, Occurrence
+from pacmandetections.util import aphiaid_from_lsid
+import logging
+import numpy as np
+import pandas as pd
+
+
+def none_if_missing(value):
+    return None if value is None or (isinstance(value, float) and np.isnan(value)) else value
+
+
+class ColumnarDetectionEngine(DetectionEngine):
+    """Detection engine which holds evidence in a single table and filters and groups it with vectorized operations.
+
+    Produces the same detections as DetectionEngine.
+    """
+
+    def evidence_table(self, occurrences: list[Occurrence]) -> pd.DataFrame:
+        """Build the evidence table, with one row per identification and a reference to the occurrence by index."""
+
+        occurrence_index = []
+        aphiaids = []
+        identities = []
+        query_covers = []
+        methods = []
+
+        for i, occurrence in enumerate(occurrences):
+
+            # main identification
+
+            occurrence_index.append(i)
+            aphiaids.append(occurrence.AphiaID)
+            identities.append(None)
+            query_covers.append(None)
+            methods.append(None)
+
+            # identificationRemarks
+
+            for annotation in self.parse_annotations(occurrence):
+                occurrence_index.append(i)
+                aphiaids.append(aphiaid_from_lsid(annotation["scientificNameID"]))
+                identities.append(annotation.get("identity"))
+                query_covers.append(annotation.get("query_cover"))
+                methods.append(annotation.get("method"))
+
+        occurrence_index = np.array(occurrence_index, dtype=np.int64)
+
+        # occurrence level columns are gathered once and broadcast to the evidence rows
+
+        occurrence_ids = np.array([occurrence.id for occurrence in occurrences], dtype=object)
+        target_genes = np.array([occurrence.target_gene for occurrence in occurrences], dtype=object)
+        quantities = np.array([occurrence.organismQuantity for occurrence in occurrences], dtype=object)
+        days = np.array([occurrence.get_day() for occurrence in occurrences], dtype=object)
+
+        return pd.DataFrame({
+            "occurrence": occurrence_index,
+            "occurrence_id": occurrence_ids[occurrence_index] if len(occurrences) > 0 else np.array([], dtype=object),
+            # missing AphiaIDs are -1 so they count as a distinct alternative, as None does in DetectionEngine
+            "AphiaID": np.array([-1 if aphiaid is None else aphiaid for aphiaid in aphiaids], dtype=np.int64),
+            "target_gene": target_genes[occurrence_index] if len(occurrences) > 0 else np.array([], dtype=object),
+            "organismQuantity": quantities[occurrence_index] if len(occurrences) > 0 else np.array([], dtype=object),
+            "identity": np.array(identities, dtype=object),
+            "query_cover": np.array(query_covers, dtype=object),
+            "method": np.array(methods, dtype=object),
+            "date": days[occurrence_index] if len(occurrences) > 0 else np.array([], dtype=object)
+        })
+
+    def filter_evidence_table(self, table: pd.DataFrame) -> pd.DataFrame:
+        """Apply the identity, WRiMS and establishment means filters and determine alternatives."""
+
+        # first filtering pass (percent identity)
+
+        identity = pd.to_numeric(table["identity"], errors="coerce")
+        table = table[~((table["method"] == "VSEARCH") & (identity < 0.99))]
+
+        # alternative identifications per occurrence
+
+        table = table.assign(alternatives=table.groupby("occurrence_id", dropna=False)["AphiaID"].transform("nunique"))
+
+        # second filtering pass (WRiMS)
+
+        table = table[self.wrims.isin(table["AphiaID"].to_numpy())]
+
+        # third filtering pass (establishment means)
+
+        aphiaids = set(int(aphiaid) for aphiaid in table["AphiaID"].unique())
+        with metrics.timer("assessment"):
+            assessments = self.perform_assessments(aphiaids)
+        if assessments:
+            allowed = [aphiaid for aphiaid, assessment in assessments.items() if assessment.establishmentMeans in (EstablishmentMeans.INTRODUCED, EstablishmentMeans.UNCERTAIN)]
+            table = table[table["AphiaID"].isin(allowed)]
+
+        return table
+
+    def detections_from_occurrences(self, occurrences: list[Occurrence]) -> list[Detection]:
+
+        with metrics.timer("evidence"):
+            table = self.evidence_table(occurrences)
+        metrics.count("evidence_extracted", len(table))
+        logging.info(f"Built evidence table with {len(table)} rows for {len(occurrences)} occurrences")
+        table = self.filter_evidence_table(table)
+        metrics.count("evidence_kept_establishment", len(table))
+
+        if len(table) == 0:
+            return []
+
+        # groups are numbered in order of first appearance, evidence is sorted within groups like sort_evidence
+
+        identity = pd.to_numeric(table["identity"], errors="coerce")
+        quantity = pd.to_numeric(table["organismQuantity"], errors="coerce")
+
+        table = table.assign(
+            group=table.groupby(["AphiaID", "target_gene", "date"], sort=False, dropna=False).ngroup(),
+            identity_missing=table["identity"].isna(),
+            identity_order=-identity.fillna(0),
+            quantity_missing=table["organismQuantity"].isna(),
+            quantity_order=-quantity.fillna(0),
+            position=np.arange(len(table))
+        )
+        table = table.sort_values(["group", "identity_missing", "identity_order", "quantity_missing", "quantity_order", "position"])
+
+        best = table.groupby("group", sort=True).head(1)
+        group_occurrences = table.drop_duplicates(["group", "occurrence_id"]).groupby("group", sort=True)["occurrence"].agg(list)
+
+        detections = list()
+
+        for row, occurrence_index in zip(best.to_dict(orient="records"), group_occurrences):
+            taxon = int(row["AphiaID"])
+            detection = Detection(
+                h3=self.h3,
+                area=self.area,
+                taxon=taxon,
+                scientificName=self.wrims[taxon],
+                date=row["date"],
+                target_gene=none_if_missing(row["target_gene"]),
+                best_identity=none_if_missing(row["identity"]),
+                best_organismQuantity=none_if_missing(row["organismQuantity"]),
+                best_query_cover=none_if_missing(row["query_cover"]),
+                best_alternatives=int(row["alternatives"]),
+                occurrences=[occurrences[i] for i in occurrence_index],
+                confidence=None,
+                media=None
+            )
+            self.assign_confidence(detection)
+            self.extract_media(detection)
+            detections.append(detection)
+
+        metrics.count("detections", len(detections))
+
+        return detections
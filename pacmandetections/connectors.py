@@ -1,40 +1,225 @@
 from pacmandetections import Detection
 from pacmandetections.risk import RiskAnalysis
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pacmandetections.metrics import metrics
+from pacmandetections.ledger import SubmissionLedger, content_hash
+from pacmandetections.portal import PortalMetadataClient
+from pacmandetections.util import create_session
+from time import perf_counter
+import json
 import requests
 import os
 import logging
 
 
-class PortalDetectionConnector:
+def list_rejected(res: requests.Response) -> bool:
+    """Check if a 400 response rejects the list payload itself, like Django REST framework does for single item endpoints."""
 
-    def __init__(self, endpoint="http://127.0.0.1:8000/api"):
+    try:
+        body = res.json()
+    except ValueError:
+        return False
+    if not isinstance(body, dict):
+        return False
+    errors = body.get("non_field_errors", body.get("detail", ""))
+    return "got list" in str(errors).lower()
+
+
+def item_errors(res: requests.Response, batch: list) -> list | None:
+    """Get the validation errors per item of a rejected batch, if the portal reports them per item."""
+
+    try:
+        body = res.json()
+    except ValueError:
+        return None
+    if not isinstance(body, list) or len(body) != len(batch):
+        return None
+    return body
+
+
+@dataclass
+class SubmissionSummary:
+    submitted: int = 0
+    failed: int = 0
+    errors: list[str] = field(default_factory=list)
+    failed_items: list = field(default_factory=list)
+    new: int = 0
+    changed: int = 0
+    unchanged: int = 0
+
+
+class PortalConnector(ABC):
+
+    def __init__(self, endpoint="http://127.0.0.1:8000/api", bulk: bool = False, batch_size: int = 100, concurrency: int = 8, retries: int = 3, ledger: SubmissionLedger = None, timeout: float = 60):
         self.endpoint = endpoint
+        self.timeout = timeout
+        self.ledger = ledger
         self.token = os.getenv("TOKEN_PACMAN_PORTAL")
+        self.bulk = bulk
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.session = create_session(pool_size=concurrency, retries=retries)
+        self.session.headers.update({"Authorization": f"Token {self.token}"})
+
+    @abstractmethod
+    def ledger_key(self, item) -> str:
+        pass
+
+    def ledger_data(self, item) -> dict:
+        return item.to_dict()
+
+    @abstractmethod
+    def submit(self, items: list) -> SubmissionSummary:
+        pass
+
+    def post(self, path: str, data) -> requests.Response:
+        start = perf_counter()
+        try:
+            return self.session.post(f"{self.endpoint}/{path}/", json=data, timeout=self.timeout)
+        finally:
+            metrics.observe("portal_post_seconds", perf_counter() - start)
+
+    def submit_one(self, path: str, item) -> tuple[bool, str]:
+        try:
+            res = self.post(path, item.to_dict())
+        except requests.RequestException as e:
+            return False, str(e)
+        if res.status_code > 201:
+            return False, res.content.decode(errors="replace")
+        return True, None
+
+    def submit_concurrent(self, path: str, items: list, summary: SubmissionSummary) -> None:
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            for item, (success, error) in zip(items, executor.map(lambda item: self.submit_one(path, item), items)):
+                if success:
+                    summary.submitted += 1
+                else:
+                    summary.failed += 1
+                    summary.errors.append(error)
+                    summary.failed_items.append(item)
+
+    def submit_batch(self, path: str, batch: list, summary: SubmissionSummary, resubmit: bool = True) -> bool:
+        """Submit a batch as a list, returns False if the portal does not accept lists."""
+
+        try:
+            res = self.post(path, [item.to_dict() for item in batch])
+        except requests.RequestException as e:
+            summary.failed += len(batch)
+            summary.errors.append(str(e))
+            summary.failed_items.extend(batch)
+            return True
+
+        if res.status_code in (404, 405, 415) or (res.status_code == 400 and list_rejected(res)):
+            return False
+
+        if res.status_code == 400 and (errors := item_errors(res, batch)) is not None:
+            # the portal rejects the whole batch on validation errors, resubmit the valid items once
+            valid = []
+            for item, error in zip(batch, errors):
+                if error:
+                    summary.failed += 1
+                    summary.errors.append(json.dumps(error))
+                    summary.failed_items.append(item)
+                else:
+                    valid.append(item)
+            if resubmit and len(valid) > 0:
+                self.submit_batch(path, valid, summary, resubmit=False)
+            elif len(valid) > 0:
+                summary.failed += len(valid)
+                summary.errors.append(res.content.decode(errors="replace"))
+                summary.failed_items.extend(valid)
+        elif res.status_code > 201:
+            summary.failed += len(batch)
+            summary.errors.append(res.content.decode(errors="replace"))
+            summary.failed_items.extend(batch)
+        else:
+            summary.submitted += len(batch)
+        return True
+
+    def submit_items(self, path: str, items: list, name: str) -> SubmissionSummary:
+
+        summary = SubmissionSummary()
+        items = list(items)
+
+        # with a ledger, skip items which are identical to their last successful submission
+
+        if self.ledger is not None:
+            keys = [self.ledger_key(item) for item in items]
+            hashes = [content_hash(self.ledger_data(item)) for item in items]
+            previous = self.ledger.hashes(path, keys)
+            summary.new = sum(1 for key in keys if key not in previous)
+            summary.changed = sum(1 for key, value in zip(keys, hashes) if key in previous and previous[key] != value)
+            summary.unchanged = len(items) - summary.new - summary.changed
+            pending = [(item, key, value) for item, key, value in zip(items, keys, hashes) if previous.get(key) != value]
+            items = [item for item, _, _ in pending]
+
+        if self.bulk:
+            for i in range(0, len(items), self.batch_size):
+                if not self.submit_batch(path, items[i:i + self.batch_size], summary):
+                    # portal does not accept lists, submit the remaining items one by one
+                    logging.warning(f"Bulk submission of {name} not supported, falling back to concurrent submission")
+                    self.bulk = False
+                    self.submit_concurrent(path, items[i:], summary)
+                    break
+        else:
+            self.submit_concurrent(path, items, summary)
+
+        if self.ledger is not None:
+            failed = set(id(item) for item in summary.failed_items)
+            self.ledger.record(path, {key: value for item, key, value in pending if id(item) not in failed})
+
+        metrics.count(f"{path}_submitted", summary.submitted)
+        metrics.count(f"{path}_failed", summary.failed)
+        metrics.count(f"{path}_unchanged", summary.unchanged)
+
+        changes = f" ({summary.new} new, {summary.changed} changed, {summary.unchanged} unchanged skipped)" if self.ledger is not None else ""
+        if summary.failed > 0:
+            logging.error(f"Submitted {summary.submitted} {name}{changes}, {summary.failed} failed: {summary.errors[0]}")
+        else:
+            logging.info(f"Submitted {summary.submitted} {name}{changes}")
+
+        return summary
+
+
+class PortalDetectionConnector(PortalConnector):
+
+    def __init__(self, *args, portal: PortalMetadataClient = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.portal = portal if portal is not None else PortalMetadataClient(endpoint=self.endpoint)
 
     def fetch_area(self, area_id: int) -> dict:
-        res = requests.get(f"{self.endpoint}/area/{area_id}", headers={"Authorization": f"Token {self.token}"})
-        area = res.json()
-        return area
+        return self.portal.area(area_id)
 
-    def submit(self, items: list[Detection]):
+    def ledger_key(self, item: Detection) -> str:
+        return f"{item.area}_{item.h3}_{item.get_key()}"
 
-        for item in items:
-            res = requests.post(f"{self.endpoint}/detection/", json=item.to_dict(), headers={"Authorization": f"Token {self.token}"})
-            if res.status_code > 201:
-                logging.error(f"Failed to submit detection: {res.content}")
-            else:
-                logging.info("Detection submitted")
+    def ledger_data(self, item: Detection) -> dict:
 
+        # occurrence and media order depend on fetch order, which does not change the detection,
+        # the description is derived from the first occurrence
 
-class PortalRiskAnalysisConnector:
+        data = item.to_dict()
+        del data["description"]
+        data["occurrences"] = sorted(data["occurrences"], key=lambda occurrence: str(occurrence["id"]))
+        if data["media"] is not None:
+            data["media"] = sorted(data["media"], key=lambda media: media["thumbnail"])
+        return data
 
-    def __init__(self, endpoint="http://127.0.0.1:8000/api"):
-        self.endpoint = endpoint
-        self.token = os.getenv("TOKEN_PACMAN_PORTAL")
+    def submit(self, items: list[Detection]) -> SubmissionSummary:
+        return self.submit_items("detection", items, "detections")
+
+
+class PortalRiskAnalysisConnector(PortalConnector):
+
+    def ledger_key(self, item: RiskAnalysis) -> str:
+        return f"{item.area}_{item.taxon}"
 
-    def submit(self, items: list[RiskAnalysis]):
+    def ledger_data(self, item: RiskAnalysis) -> dict:
+        data = item.to_dict()
+        del data["date"]
+        return data
 
-        for item in items:
-            res = requests.post(f"{self.endpoint}/risk_analysis/", json=item.to_dict(), headers={"Authorization": f"Token {self.token}"})
-            if res.status_code > 201:
-                logging.error(f"Failed to submit risk analysis: {res.content}")
+    def submit(self, items: list[RiskAnalysis]) -> SubmissionSummary:
+        return self.submit_items("risk_analysis", items, "risk analyses")
@@ -0,0 +1,338 @@
+from datetime import datetime
+from enum import IntFlag
+from h3 import h3_get_resolution, string_to_h3
+from pacmandetections.assessment import get_speedy, speedy_data_version, speedy_files
+from pacmandetections.metrics import metrics
+from pacmandetections.model import Assessment, EstablishmentMeans
+from pacmandetections.taxa import wrims_registry
+from pacmandetections.util import atomic_write
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import numpy as np
+import pandas as pd
+
+
+INDEX_VERSION = 3
+
+
+class EstablishmentFlag(IntFlag):
+    NATIVE = 1
+    INTRODUCED = 2
+    INVASIVE = 4
+    CONCERN = 8
+    THERMAL = 16
+
+
+SUMMARY_FLAGS = {
+    "establishmentMeans_native": EstablishmentFlag.NATIVE,
+    "establishmentMeans_introduced": EstablishmentFlag.INTRODUCED,
+    "invasiveness_invasive": EstablishmentFlag.INVASIVE,
+    "invasiveness_concern": EstablishmentFlag.CONCERN
+}
+
+
+def cell_ids(cells) -> np.ndarray:
+    return np.array([string_to_h3(cell) for cell in cells], dtype=np.uint64)
+
+
+def assessment_from_flags(flags: int) -> Assessment:
+    if flags & EstablishmentFlag.INTRODUCED:
+        return Assessment(establishmentMeans=EstablishmentMeans.INTRODUCED)
+    elif flags & EstablishmentFlag.NATIVE:
+        return Assessment(establishmentMeans=EstablishmentMeans.NATIVE)
+    else:
+        return Assessment(establishmentMeans=EstablishmentMeans.UNCERTAIN)
+
+
+class EstablishmentIndex:
+    """Per cell establishment means, invasiveness and thermal envelope flags for the taxa in the Speedy data.
+
+    For each resolution the index holds (cell, taxon, flags) rows sorted by cell and taxon, stored as .npy files
+    which are memory mapped, so lookups are binary searches instead of reading taxon summaries. Taxa which were
+    indexed but have no flags in a cell have no row, taxa which were not indexed are not answered by the index.
+
+    Each build is written to its own directory and meta.json points to the current build, so readers never mix
+    arrays from different builds. The build records the Speedy data version and the modification times of the
+    Speedy files of each taxon, so updates only reindex the taxa whose files changed.
+    """
+
+    def __init__(self, path: str, meta: dict, taxa: np.ndarray, tables: dict[int, tuple[np.ndarray, np.ndarray, np.ndarray]]):
+        self.path = path
+        self.meta = meta
+        self.taxa = taxa
+        self.tables = tables
+
+    @staticmethod
+    def file(path: str, name: str) -> str:
+        return os.path.join(path, f"{name}.npy")
+
+    @staticmethod
+    def exists(path: str) -> bool:
+        return os.path.exists(os.path.join(os.path.expanduser(path), "meta.json"))
+
+    @staticmethod
+    def load(path: str, mmap_mode: str = "r") -> "EstablishmentIndex":
+
+        path = os.path.expanduser(path)
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+        if meta.get("version") != INDEX_VERSION:
+            raise ValueError(f"Establishment index in {path} has version {meta.get('version')}, expected {INDEX_VERSION}, rebuild the index")
+
+        build = os.path.join(path, meta["build"])
+        load = lambda name: np.load(EstablishmentIndex.file(build, name), mmap_mode=mmap_mode)
+        tables = {resolution: (load(f"cells_{resolution}"), load(f"taxa_{resolution}"), load(f"flags_{resolution}")) for resolution in meta["resolutions"]}
+        taxa = load("taxa")
+
+        if len(taxa) != meta["taxa"]:
+            raise ValueError(f"Establishment index build {build} has {len(taxa)} taxa, expected {meta['taxa']}")
+        for resolution, arrays in tables.items():
+            if any(len(array) != meta["rows"][str(resolution)] for array in arrays):
+                raise ValueError(f"Establishment index build {build} has inconsistent arrays for resolution {resolution}")
+
+        return EstablishmentIndex(path=path, meta=meta, taxa=taxa, tables=tables)
+
+    def current(self, speedy_version: str) -> bool:
+        """Check if the index was built from the Speedy data version."""
+        return self.meta.get("speedy_version") == speedy_version
+
+    def taxon_versions(self) -> np.ndarray:
+        """Get the modification times of the Speedy files of the indexed taxa at build time."""
+
+        versions = np.load(EstablishmentIndex.file(os.path.join(self.path, self.meta["build"]), "taxon_versions"))
+        if len(versions) != len(self.taxa):
+            raise ValueError(f"Establishment index build {self.meta['build']} has {len(versions)} taxon versions, expected {len(self.taxa)}")
+        return versions
+
+    def indexed(self, aphiaid: int, resolution: int) -> bool:
+        if resolution not in self.tables:
+            return False
+        i = int(np.searchsorted(self.taxa, aphiaid))
+        return i < len(self.taxa) and self.taxa[i] == aphiaid
+
+    def cell_range(self, cell: str) -> tuple[np.ndarray, np.ndarray]:
+        """Get the taxa and flags rows of a cell."""
+
+        cells, taxa, flags = self.tables[h3_get_resolution(cell)]
+        cell_id = np.uint64(string_to_h3(cell))
+        start = int(np.searchsorted(cells, cell_id, side="left"))
+        end = int(np.searchsorted(cells, cell_id, side="right"))
+        return taxa[start:end], flags[start:end]
+
+    def flags(self, cell: str, aphiaid: int) -> EstablishmentFlag:
+
+        taxa, flags = self.cell_range(cell)
+        i = int(np.searchsorted(taxa, aphiaid))
+        if i < len(taxa) and taxa[i] == aphiaid:
+            return EstablishmentFlag(int(flags[i]))
+        return EstablishmentFlag(0)
+
+    def taxa_with(self, cell: str, flag: EstablishmentFlag) -> list[int]:
+        """Get the taxa with a flag in a cell, for example the taxa introduced in a cell."""
+
+        taxa, flags = self.cell_range(cell)
+        return taxa[(flags & flag) != 0].tolist()
+
+    def lookup(self, cells: list[str], aphiaids: list[int]) -> np.ndarray:
+        """Get flags for all combinations of cells and taxa, as an array with a row per cell."""
+
+        result = np.zeros((len(cells), len(aphiaids)), dtype=np.uint8)
+        aphiaids = np.asarray(aphiaids, dtype=np.int64)
+
+        for i, cell in enumerate(cells):
+            taxa, flags = self.cell_range(cell)
+            if len(taxa) == 0 or len(aphiaids) == 0:
+                continue
+            positions = np.minimum(np.searchsorted(taxa, aphiaids), len(taxa) - 1)
+            found = taxa[positions] == aphiaids
+            result[i, found] = flags[positions[found]]
+
+        metrics.count("establishment_index_lookups", len(cells) * len(aphiaids))
+        return result
+
+    def assess(self, cell: str, aphiaid: int) -> Assessment:
+        metrics.count("establishment_index_lookups")
+        return assessment_from_flags(self.flags(cell, aphiaid))
+
+    def assess_many(self, cells: list[str], aphiaids: list[int]) -> dict[str, dict[int, Assessment]]:
+        flags = self.lookup(cells, aphiaids)
+        return {cell: {aphiaid: assessment_from_flags(flags[i, j]) for j, aphiaid in enumerate(aphiaids)} for i, cell in enumerate(cells)}
+
+
+def taxon_rows(speedy_data: str, aphiaid: int, resolution: int) -> pd.DataFrame:
+    """Get the cells with flags for a taxon from its Speedy summary and thermal envelope."""
+
+    sp = get_speedy(speedy_data)
+    summary = sp.get_summary(aphiaid, resolution=resolution, as_geopandas=False)
+    envelope = sp.get_thermal_envelope(aphiaid, resolution=resolution, as_geopandas=False)
+
+    flags = pd.Series(0, index=summary.index, dtype=np.uint8)
+    for column, flag in SUMMARY_FLAGS.items():
+        flags = flags | np.where(summary[column].fillna(False).astype(bool), int(flag), 0).astype(np.uint8)
+    rows = pd.DataFrame({"h3": summary["h3"].astype(str), "flags": flags})
+
+    if envelope is not None and len(envelope) > 0:
+        rows = pd.concat([rows, pd.DataFrame({"h3": envelope["h3"].astype(str), "flags": np.uint8(EstablishmentFlag.THERMAL)})], ignore_index=True)
+
+    rows = rows.groupby("h3", as_index=False)["flags"].agg(np.bitwise_or.reduce)
+    rows = rows[rows["flags"] != 0]
+
+    return pd.DataFrame({"cell": cell_ids(rows["h3"]), "taxon": np.int64(aphiaid), "flags": rows["flags"].to_numpy(dtype=np.uint8)})
+
+
+def taxon_versions(speedy_data: str, taxa: np.ndarray) -> tuple[np.ndarray, float]:
+    """Get the latest modification time of the Speedy files of each taxon, and of the files of no taxon.
+
+    Files are matched to taxa on AphiaIDs in their path. Files which do not match a taxon, including files of taxa
+    which are not indexed, count as shared files.
+    """
+
+    positions = {int(aphiaid): i for i, aphiaid in enumerate(taxa)}
+    versions = np.zeros(len(taxa), dtype=np.float64)
+    shared = 0.0
+
+    for file, mtime in speedy_files(speedy_data):
+        matched = [positions[int(number)] for number in re.findall(r"\d+", file) if int(number) in positions]
+        if len(matched) > 0:
+            versions[matched] = np.maximum(versions[matched], mtime)
+        else:
+            shared = max(shared, mtime)
+
+    return versions, shared
+
+
+def build_index(speedy_data: str, path: str, taxa: list[int], resolutions: list[int] = [5, 7], incremental: bool = True) -> EstablishmentIndex:
+    """Build the establishment index for taxa from the Speedy data.
+
+    With incremental, taxa in an existing index with the same resolutions are kept, and only new taxa and taxa
+    whose Speedy files changed since the last build are processed. When shared Speedy files changed all taxa are
+    processed again.
+    """
+
+    path = os.path.expanduser(path)
+    resolutions = sorted(resolutions)
+
+    # the version is taken before reading, so data updated during the build makes the index stale
+
+    speedy_version = speedy_data_version(speedy_data, refresh=True)
+
+    existing = None
+    if incremental and EstablishmentIndex.exists(path):
+        try:
+            existing = EstablishmentIndex.load(path, mmap_mode=None)
+            existing_versions = existing.taxon_versions()
+        except (ValueError, OSError, KeyError) as e:
+            logging.warning(f"Cannot update existing establishment index, rebuilding all taxa: {e}")
+            existing = None
+        if existing is not None and sorted(existing.meta["resolutions"]) != resolutions:
+            logging.warning(f"Existing establishment index has resolutions {existing.meta['resolutions']}, rebuilding all taxa")
+            existing = None
+
+    indexed_taxa = np.array(sorted(set(int(aphiaid) for aphiaid in taxa)), dtype=np.int64)
+    if existing is not None:
+        indexed_taxa = np.union1d(existing.taxa, indexed_taxa)
+    versions, shared = taxon_versions(speedy_data, indexed_taxa)
+
+    if existing is not None and shared > existing.meta["shared_version"]:
+        logging.warning("Shared Speedy files changed since the last build, rebuilding all taxa")
+        existing = None
+
+    if existing is not None:
+        previous = dict(zip(existing.taxa.tolist(), existing_versions.tolist()))
+        taxa = [aphiaid for aphiaid, version in zip(indexed_taxa.tolist(), versions.tolist()) if previous.get(aphiaid) != version]
+        logging.info(f"Indexing {len(taxa)} new or updated taxa, keeping {len(indexed_taxa) - len(taxa)} taxa")
+    else:
+        taxa = indexed_taxa.tolist()
+
+    arrays = dict()
+
+    for resolution in resolutions:
+        frames = []
+        for i, aphiaid in enumerate(taxa):
+            logging.info(f"Indexing {aphiaid} at resolution {resolution} ({i + 1} / {len(taxa)})")
+            with metrics.timer("speedy_summary"):
+                frames.append(taxon_rows(speedy_data, aphiaid, resolution))
+
+        if existing is not None:
+            cells, existing_taxa, flags = existing.tables[resolution]
+            keep = ~np.isin(existing_taxa, taxa)
+            frames.append(pd.DataFrame({"cell": cells[keep], "taxon": existing_taxa[keep], "flags": flags[keep]}))
+
+        rows = pd.concat(frames, ignore_index=True) if len(frames) > 0 else pd.DataFrame({"cell": [], "taxon": [], "flags": []})
+        order = np.lexsort((rows["taxon"].to_numpy(), rows["cell"].to_numpy()))
+
+        arrays[f"cells_{resolution}"] = rows["cell"].to_numpy(dtype=np.uint64)[order]
+        arrays[f"taxa_{resolution}"] = rows["taxon"].to_numpy(dtype=np.int64)[order]
+        arrays[f"flags_{resolution}"] = rows["flags"].to_numpy(dtype=np.uint8)[order]
+
+    arrays["taxa"] = indexed_taxa
+    arrays["taxon_versions"] = versions
+
+    # arrays are written to a new build directory and meta.json is switched to it atomically, the previous build is
+    # kept for readers which read the previous meta.json, older builds are removed
+
+    previous = None
+    if EstablishmentIndex.exists(path):
+        with open(os.path.join(path, "meta.json")) as f:
+            previous = json.load(f).get("build")
+    build = f"build-{datetime.now():%Y%m%dT%H%M%S%f}"
+    os.makedirs(os.path.join(path, build))
+
+    for name, array in arrays.items():
+        np.save(EstablishmentIndex.file(os.path.join(path, build), name), array)
+
+    meta = {
+        "version": INDEX_VERSION,
+        "build": build,
+        "resolutions": resolutions,
+        "speedy_data": os.path.expanduser(speedy_data),
+        "speedy_version": speedy_version,
+        "shared_version": shared,
+        "built": datetime.now().isoformat(),
+        "taxa": len(indexed_taxa),
+        "rows": {str(resolution): len(arrays[f"cells_{resolution}"]) for resolution in resolutions}
+    }
+    with atomic_write(os.path.join(path, "meta.json")) as f:
+        json.dump(meta, f)
+
+    for name in os.listdir(path):
+        if name.startswith("build-") and name not in (build, previous):
+            shutil.rmtree(os.path.join(path, name), ignore_errors=True)
+
+    logging.info(f"Stored establishment index for {len(indexed_taxa)} taxa in {path}")
+
+    return EstablishmentIndex.load(path)
+
+
+def load_current_index(path: str, speedy_version: str) -> EstablishmentIndex | None:
+    """Load an establishment index, or None if it was built from another version of the Speedy data."""
+
+    index = EstablishmentIndex.load(path)
+    if not index.current(speedy_version):
+        logging.warning(f"Establishment index in {path} was built from Speedy data version {index.meta.get('speedy_version')}, the data is at version {speedy_version}, not using the index until it is updated")
+        return None
+    return index
+
+
+def main():
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(prog="pacmandetections.establishment", description="Build the per cell establishment index from the Speedy data")
+    parser.add_argument("speedy_data", help="Speedy data directory")
+    parser.add_argument("path", help="output directory of the index")
+    parser.add_argument("--taxa", type=int, nargs="+", default=None, help="index these taxa in addition to the indexed taxa, by default all WRiMS taxa")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[5, 7], help="H3 resolutions to index")
+    parser.add_argument("--full", action="store_true", help="reindex all taxa instead of only new taxa and taxa with updated Speedy data")
+    args = parser.parse_args()
+
+    taxa = args.taxa if args.taxa else wrims_registry().keys()
+    build_index(args.speedy_data, args.path, taxa, resolutions=args.resolutions, incremental=not args.full)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+from shapely import Geometry, MultiPolygon, Polygon, bounds, from_wkb, get_parts, to_wkb
+from h3 import compact, uncompact
+from h3pandas.util.shapely import polyfill
+from pacmandetections.util import atomic_write, cell_polygon, split_antimeridian
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+import hashlib
+import numpy as np
+import json
+import logging
+import os
+import threading
+
+
+def polyfill_parts(shape: Geometry, resolution: int) -> list[str]:
+    """Polyfill a shape, splitting it at the antimeridian and polyfilling the parts in parallel."""
+
+    parts = split_antimeridian(shape)
+    if len(parts) == 1:
+        return sorted(polyfill(parts[0], resolution, geo_json=True))
+
+    with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+        return sorted(set(chain.from_iterable(executor.map(lambda part: polyfill(part, resolution, geo_json=True), parts))))
+
+
+def bounding_box(part_bounds: np.ndarray) -> Polygon:
+    minx, miny = part_bounds[:, 0].min(), part_bounds[:, 1].min()
+    maxx, maxy = part_bounds[:, 2].max(), part_bounds[:, 3].max()
+    return Polygon([(minx, miny), (maxx, miny), (maxx, maxy), (minx, maxy), (minx, miny)])
+
+
+def envelope(polygons: list[Geometry]) -> Polygon | MultiPolygon:
+    """Get the envelope of a set of polygons, with an envelope per side of the antimeridian if they span it."""
+
+    part_bounds = bounds(get_parts(polygons))
+    if part_bounds[:, 2].max() - part_bounds[:, 0].min() <= 180:
+        return bounding_box(part_bounds)
+
+    west = part_bounds[:, 0] < 0
+    return MultiPolygon([bounding_box(part_bounds[west]), bounding_box(part_bounds[~west])])
+
+
+class AreaCache:
+    """Cache of the H3 cells and cell polygons covering an area, keyed by area id, geometry hash and resolution.
+
+    Cells are stored in compact form and expanded to the requested resolution on load. With a path, entries are
+    persisted as JSON so polyfills are only computed once across runs.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = os.path.expanduser(path) if path else None
+        self.entries = dict()
+        self.lock = threading.Lock()
+
+    def key(self, shape: Geometry, resolution: int, area: int = None) -> str:
+        geometry_hash = hashlib.sha1(to_wkb(shape.normalize())).hexdigest()
+        return f"{area}_{geometry_hash}_{resolution}"
+
+    def file(self, key: str) -> str:
+        return os.path.join(self.path, f"{key}.json")
+
+    def entry(self, shape: Geometry, resolution: int, area: int = None) -> dict:
+
+        key = self.key(shape, resolution, area)
+
+        with self.lock:
+            if key in self.entries:
+                return self.entries[key]
+
+            if self.path is not None and os.path.exists(self.file(key)):
+                with open(self.file(key)) as f:
+                    entry = json.load(f)
+                entry["cells"] = sorted(uncompact(entry["compact"], resolution))
+            else:
+                logging.info(f"Polyfilling area {area} at resolution {resolution}")
+                cells = polyfill_parts(shape, resolution)
+                entry = {"area": area, "resolution": resolution, "compact": sorted(compact(cells)), "cells": cells, "polygons": None}
+                self.save(key, entry)
+
+            self.entries[key] = entry
+            return entry
+
+    def save(self, key: str, entry: dict) -> None:
+
+        if self.path is None:
+            return
+
+        with atomic_write(self.file(key)) as f:
+            json.dump({name: value for name, value in entry.items() if name != "cells"}, f)
+
+    def cells(self, shape: Geometry, resolution: int, area: int = None) -> list[str]:
+        """Get the cells covering an area at a resolution."""
+        return self.entry(shape, resolution, area)["cells"]
+
+    def compact_cells(self, shape: Geometry, resolution: int, area: int = None) -> list[str]:
+        """Get the compact multi-resolution representation of the cells covering an area."""
+        return self.entry(shape, resolution, area)["compact"]
+
+    def polygons(self, shape: Geometry, resolution: int, area: int = None) -> list[Polygon]:
+        """Get the cell polygons for an area, in the order of cells()."""
+
+        entry = self.entry(shape, resolution, area)
+
+        with self.lock:
+            if entry["polygons"] is None:
+                entry["polygons"] = [to_wkb(cell_polygon(cell), hex=True) for cell in entry["cells"]]
+                self.save(self.key(shape, resolution, area), entry)
+
+        return list(from_wkb(entry["polygons"]))
+
+
+default_area_cache = AreaCache()
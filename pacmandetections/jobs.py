@@ -0,0 +1,107 @@
+from datetime import timedelta
+from enum import Enum
+import logging
+import os
+import socket
+import sqlite3
+import time
+from pacmandetections.util import SQLiteConnection
+
+
+class JobStatus(Enum):
+    PENDING = "pending"
+    LEASED = "leased"
+    DONE = "done"
+    FAILED = "failed"
+
+
+def worker_id() -> str:
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobStore:
+    """SQLite store of work units (cells or taxa) per run, so runs can be resumed and split across workers.
+
+    Workers lease pending units, leases which are not completed within the lease timeout are handed out again.
+    Several processes or machines can share the state file.
+    """
+
+    def __init__(self, path: str, lease_timeout: timedelta = timedelta(hours=1)):
+        self.path = os.path.expanduser(path)
+        self.lease_timeout = lease_timeout
+        self.db = SQLiteConnection(self.path, [
+            "create table if not exists job (run text, unit text, status text, attempts integer, worker text, lease_expires real, error text, updated real, primary key (run, unit))",
+            "create index if not exists job_status on job (run, status)"
+        ], timeout=60, isolation_level=None)
+
+    def connection(self) -> sqlite3.Connection:
+        return self.db.get()
+
+    def add(self, run: str, units: list) -> int:
+        """Add work units to a run, keeping the status of units which already exist. Returns the number of new units."""
+
+        conn = self.connection()
+        conn.execute("begin immediate")
+        before = conn.execute("select count(*) from job where run = ?", (run,)).fetchone()[0]
+        conn.executemany("insert or ignore into job values (?, ?, ?, 0, null, null, null, ?)", [(run, str(unit), JobStatus.PENDING.value, time.time()) for unit in units])
+        after = conn.execute("select count(*) from job where run = ?", (run,)).fetchone()[0]
+        conn.execute("commit")
+        return after - before
+
+    def lease(self, run: str, limit: int = 1, worker: str = None) -> list[str]:
+        """Lease up to limit pending units, or units with an expired lease."""
+
+        worker = worker or worker_id()
+        now = time.time()
+
+        conn = self.connection()
+        conn.execute("begin immediate")
+        units = [row[0] for row in conn.execute(
+            "select unit from job where run = ? and (status = ? or (status = ? and lease_expires < ?)) order by rowid limit ?",
+            (run, JobStatus.PENDING.value, JobStatus.LEASED.value, now, limit)
+        ).fetchall()]
+        conn.executemany(
+            "update job set status = ?, attempts = attempts + 1, worker = ?, lease_expires = ?, updated = ? where run = ? and unit = ?",
+            [(JobStatus.LEASED.value, worker, now + self.lease_timeout.total_seconds(), now, run, unit) for unit in units]
+        )
+        conn.execute("commit")
+        return units
+
+    def complete(self, run: str, units: list, worker: str = None) -> int:
+        """Mark units leased by worker as done, returning the number of units marked."""
+        return self.finish(run, units, JobStatus.DONE, None, worker)
+
+    def fail(self, run: str, units: list, error: str = None, worker: str = None) -> int:
+        """Mark units leased by worker as failed, returning the number of units marked."""
+        return self.finish(run, units, JobStatus.FAILED, error, worker)
+
+    def finish(self, run: str, units: list, status: JobStatus, error: str = None, worker: str = None) -> int:
+
+        # units whose lease expired and were leased by another worker belong to that worker now
+
+        worker = worker or worker_id()
+        conn = self.connection()
+        conn.execute("begin immediate")
+        before = conn.total_changes
+        conn.executemany(
+            "update job set status = ?, error = ?, lease_expires = null, updated = ? where run = ? and unit = ? and status = ? and worker = ?",
+            [(status.value, error, time.time(), run, str(unit), JobStatus.LEASED.value, worker) for unit in units]
+        )
+        finished = conn.total_changes - before
+        conn.execute("commit")
+
+        if finished < len(units):
+            logging.warning(f"Lost the lease on {len(units) - finished} units of {run}, keeping the results of the workers which took them over")
+        return finished
+
+    def retry_failed(self, run: str) -> int:
+        """Reset failed units to pending, returning the number of units reset."""
+
+        cursor = self.connection().execute("update job set status = ?, error = null, updated = ? where run = ? and status = ?", (JobStatus.PENDING.value, time.time(), run, JobStatus.FAILED.value))
+        return cursor.rowcount
+
+    def counts(self, run: str) -> dict[JobStatus, int]:
+        rows = self.connection().execute("select status, count(*) from job where run = ? group by status", (run,)).fetchall()
+        counts = {status: 0 for status in JobStatus}
+        counts.update({JobStatus(status): count for status, count in rows})
+        return counts
@@ -0,0 +1,39 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from pacmandetections.util import SQLiteConnection
+
+
+def content_hash(data: dict) -> str:
+    """Stable hash of a JSON serializable dict."""
+    return hashlib.sha256(json.dumps(data, sort_keys=True, separators=(",", ":"), default=str).encode()).hexdigest()
+
+
+class SubmissionLedger:
+    """Local record of content hashes of items submitted to the portal, so unchanged items can be skipped."""
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+        self.db = SQLiteConnection(self.path, ["create table if not exists submission (kind text, key text, hash text, submitted real, primary key (kind, key))"], timeout=30)
+
+    def connection(self) -> sqlite3.Connection:
+        return self.db.get()
+
+    def hashes(self, kind: str, keys: list[str]) -> dict[str, str]:
+        """Get the stored hashes for keys, keys which were never submitted are left out."""
+
+        conn = self.connection()
+        hashes = dict()
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = conn.execute(f"select key, hash from submission where kind = ? and key in ({', '.join('?' * len(batch))})", (kind, *batch)).fetchall()
+            hashes.update(rows)
+        return hashes
+
+    def record(self, kind: str, hashes: dict[str, str]) -> None:
+        conn = self.connection()
+        now = time.time()
+        conn.executemany("insert or replace into submission values (?, ?, ?, ?)", [(kind, key, value, now) for key, value in hashes.items()])
+        conn.commit()
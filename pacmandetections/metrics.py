@@ -0,0 +1,149 @@
+from contextlib import contextmanager
+from time import perf_counter
+import json
+import logging
+import os
+import threading
+
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Metrics:
+    """Stage timers, counters and latency histograms, exported as a JSON run report or in Prometheus text format."""
+
+    def __init__(self, buckets: tuple[float] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        with self.lock:
+            self.counters = dict()
+            self.timers = dict()
+            self.histograms = dict()
+
+    @contextmanager
+    def timer(self, stage: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.record_time(stage, perf_counter() - start)
+
+    def record_time(self, stage: str, seconds: float) -> None:
+        with self.lock:
+            timer = self.timers.setdefault(stage, {"count": 0, "seconds": 0.0})
+            timer["count"] += 1
+            timer["seconds"] += seconds
+
+    def count(self, name: str, value: int = 1) -> None:
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self.lock:
+            histogram = self.histograms.setdefault(name, {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0})
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+            histogram["count"] += 1
+            histogram["sum"] += value
+
+    def hit_rate(self, name: str) -> float | None:
+        hits = self.counters.get(f"{name}_hits", 0)
+        misses = self.counters.get(f"{name}_misses", 0)
+        return hits / (hits + misses) if hits + misses > 0 else None
+
+    def report(self) -> dict:
+        with self.lock:
+            caches = set(name[:-5] for name in self.counters if name.endswith("_hits")) | set(name[:-7] for name in self.counters if name.endswith("_misses"))
+            return {
+                "timers": {stage: dict(timer) for stage, timer in self.timers.items()},
+                "counters": dict(self.counters),
+                "cache_hit_rates": {name: self.hit_rate(name) for name in sorted(caches)},
+                "histograms": {
+                    name: {"buckets": dict(zip([str(bound) for bound in self.buckets], histogram["buckets"])), "count": histogram["count"], "sum": histogram["sum"]}
+                    for name, histogram in self.histograms.items()
+                }
+            }
+
+    def merge(self, report: dict) -> None:
+        """Merge a report from another process, for example a pool worker."""
+
+        with self.lock:
+            for stage, timer in report["timers"].items():
+                own = self.timers.setdefault(stage, {"count": 0, "seconds": 0.0})
+                own["count"] += timer["count"]
+                own["seconds"] += timer["seconds"]
+            for name, value in report["counters"].items():
+                self.counters[name] = self.counters.get(name, 0) + value
+            for name, histogram in report["histograms"].items():
+                own = self.histograms.setdefault(name, {"buckets": [0] * len(self.buckets), "count": 0, "sum": 0.0})
+                for i, value in enumerate(histogram["buckets"].values()):
+                    own["buckets"][i] += value
+                own["count"] += histogram["count"]
+                own["sum"] += histogram["sum"]
+
+    def to_prometheus(self, prefix: str = "pacmandetections") -> str:
+
+        report = self.report()
+        lines = []
+
+        for stage, timer in report["timers"].items():
+            lines.append(f"{prefix}_stage_seconds_total{{stage=\"{stage}\"}} {timer['seconds']}")
+            lines.append(f"{prefix}_stage_calls_total{{stage=\"{stage}\"}} {timer['count']}")
+        for name, value in report["counters"].items():
+            lines.append(f"{prefix}_{name}_total {value}")
+        for name, rate in report["cache_hit_rates"].items():
+            if rate is not None:
+                lines.append(f"{prefix}_{name}_hit_rate {rate}")
+        for name, histogram in report["histograms"].items():
+            cumulative = 0
+            for bound, value in histogram["buckets"].items():
+                cumulative += value
+                lines.append(f"{prefix}_{name}_bucket{{le=\"{bound}\"}} {cumulative}")
+            lines.append(f"{prefix}_{name}_bucket{{le=\"+Inf\"}} {histogram['count']}")
+            lines.append(f"{prefix}_{name}_sum {histogram['sum']}")
+            lines.append(f"{prefix}_{name}_count {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str) -> None:
+        with open(os.path.expanduser(path), "w") as f:
+            json.dump(self.report(), f, indent=2)
+
+    def write_prometheus(self, path: str) -> None:
+        with open(os.path.expanduser(path), "w") as f:
+            f.write(self.to_prometheus())
+
+
+metrics = Metrics()
+
+
+@contextmanager
+def profile(path: str, profiler: str = "cprofile"):
+    """Profile the enclosed block with cProfile or pyinstrument and write the result to path."""
+
+    if profiler == "pyinstrument":
+        from pyinstrument import Profiler
+        instrument = Profiler()
+        instrument.start()
+        try:
+            yield
+        finally:
+            instrument.stop()
+            with open(os.path.expanduser(path), "w") as f:
+                f.write(instrument.output_html())
+    else:
+        import cProfile
+        instrument = cProfile.Profile()
+        instrument.enable()
+        try:
+            yield
+        finally:
+            instrument.disable()
+            instrument.dump_stats(os.path.expanduser(path))
+
+    logging.info(f"Wrote profile to {path}")
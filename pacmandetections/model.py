@@ -1,7 +1,7 @@
 from abc import ABC, abstractmethod
 from enum import Enum
-from dataclasses import dataclass
-import dateutil.parser
+from dataclasses import dataclass, fields
+from pacmandetections.util import parse_day
 from shapely import Geometry
 
 
@@ -30,12 +30,15 @@ class Invasiveness(Enum):
     UNCERTAIN = "uncertain"
 
 
-@dataclass
+@dataclass(slots=True)
 class Media:
     thumbnail: str
 
+    def to_dict(self):
+        return {"thumbnail": self.thumbnail}
 
-@dataclass
+
+@dataclass(slots=True)
 class Occurrence:
     id: str
     scientificName: str
@@ -57,11 +60,13 @@ class Occurrence:
     organismQuantity: float
 
     def get_day(self):
-        date = dateutil.parser.isoparse(self.eventDate)
-        return date.strftime("%Y-%m-%d")
+        return parse_day(self.eventDate)
+
+    def to_dict(self):
+        return {field.name: getattr(self, field.name) for field in fields(self)}
 
 
-@dataclass
+@dataclass(slots=True)
 class Evidence:
     AphiaID: int
     target_gene: str
@@ -112,13 +117,16 @@ class Detection:
                 description += f", marker {occurrence.target_gene}"
         return description
 
+    def get_key(self):
+        return f"{self.taxon}_{self.target_gene}_{self.date}"
+
     def to_dict(self):
         return {
             "taxon": self.taxon,
             "area": self.area,
             "h3": self.h3,
             "date": self.date,
-            "occurrences": [occurrence.__dict__ for occurrence in self.occurrences],
+            "occurrences": [occurrence.to_dict() for occurrence in self.occurrences],
             "target_gene": self.target_gene,
             "description": self.__repr__(),
             "confidence": self.confidence.value,
@@ -126,9 +134,27 @@ class Detection:
             "best_organismQuantity": self.best_organismQuantity,
             "best_query_cover": self.best_query_cover,
             "best_alternatives": self.best_alternatives,
-            "media": [media.__dict__ for media in self.media] if self.media else None,
+            "media": [media.to_dict() for media in self.media] if self.media else None,
         }
 
+    @staticmethod
+    def from_dict(data: dict, scientificName: str = None) -> "Detection":
+        return Detection(
+            taxon=data["taxon"],
+            scientificName=scientificName,
+            h3=data["h3"],
+            date=data["date"],
+            occurrences=[Occurrence(**occurrence) for occurrence in data["occurrences"]],
+            area=data["area"],
+            target_gene=data["target_gene"],
+            confidence=Confidence(data["confidence"]),
+            media=[Media(**media) for media in data["media"]] if data["media"] else None,
+            best_identity=data["best_identity"],
+            best_organismQuantity=data["best_organismQuantity"],
+            best_query_cover=data["best_query_cover"],
+            best_alternatives=data["best_alternatives"]
+        )
+
 
 class Source(ABC):
 
@@ -0,0 +1,130 @@
+from datetime import timedelta
+from pacmandetections.metrics import metrics
+from pacmandetections.util import atomic_write, create_session
+import hashlib
+import json
+import logging
+import os
+import requests
+import threading
+import time
+
+
+class PortalMetadataClient:
+    """Client for portal metadata such as areas and priority lists.
+
+    Responses are kept as snapshots, in memory and optionally on disk, and revalidated with ETag and
+    Last-Modified headers. Snapshots younger than max_age are used without revalidation, and snapshots are
+    served when the portal is unreachable or in offline mode.
+    """
+
+    def __init__(self, endpoint: str = "http://127.0.0.1:8000/api", path: str = None, max_age: timedelta = None, offline: bool = False, timeout: float = 10):
+        self.endpoint = endpoint
+        self.path = os.path.expanduser(path) if path else None
+        self.max_age = max_age
+        self.offline = offline
+        self.timeout = timeout
+        self.snapshots = dict()
+        self.lock = threading.Lock()
+        self.session = create_session(pool_size=2, retries=1)
+        token = os.getenv("TOKEN_PACMAN_PORTAL")
+        if token:
+            self.session.headers.update({"Authorization": f"Token {token}"})
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["session"] = None
+        state["lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.session = create_session(pool_size=2, retries=1)
+        self.lock = threading.Lock()
+
+    def file(self, resource: str) -> str:
+        return os.path.join(self.path, f"{hashlib.sha1(resource.encode()).hexdigest()}.json")
+
+    def load_snapshot(self, resource: str) -> dict | None:
+
+        if resource in self.snapshots:
+            return self.snapshots[resource]
+        if self.path is None or not os.path.exists(self.file(resource)):
+            return None
+
+        try:
+            with open(self.file(resource)) as f:
+                snapshot = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            logging.warning(f"Ignoring unreadable portal snapshot for {resource}")
+            return None
+
+        self.snapshots[resource] = snapshot
+        return snapshot
+
+    def save_snapshot(self, resource: str, snapshot: dict) -> None:
+
+        self.snapshots[resource] = snapshot
+        if self.path is None:
+            return
+
+        with atomic_write(self.file(resource)) as f:
+            json.dump(snapshot, f)
+
+    def get(self, resource: str):
+        """Get a portal resource, for example area/1, revalidating the snapshot if there is one."""
+
+        with self.lock:
+            snapshot = self.load_snapshot(resource)
+
+            if self.offline:
+                if snapshot is None:
+                    raise LookupError(f"No portal snapshot for {resource} in offline mode")
+                metrics.count("portal_snapshot_hits")
+                return snapshot["data"]
+
+            if snapshot is not None:
+                if self.max_age is not None and time.time() - snapshot["fetched"] < self.max_age.total_seconds():
+                    metrics.count("portal_snapshot_hits")
+                    return snapshot["data"]
+
+            headers = dict()
+            if snapshot is not None:
+                if snapshot.get("etag"):
+                    headers["If-None-Match"] = snapshot["etag"]
+                if snapshot.get("last_modified"):
+                    headers["If-Modified-Since"] = snapshot["last_modified"]
+
+            try:
+                res = self.session.get(f"{self.endpoint}/{resource}", headers=headers, timeout=self.timeout)
+                if res.status_code != 304:
+                    res.raise_for_status()
+                    data = res.json()
+            except (requests.RequestException, ValueError) as e:
+                if snapshot is None:
+                    raise
+                logging.warning(f"Portal unavailable, using snapshot of {resource} from {time.ctime(snapshot['fetched'])}: {e}")
+                metrics.count("portal_snapshot_hits")
+                return snapshot["data"]
+
+            if res.status_code == 304:
+                metrics.count("portal_snapshot_hits")
+                snapshot = {**snapshot, "fetched": time.time()}
+            else:
+                metrics.count("portal_snapshot_misses")
+                snapshot = {"data": data, "etag": res.headers.get("ETag"), "last_modified": res.headers.get("Last-Modified"), "fetched": time.time()}
+
+            self.save_snapshot(resource, snapshot)
+            return snapshot["data"]
+
+    def area(self, area_id: int) -> dict:
+        return self.get(f"area/{area_id}")
+
+    def priority_lists(self, area_id: int) -> list[dict]:
+        return self.get(f"priority_list?area={area_id}")
+
+    def priority_taxa(self, area_id: int) -> set[int]:
+        taxa_ids = []
+        for entry in self.priority_lists(area_id):
+            taxa_ids.extend(entry["taxa"])
+        return set(taxa_ids)
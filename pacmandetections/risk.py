@@ -2,7 +2,6 @@ from shapely import Geometry, Polygon, from_wkt
 from h3 import h3_to_geo_boundary, h3_get_resolution
 from datetime import datetime, timedelta
 import importlib.resources
-from speedy import Speedy
 import os
 import json
 from pacmandetections.util import aphiaid_from_lsid
@@ -10,57 +9,73 @@ import logging
 from termcolor import colored
 from pacmandetections.model import Detection, EstablishmentMeans, Source, Occurrence, RiskAnalysis, RiskLevel
 from pacmandetections.sources import OBISAPISource
-from h3pandas.util.shapely import polyfill
+from pacmandetections.assessment import get_speedy
+from pacmandetections.metrics import metrics
+from pacmandetections.geometry import AreaCache, default_area_cache
+from pacmandetections.portal import PortalMetadataClient
 import geopandas as gpd
 import duckdb
 import pandas as pd
 import numpy as np
-import requests
 
 
 class RiskEngine:
 
-    def __init__(self, shape: Geometry | str, area: int = None, speedy_data: str = None):
+    def __init__(self, shape: Geometry | str, area: int = None, speedy_data: str = None, area_cache: AreaCache = None, portal: PortalMetadataClient = None):
 
         self.resolution = 5
 
         if isinstance(shape, str):
             self.shape = from_wkt(shape)
-            # TODO: handle dateline wrap
         else:
             self.shape = shape
-        self.h3 = pd.DataFrame({"h3": list(polyfill(self.shape, self.resolution, geo_json=True))})
+        area_cache = area_cache if area_cache is not None else default_area_cache
+        self.h3 = pd.DataFrame({"h3": area_cache.cells(self.shape, self.resolution, area)})
 
         self.area = area
         self.speedy_data = speedy_data
+        self.portal = portal if portal is not None else PortalMetadataClient()
+        self.conn = None
 
         self.fetch_priority_lists()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def connection(self) -> duckdb.DuckDBPyConnection:
+        """Get the engine's DuckDB connection, which holds the area cells in an indexed table."""
+
+        if self.conn is None:
+            self.conn = duckdb.connect()
+            self.conn.register("area_cells", self.h3)
+            self.conn.execute("create table cells as select h3::varchar as h3 from area_cells")
+            self.conn.execute("create index cells_h3 on cells (h3)")
+            self.conn.unregister("area_cells")
+        return self.conn
+
+    def close(self) -> None:
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
     def fetch_priority_lists(self):
 
-        res = requests.get(f"http://127.0.0.1:8000/api/priority_list?area={self.area}") 
-        data = res.json()
-        taxa_ids = []
-        for entry in data:
-            taxa_ids.extend(entry["taxa"])
-        self.priority_taxa = set(taxa_ids)
+        self.priority_taxa = self.portal.priority_taxa(self.area)
 
     def summarize(self, summary: pd.DataFrame, envelope: pd.DataFrame) -> pd.DataFrame:
 
         # handle missing envelope
-        if envelope is not None:
-            envelope["thermal"] = True
-        else:
-            envelope_columns = {
-                "h3": "string",
-                "thermal": "bool"
-            }
-            envelope = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in envelope_columns.items()})
+        if envelope is None:
+            envelope = pd.DataFrame({"h3": pd.Series(dtype="string")})
+
+        # frames are registered without copying, the cells table and connection are reused across taxa
 
-        conn = duckdb.connect()
+        conn = self.connection()
         conn.register("summary", summary)
         conn.register("envelope", envelope)
-        conn.register("cells", self.h3)
 
         aggregated = conn.execute("""
             select
@@ -73,21 +88,26 @@ class RiskEngine:
                 coalesce(max(establishmentMeans_introduced), false) as establishmentMeans_introduced,
                 coalesce(max(invasiveness_invasive), false) as invasiveness_invasive,
                 coalesce(max(invasiveness_concern), false) as invasiveness_concern,
-                coalesce(max(thermal), false) as thermal,
+                coalesce(bool_or(envelope.h3 is not null), false) as thermal,
             from cells
             left join envelope on envelope.h3 = cells.h3
             left join summary on summary.h3 = cells.h3
         """).fetchdf()
+        conn.unregister("summary")
+        conn.unregister("envelope")
 
         return aggregated.to_dict(orient="index").get(0)
 
     def calculate_risk(self, aphiaid: int) -> RiskAnalysis:
 
-        sp = Speedy(h3_resolution=7, data_dir=os.path.expanduser(self.speedy_data), cache_summary=True)
-        summary = sp.get_summary(aphiaid, resolution=self.resolution, as_geopandas=False)
-        envelope = sp.get_thermal_envelope(aphiaid, resolution=self.resolution, as_geopandas=False)
+        sp = get_speedy(self.speedy_data)
+        with metrics.timer("speedy_summary"):
+            summary = sp.get_summary(aphiaid, resolution=self.resolution, as_geopandas=False)
+            envelope = sp.get_thermal_envelope(aphiaid, resolution=self.resolution, as_geopandas=False)
 
-        aggregated = self.summarize(summary, envelope)
+        with metrics.timer("risk_aggregation"):
+            aggregated = self.summarize(summary, envelope)
+        metrics.count("risk_analyses")
         global_impact = bool(summary.invasiveness_invasive.any())
         on_priority_list = aphiaid in self.priority_taxa
 
@@ -136,3 +156,171 @@ class RiskEngine:
         risk_analysis.risk_level = risk_level
 
         return risk_analysis
+
+    def load_taxa(self, taxa: list[int]) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """Load summaries and thermal envelopes for all taxa, keeping only rows for the area cells."""
+
+        sp = get_speedy(self.speedy_data)
+        cells = set(self.h3["h3"])
+
+        summaries = []
+        envelopes = []
+        global_impact = []
+
+        for i, aphiaid in enumerate(taxa):
+            logging.info(f"Loading summary and thermal envelope for {aphiaid} ({i + 1} / {len(taxa)})")
+            with metrics.timer("speedy_summary"):
+                summary = sp.get_summary(aphiaid, resolution=self.resolution, as_geopandas=False)
+                envelope = sp.get_thermal_envelope(aphiaid, resolution=self.resolution, as_geopandas=False)
+
+            global_impact.append(bool(summary.invasiveness_invasive.any()))
+            summary = summary[summary["h3"].isin(cells)]
+            if len(summary) > 0:
+                summaries.append(summary.assign(taxon=aphiaid))
+            if envelope is not None:
+                envelope = envelope[envelope["h3"].isin(cells)]
+                if len(envelope) > 0:
+                    envelopes.append(envelope[["h3"]].assign(taxon=aphiaid))
+
+        summary_columns = {
+            "taxon": "int64",
+            "h3": "string",
+            "source_obis": "bool",
+            "source_gbif": "bool",
+            "records": "int64",
+            "min_year": "int64",
+            "max_year": "int64",
+            "establishmentMeans_native": "bool",
+            "establishmentMeans_introduced": "bool",
+            "invasiveness_invasive": "bool",
+            "invasiveness_concern": "bool"
+        }
+        if len(summaries) > 0:
+            summary = pd.concat(summaries, ignore_index=True)[list(summary_columns.keys())]
+        else:
+            summary = pd.DataFrame({col: pd.Series(dtype=dtype) for col, dtype in summary_columns.items()})
+
+        if len(envelopes) > 0:
+            envelope = pd.concat(envelopes, ignore_index=True)
+        else:
+            envelope = pd.DataFrame({"h3": pd.Series(dtype="string"), "taxon": pd.Series(dtype="int64")})
+
+        taxa = pd.DataFrame({"position": np.arange(len(taxa)), "taxon": pd.Series(taxa, dtype="int64"), "global_impact": global_impact})
+
+        return taxa, summary, envelope
+
+    def summarize_all(self, taxa: pd.DataFrame, summary: pd.DataFrame, envelope: pd.DataFrame) -> pd.DataFrame:
+
+        conn = self.connection()
+        conn.register("taxa", taxa)
+        conn.register("summary", summary)
+        conn.register("envelope", envelope)
+
+        aggregated = conn.execute("""
+            with summary_cells as (
+                select
+                    taxon,
+                    max(source_obis) as source_obis,
+                    max(source_gbif) as source_gbif,
+                    sum(records) as records,
+                    min(min_year) as min_year,
+                    max(max_year) as max_year,
+                    max(establishmentMeans_native) as establishmentMeans_native,
+                    max(establishmentMeans_introduced) as establishmentMeans_introduced,
+                    max(invasiveness_invasive) as invasiveness_invasive,
+                    max(invasiveness_concern) as invasiveness_concern
+                from summary
+                where h3 in (select h3 from cells)
+                group by taxon
+            ), envelope_cells as (
+                select taxon, true as thermal
+                from envelope
+                where h3 in (select h3 from cells)
+                group by taxon
+            )
+            select
+                taxa.taxon,
+                taxa.global_impact,
+                summary_cells.source_obis,
+                summary_cells.source_gbif,
+                summary_cells.records,
+                summary_cells.min_year,
+                summary_cells.max_year,
+                coalesce(summary_cells.establishmentMeans_native, false) as establishmentMeans_native,
+                coalesce(summary_cells.establishmentMeans_introduced, false) as establishmentMeans_introduced,
+                coalesce(summary_cells.invasiveness_invasive, false) as invasiveness_invasive,
+                coalesce(summary_cells.invasiveness_concern, false) as invasiveness_concern,
+                coalesce(envelope_cells.thermal, false) as thermal
+            from taxa
+            left join summary_cells on summary_cells.taxon = taxa.taxon
+            left join envelope_cells on envelope_cells.taxon = taxa.taxon
+            order by taxa.position
+        """).fetchdf()
+        for name in ["taxa", "summary", "envelope"]:
+            conn.unregister(name)
+
+        aggregated["on_priority_list"] = aggregated["taxon"].isin(self.priority_taxa)
+
+        return aggregated
+
+    def risk_levels(self, aggregated: pd.DataFrame) -> np.ndarray:
+        """Vectorized version of the risk level decision tree in calculate_risk."""
+
+        priority = aggregated["on_priority_list"].to_numpy(dtype=bool)
+        native = aggregated["establishmentMeans_native"].to_numpy(dtype=bool)
+        introduced = aggregated["establishmentMeans_introduced"].to_numpy(dtype=bool)
+        invasive = aggregated["invasiveness_invasive"].to_numpy(dtype=bool) | aggregated["invasiveness_concern"].to_numpy(dtype=bool)
+        thermal = aggregated["thermal"].to_numpy(dtype=bool)
+        global_impact = aggregated["global_impact"].to_numpy(dtype=bool)
+
+        return np.select(
+            [
+                priority,
+                native,
+                introduced & (invasive | global_impact),
+                introduced,
+                thermal & global_impact
+            ],
+            [
+                RiskLevel.HIGH,
+                RiskLevel.NONE,
+                RiskLevel.HIGH,
+                RiskLevel.MEDIUM,
+                RiskLevel.MEDIUM
+            ],
+            default=RiskLevel.LOW
+        )
+
+    def calculate_all(self, taxa: list[int]) -> list[RiskAnalysis]:
+        """Calculate risk for all taxa with a single aggregation query."""
+
+        taxa_table, summary, envelope = self.load_taxa(list(taxa))
+        with metrics.timer("risk_aggregation"):
+            aggregated = self.summarize_all(taxa_table, summary, envelope)
+            aggregated["risk_level"] = self.risk_levels(aggregated)
+        metrics.count("risk_analyses", len(aggregated))
+
+        date = datetime.now().isoformat()
+
+        return [
+            RiskAnalysis(
+                taxon=int(row["taxon"]),
+                area=self.area,
+                date=date,
+                software="pacmandetections",
+                software_version=None,
+                description=None,
+                records=None if pd.isna(row["records"]) else int(row["records"]),
+                min_year=None if pd.isna(row["min_year"]) else int(row["min_year"]),
+                max_year=None if pd.isna(row["max_year"]) else int(row["max_year"]),
+                establishmentMeans_native=bool(row["establishmentMeans_native"]),
+                establishmentMeans_introduced=bool(row["establishmentMeans_introduced"]),
+                invasiveness_invasive=bool(row["invasiveness_invasive"]),
+                invasiveness_concern=bool(row["invasiveness_concern"]),
+                thermal=bool(row["thermal"]),
+                global_impact=bool(row["global_impact"]),
+                on_priority_list=bool(row["on_priority_list"]),
+                risk_level=row["risk_level"]
+            )
+            for row in aggregated.to_dict(orient="records")
+        ]
@@ -0,0 +1,164 @@
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Generator
+import logging
+import os
+import traceback
+from termcolor import colored
+from pacmandetections import DetectionEngine
+from pacmandetections.columnar import ColumnarDetectionEngine
+from pacmandetections.model import Detection, Source
+from pacmandetections.sources import OBISAPISource
+from pacmandetections.taxa import wrims_registry
+from pacmandetections.assessment import AssessmentCache, get_speedy, speedy_data_version
+from pacmandetections.establishment import EstablishmentIndex, load_current_index
+from pacmandetections.state import DetectionState
+from pacmandetections.metrics import metrics
+
+
+@dataclass
+class CellResult:
+    cell: str
+    detections: list[Detection]
+    error: str
+    metrics: dict = field(default_factory=dict)
+
+
+# state kept warm in each worker process, set up once by the pool initializer
+
+worker_state = dict()
+
+
+def init_worker(days: int, sources: list[Source], area: int, speedy_data: str, assessment_cache_path: str, state_path: str, columnar: bool = False, streaming: bool = False, establishment_index_path: str = None, assessment_cache_ttl: timedelta = None, assessment_cache_version: str = None) -> None:
+
+    worker_state["days"] = days
+    worker_state["sources"] = sources
+    worker_state["area"] = area
+    worker_state["speedy_data"] = speedy_data
+    worker_state["wrims"] = wrims_registry()
+    worker_state["assessment_cache"] = AssessmentCache(path=assessment_cache_path, version=assessment_cache_version, ttl=assessment_cache_ttl)
+    worker_state["state"] = DetectionState(state_path) if state_path else None
+    worker_state["engine_class"] = ColumnarDetectionEngine if columnar else DetectionEngine
+    worker_state["streaming"] = streaming
+    worker_state["establishment_index"] = EstablishmentIndex.load(establishment_index_path) if establishment_index_path else None
+
+    # warm the process wide Speedy handle
+
+    if speedy_data:
+        get_speedy(speedy_data)
+
+
+def generate_cell(cell: str) -> CellResult:
+
+    # metrics are collected per cell and merged in the parent process
+
+    metrics.reset()
+
+    try:
+        engine = worker_state["engine_class"](
+            h3=cell,
+            days=worker_state["days"],
+            sources=worker_state["sources"],
+            area=worker_state["area"],
+            speedy_data=worker_state["speedy_data"],
+            wrims=worker_state["wrims"],
+            assessment_cache=worker_state["assessment_cache"],
+            establishment_index=worker_state["establishment_index"]
+        )
+        if worker_state["state"] is not None:
+            detections = engine.generate_incremental(worker_state["state"])
+        elif worker_state["streaming"]:
+            detections = engine.generate_streaming()
+        else:
+            detections = engine.generate()
+        return CellResult(cell=cell, detections=detections, error=None, metrics=metrics.report())
+    except Exception:
+        return CellResult(cell=cell, detections=[], error=traceback.format_exc(), metrics=metrics.report())
+
+
+class ParallelDetectionRunner:
+    """Generates detections for cells in a process pool, yielding results in completion order.
+
+    Used as a context manager the pool is kept between calls to run, so workers stay warm across chunks of cells.
+    """
+
+    def __init__(self, cells: list[str] = None, workers: int = None, days: int = 365, sources: list[Source] = [OBISAPISource()], area: int = None, speedy_data: str = None, assessment_cache_path: str = None, state_path: str = None, columnar: bool = False, streaming: bool = False, establishment_index_path: str = None, assessment_cache_ttl: timedelta = None, assessment_cache_version: str = None):
+
+        if streaming and state_path:
+            raise ValueError("streaming generation does not support incremental state")
+
+        self.cells = list(cells) if cells is not None else []
+        self.workers = workers or os.cpu_count()
+        self.days = days
+        self.sources = sources
+        self.area = area
+        self.speedy_data = speedy_data
+        self.assessment_cache_path = assessment_cache_path
+        self.state_path = state_path
+        self.columnar = columnar
+        self.streaming = streaming
+        self.assessment_cache_ttl = assessment_cache_ttl
+
+        # the Speedy data version is determined once here rather than in every worker, an establishment index built
+        # from another version is not used
+
+        speedy_version = assessment_cache_version
+        if speedy_version is None and (assessment_cache_path or establishment_index_path):
+            speedy_version = speedy_data_version(speedy_data)
+        self.assessment_cache_version = speedy_version if assessment_cache_path else None
+        if establishment_index_path and load_current_index(establishment_index_path, speedy_version) is None:
+            establishment_index_path = None
+        self.establishment_index_path = establishment_index_path
+        self.failed = []
+        self.executor = None
+
+    def __enter__(self):
+        self.open()
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def open(self) -> ProcessPoolExecutor:
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers, initializer=init_worker, initargs=(self.days, self.sources, self.area, self.speedy_data, self.assessment_cache_path, self.state_path, self.columnar, self.streaming, self.establishment_index_path, self.assessment_cache_ttl, self.assessment_cache_version))
+        return self.executor
+
+    def close(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+    def run(self, cells: list[str] = None) -> Generator[CellResult, None, None]:
+        """Generate detections for cells, by default the cells passed to the runner."""
+
+        cells = self.cells if cells is None else list(cells)
+        failed = []
+
+        logging.info(f"Generating detections for {len(cells)} cells with {self.workers} workers")
+
+        # without a surrounding context the pool only lives for this run
+
+        owned = self.executor is None
+        executor = self.open()
+
+        try:
+            futures = [executor.submit(generate_cell, cell) for cell in cells]
+            for i, future in enumerate(as_completed(futures)):
+                result = future.result()
+                if result.metrics:
+                    metrics.merge(result.metrics)
+                if result.error is not None:
+                    failed.append(result)
+                    logging.error(f"Failed to generate detections for cell {result.cell}: {result.error}")
+                else:
+                    logging.info(colored(f"Generated {len(result.detections)} detections for cell {result.cell} ({i + 1} / {len(cells)})", "blue"))
+                yield result
+        finally:
+            if owned:
+                self.close()
+
+        self.failed.extend(failed)
+        if len(failed) > 0:
+            logging.error(f"Detection generation failed for {len(failed)} of {len(cells)} cells: {', '.join(result.cell for result in failed)}")
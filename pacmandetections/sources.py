@@ -1,10 +1,26 @@
-from shapely import Geometry
+from shapely import Geometry, box, from_wkt, intersects_xy
 from pyobis import occurrences
 import pandas as pd
 from pacmandetections.model import Occurrence, Source
 import requests
 from typing import Generator
-from pacmandetections.util import try_float
+from pacmandetections.util import try_float, split_date_range, create_session, intern, aphiaid_from_lsid, cells_for_points, split_antimeridian, unwrap_antimeridian
+from pacmandetections.cache import PageCache
+from pacmandetections.metrics import metrics
+from pacmandetections.taxa import wrims_registry
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from time import perf_counter
+from itertools import chain
+from h3 import geo_to_h3, k_ring
+from pacmandetections.geometry import polyfill_parts
+import xml.etree.ElementTree as ET
+import duckdb
+import logging
+import numpy as np
+import os
+import tempfile
+import zipfile
 
 
 class PyOBISSource(Source):
@@ -36,63 +52,540 @@ class PyOBISSource(Source):
 
 class OBISAPISource(Source):
 
-    def __init__(self):
+    def __init__(self, cache: PageCache = None):
         self.rank = "genus"
+        self.cache = cache
+        self.session = None
 
-    def fetch(self, shape: Geometry, start_date, end_date) -> Generator[Occurrence, None, None]:
+    def fetch_page(self, wkt: str, start_date_str: str, end_date_str: str, after, closed: bool = False) -> list[dict]:
 
-        start_date_str = str(start_date)[0:10]
-        end_date_str = str(end_date)[0:10]
-        wkt = str(shape)
+        if self.cache is not None:
+            key = self.cache.key(wkt, start_date_str, end_date_str, after)
+            results = self.cache.get(key, closed=closed)
+            if results is not None:
+                return results
+            if self.cache.offline:
+                logging.warning(f"Page {start_date_str} - {end_date_str} after {after} not in cache, skipping in offline mode")
+                return []
+
+        url = f"https://api.obis.org/v3/occurrence?geometry={wkt}&startdate={start_date_str}&enddate={end_date_str}&after={after}&dna=true&size=10000"
+        start = perf_counter()
+        res = self.session.get(url) if self.session is not None else requests.get(url)
+        metrics.observe("obis_request_seconds", perf_counter() - start)
+        with metrics.timer("obis_json"):
+            results = res.json()["results"]
+        metrics.count("obis_pages")
+
+        if self.cache is not None:
+            self.cache.put(key, results)
+
+        return results
+
+    def occurrence_from_result(self, result: dict) -> Occurrence:
+
+        if dnas := result.get("dna"):
+            if len(dnas) > 0:
+                dna = dnas[0]
+                result["target_gene"] = dna.get("target_gene")
+                result["DNA_sequence"] = dna.get("DNA_sequence")
+
+        return Occurrence(
+            id=result.get("id"),
+            scientificName=intern(result.get("scientificName")),
+            AphiaID=result.get("speciesid"),
+            eventDate=result.get("eventDate"),
+            decimalLongitude=result.get("decimalLongitude"),
+            decimalLatitude=result.get("decimalLatitude"),
+            catalogNumber=result.get("catalogNumber"),
+            eventID=result.get("eventID"),
+            materialSampleID=result.get("materialSampleID"),
+            establishmentMeans=intern(result.get("establishmentMeans")),
+            occurrenceRemarks=result.get("occurrenceRemarks"),
+            associatedMedia=result.get("associatedMedia"),
+            datasetID=intern(result.get("datasetID")),
+            datasetName=intern(result.get("datasetName")),
+            target_gene=intern(result.get("target_gene")),
+            DNA_sequence=result.get("DNA_sequence"),
+            identificationRemarks=result.get("identificationRemarks"),
+            organismQuantity=try_float(result.get("organismQuantity"))
+        )
+
+    def fetch_window(self, wkt: str, start_date_str: str, end_date_str: str, closed: bool = False) -> Generator[dict, None, None]:
 
         after = 0
 
         while True:
-            url = f"https://api.obis.org/v3/occurrence?geometry={wkt}&startdate={start_date_str}&enddate={end_date_str}&after={after}&dna=true&size=10000"
-            res = requests.get(url)
-            results = res.json()["results"]
+            results = self.fetch_page(wkt, start_date_str, end_date_str, after, closed=closed)
             if len(results) == 0:
                 break
-            rank_results = [record for record in results if record.get(f"{self.rank}id")]
-
-            for result in rank_results:
-
-                if dnas := result.get("dna"):
-                    if len(dnas) > 0:
-                        dna = dnas[0]
-                        result["target_gene"] = dna.get("target_gene")
-                        result["DNA_sequence"] = dna.get("DNA_sequence")
-
-                occurrence = Occurrence(
-                    id=result.get("id"),
-                    scientificName=result.get("scientificName"),
-                    AphiaID=result.get("speciesid"),
-                    eventDate=result.get("eventDate"),
-                    decimalLongitude=result.get("decimalLongitude"),
-                    decimalLatitude=result.get("decimalLatitude"),
-                    catalogNumber=result.get("catalogNumber"),
-                    eventID=result.get("eventID"),
-                    materialSampleID=result.get("materialSampleID"),
-                    establishmentMeans=result.get("establishmentMeans"),
-                    occurrenceRemarks=result.get("occurrenceRemarks"),
-                    associatedMedia=result.get("associatedMedia"),
-                    datasetID=result.get("datasetID"),
-                    datasetName=result.get("datasetName"),
-                    target_gene=result.get("target_gene"),
-                    DNA_sequence=result.get("DNA_sequence"),
-                    identificationRemarks=result.get("identificationRemarks"),
-                    organismQuantity=try_float(result.get("organismQuantity"))
-                )
-
-                yield occurrence
-
+            yield from (record for record in results if record.get(f"{self.rank}id"))
             after = results[-1]["id"]
 
+    def fetch_parts(self, parts: list[Geometry], start_date, end_date) -> Generator[Occurrence, None, None]:
+        """Fetch the parts of a shape in parallel, deduplicating records by id."""
+
+        seen = set()
+
+        with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+            for future in as_completed([executor.submit(lambda part: list(self.fetch(part, start_date, end_date)), part) for part in parts]):
+                for occurrence in future.result():
+                    if occurrence.id in seen:
+                        continue
+                    seen.add(occurrence.id)
+                    yield occurrence
+
+    def fetch(self, shape: Geometry | str, start_date, end_date) -> Generator[Occurrence, None, None]:
+
+        wkt = shape if isinstance(shape, str) else str(shape)
+        if isinstance(shape, str):
+            shape = from_wkt(shape)
+
+        # shapes crossing the antimeridian are queried per part
+
+        parts = split_antimeridian(shape)
+        if len(parts) > 1:
+            yield from self.fetch_parts(parts, start_date, end_date)
+            return
+
+        if self.cache is None:
+            for result in self.fetch_window(wkt, str(start_date)[0:10], str(end_date)[0:10]):
+                yield self.occurrence_from_result(result)
+            return
+
+        # with a cache, query per calendar month so closed months keep stable cache keys across runs
+
+        closed_before = date.today() - self.cache.closed_after
+        seen = set()
+
+        for window_start, window_end in split_date_range(start_date, end_date):
+            for result in self.fetch_window(wkt, str(window_start), str(window_end), closed=window_end < closed_before):
+                if result.get("id") in seen:
+                    continue
+                seen.add(result.get("id"))
+                yield self.occurrence_from_result(result)
+
     def __str__(self):
         return "OBIS (API)"
 
 
+class ShardedOBISAPISource(OBISAPISource):
+    """OBIS API source fetching monthly time windows, and optionally a grid of geometry parts, concurrently."""
+
+    def __init__(self, cache: PageCache = None, max_workers: int = 8, grid: int = 1):
+        super().__init__(cache=cache)
+        self.max_workers = max_workers
+        self.grid = grid
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["session"] = None
+        return state
+
+    def shard_geometries(self, shape: Geometry) -> list[Geometry]:
+
+        shapes = split_antimeridian(shape)
+        if self.grid <= 1:
+            return shapes
+
+        parts = []
+        for shape in shapes:
+            minx, miny, maxx, maxy = shape.bounds
+            width = (maxx - minx) / self.grid
+            height = (maxy - miny) / self.grid
+            for i in range(self.grid):
+                for j in range(self.grid):
+                    part = shape.intersection(box(minx + i * width, miny + j * height, minx + (i + 1) * width, miny + (j + 1) * height))
+                    if not part.is_empty:
+                        parts.append(part)
+        return parts
+
+    def fetch_shard(self, wkt: str, start_date_str: str, end_date_str: str, closed: bool) -> list[dict]:
+        return list(self.fetch_window(wkt, start_date_str, end_date_str, closed=closed))
+
+    def fetch(self, shape: Geometry | str, start_date, end_date) -> Generator[Occurrence, None, None]:
+
+        if isinstance(shape, str):
+            shape = from_wkt(shape)
+        if self.session is None:
+            self.session = create_session(pool_size=self.max_workers)
+
+        closed_after = self.cache.closed_after if self.cache is not None else timedelta(days=30)
+        closed_before = date.today() - closed_after
+
+        shards = [
+            (str(part), str(window_start), str(window_end), window_end < closed_before)
+            for part in self.shard_geometries(shape)
+            for window_start, window_end in split_date_range(start_date, end_date)
+        ]
+        logging.info(f"Fetching {len(shards)} shards with {self.max_workers} workers")
+
+        # shards are yielded as they complete, records on shard boundaries are deduplicated by id
+
+        seen = set()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for future in as_completed([executor.submit(self.fetch_shard, *shard) for shard in shards]):
+                for result in future.result():
+                    if result.get("id") in seen:
+                        continue
+                    seen.add(result.get("id"))
+                    yield self.occurrence_from_result(result)
+
+    def __str__(self):
+        return "OBIS (API, sharded)"
+
+
+PARQUET_COLUMNS = {
+    "id": "id",
+    "scientificName": "scientificName",
+    "AphiaID": "speciesid",
+    "eventDate": "eventDate",
+    "decimalLongitude": "decimalLongitude",
+    "decimalLatitude": "decimalLatitude",
+    "catalogNumber": "catalogNumber",
+    "eventID": "eventID",
+    "materialSampleID": "materialSampleID",
+    "establishmentMeans": "establishmentMeans",
+    "occurrenceRemarks": "occurrenceRemarks",
+    "associatedMedia": "associatedMedia",
+    "datasetID": "dataset_id",
+    "datasetName": "datasetName",
+    "target_gene": "target_gene",
+    "DNA_sequence": "DNA_sequence",
+    "identificationRemarks": "identificationRemarks",
+    "organismQuantity": "organismQuantity"
+}
+
+
+def occurrence_from_batch(data: dict[str, list], i: int) -> Occurrence:
+    """Create an occurrence from row i of a record batch with columns named after the Occurrence fields."""
+
+    return Occurrence(
+        id=data["id"][i],
+        scientificName=intern(data["scientificName"][i]),
+        AphiaID=int(data["AphiaID"][i]),
+        eventDate=data["eventDate"][i],
+        decimalLongitude=data["decimalLongitude"][i],
+        decimalLatitude=data["decimalLatitude"][i],
+        catalogNumber=data["catalogNumber"][i],
+        eventID=data["eventID"][i],
+        materialSampleID=data["materialSampleID"][i],
+        establishmentMeans=intern(data["establishmentMeans"][i]),
+        occurrenceRemarks=data["occurrenceRemarks"][i],
+        associatedMedia=data["associatedMedia"][i],
+        datasetID=intern(data["datasetID"][i]),
+        datasetName=intern(data["datasetName"][i]),
+        target_gene=intern(data["target_gene"][i]),
+        DNA_sequence=data["DNA_sequence"][i],
+        identificationRemarks=data["identificationRemarks"][i],
+        organismQuantity=try_float(data["organismQuantity"][i])
+    )
+
+
+class ParquetOccurrenceSource(Source):
+    """Occurrences from a local OBIS Parquet export, queried with DuckDB.
+
+    The date range, bounding box, DNA and rank predicates are pushed down to the Parquet scan, the exact geometry
+    test is applied per Arrow batch. Columns are mapped to Occurrence fields with the columns argument, mapped
+    columns which are not in the export are read as null.
+    """
+
+    def __init__(self, path: str, columns: dict[str, str] = None, date_columns: tuple[str, str] = ("date_start", "date_end"), dna_column: str = "DNA_sequence", rank_column: str = "genusid", batch_size: int = 100000):
+        self.path = os.path.expanduser(path)
+        self.columns = {**PARQUET_COLUMNS, **(columns or dict())}
+        self.date_columns = date_columns
+        self.dna_column = dna_column
+        self.rank_column = rank_column
+        self.batch_size = batch_size
+
+    def relation(self) -> str:
+        path = self.path.replace("'", "''")
+        if os.path.isdir(self.path):
+            path = os.path.join(path, "**", "*.parquet")
+        return f"read_parquet('{path}', union_by_name = true)"
+
+    def column_types(self, conn: duckdb.DuckDBPyConnection) -> dict[str, str]:
+        return {row[0]: row[1] for row in conn.execute(f"describe select * from {self.relation()}").fetchall()}
+
+    def date_predicate(self, column: str, column_type: str, operator: str) -> str:
+
+        # the OBIS export stores dates as epoch milliseconds
+
+        if "INT" in column_type:
+            return f"\"{column}\" {operator} epoch_ms(?::timestamp)"
+        return f"\"{column}\"::date {operator} ?::date"
+
+    def query(self, shape: Geometry, column_types: dict[str, str]) -> str:
+
+        select = [f"\"{column}\" as \"{field}\"" if column in column_types else f"null as \"{field}\"" for field, column in self.columns.items()]
+
+        # a bounding box per side of the antimeridian, the bounds of the whole shape would span the globe
+
+        lon = self.columns["decimalLongitude"]
+        lat = self.columns["decimalLatitude"]
+        boxes = []
+        for part in split_antimeridian(shape):
+            minx, miny, maxx, maxy = part.bounds
+            boxes.append(f"(\"{lon}\" between {minx} and {maxx} and \"{lat}\" between {miny} and {maxy})")
+
+        where = [
+            f"({' or '.join(boxes)})",
+            f"\"{self.columns['AphiaID']}\" is not null",
+            self.date_predicate(self.date_columns[0], column_types[self.date_columns[0]], ">="),
+            self.date_predicate(self.date_columns[1], column_types[self.date_columns[1]], "<=")
+        ]
+        if self.dna_column is not None and self.dna_column in column_types:
+            where.append(f"\"{self.dna_column}\" is not null")
+        if self.rank_column is not None and self.rank_column in column_types:
+            where.append(f"\"{self.rank_column}\" is not null")
+
+        return f"select {', '.join(select)} from {self.relation()} where {' and '.join(where)}"
+
+    def fetch(self, shape: Geometry, start_date, end_date) -> Generator[Occurrence, None, None]:
+
+        conn = duckdb.connect()
+        query = self.query(shape, self.column_types(conn))
+        reader = conn.execute(query, [str(start_date)[0:10], str(end_date)[0:10]]).fetch_record_batch(self.batch_size)
+
+        # the exact test uses the same parts as the bounding boxes, so rows across the antimeridian are kept
+
+        exact = unwrap_antimeridian(shape)
+
+        for batch in reader:
+            data = batch.to_pydict()
+
+            # exact geometry test, the bounding box was applied in the scan
+
+            lons = np.array(data["decimalLongitude"], dtype=float)
+            lats = np.array(data["decimalLatitude"], dtype=float)
+            inside = intersects_xy(exact, lons, lats)
+            metrics.count("parquet_rows_scanned", len(inside))
+
+            for i in np.flatnonzero(inside):
+                yield occurrence_from_batch(data, i)
+
+        conn.close()
+
+    def __str__(self):
+        return f"OBIS (Parquet, {self.path})"
+
+
+GBIF_TERMS = {
+    "id": "gbifID",
+    "scientificName": "scientificName",
+    "eventDate": "eventDate",
+    "decimalLongitude": "decimalLongitude",
+    "decimalLatitude": "decimalLatitude",
+    "catalogNumber": "catalogNumber",
+    "eventID": "eventID",
+    "materialSampleID": "materialSampleID",
+    "establishmentMeans": "establishmentMeans",
+    "occurrenceRemarks": "occurrenceRemarks",
+    "associatedMedia": "associatedMedia",
+    "datasetID": "datasetKey",
+    "datasetName": "datasetName",
+    "identificationRemarks": "identificationRemarks",
+    "organismQuantity": "organismQuantity",
+    "scientificNameID": "scientificNameID",
+    "species": "species",
+    "verbatimScientificName": "verbatimScientificName",
+    "basisOfRecord": "basisOfRecord"
+}
+
+GBIF_DNA_TERMS = {
+    "target_gene": "target_gene",
+    "DNA_sequence": "DNA_sequence"
+}
+
+DWCA_NAMESPACE = {"dwca": "http://rs.tdwg.org/dwc/text/"}
+
+
 class GBIFSource(Source):
+    """GBIF occurrences from a local DuckDB store built from occurrence downloads.
 
-    def fetch(self, shape: Geometry, start_date, end_date) -> list[Occurrence]:
-        pass
+    Downloads in DwC-A format, including the DNA derived data extension, or in SIMPLE_PARQUET format are ingested
+    into a table indexed by H3 cell and day. AphiaIDs are taken from WoRMS LSIDs in scientificNameID, or matched
+    on name against WRiMS. Records without an AphiaID are not stored.
+    """
+
+    def __init__(self, path: str, resolution: int = 7, batch_size: int = 100000):
+        self.path = os.path.expanduser(path)
+        self.resolution = resolution
+        self.batch_size = batch_size
+
+    def connect(self) -> duckdb.DuckDBPyConnection:
+
+        conn = duckdb.connect(self.path)
+        conn.execute("""
+            create table if not exists occurrence (
+                id varchar primary key,
+                scientificName varchar,
+                AphiaID integer,
+                eventDate varchar,
+                decimalLongitude double,
+                decimalLatitude double,
+                catalogNumber varchar,
+                eventID varchar,
+                materialSampleID varchar,
+                establishmentMeans varchar,
+                occurrenceRemarks varchar,
+                associatedMedia varchar,
+                datasetID varchar,
+                datasetName varchar,
+                target_gene varchar,
+                DNA_sequence varchar,
+                identificationRemarks varchar,
+                organismQuantity double,
+                h3 varchar,
+                day date,
+                dna boolean
+            )
+        """)
+        conn.execute("create index if not exists occurrence_h3_day on occurrence (h3, day)")
+        return conn
+
+    def term_columns(self, conn: duckdb.DuckDBPyConnection, relation: str, terms: dict[str, str]) -> dict[str, str]:
+        """Map fields to term columns in a relation by case insensitive column name, as null if missing."""
+
+        columns = {row[0].lower(): row[0] for row in conn.execute(f"describe select * from {relation}").fetchall()}
+        return {field: f"cast(\"{columns[term.lower()]}\" as varchar)" if term.lower() in columns else "null" for field, term in terms.items()}
+
+    def archive_relation(self, conn: duckdb.DuckDBPyConnection, directory: str) -> str:
+        """Query for the core and DNA derived data extension files of an unpacked DwC-A."""
+
+        meta = ET.parse(os.path.join(directory, "meta.xml")).getroot()
+
+        def table(element) -> tuple[str, int]:
+            location = element.find("dwca:files/dwca:location", DWCA_NAMESPACE).text
+            file = os.path.join(directory, location).replace("'", "''")
+            id_element = element.find("dwca:id", DWCA_NAMESPACE)
+            if id_element is None:
+                id_element = element.find("dwca:coreid", DWCA_NAMESPACE)
+            return f"read_csv('{file}', delim = '\\t', header = true, quote = '', escape = '', all_varchar = true)", int(id_element.get("index", 0))
+
+        core, core_id = table(meta.find("dwca:core", DWCA_NAMESPACE))
+        core_columns = [row[0] for row in conn.execute(f"describe select * from {core}").fetchall()]
+        select = ", ".join(f"{column} as \"{field}\"" for field, column in self.term_columns(conn, core, GBIF_TERMS).items())
+
+        extensions = [extension for extension in meta.findall("dwca:extension", DWCA_NAMESPACE) if extension.get("rowType", "").endswith("DNADerivedData")]
+        if len(extensions) == 0:
+            return f"select {select}, null as target_gene, null as DNA_sequence from {core} core"
+
+        # occurrences can have several DNA records, the first one is used as in the OBIS API source
+
+        dna, dna_id = table(extensions[0])
+        dna_columns = [row[0] for row in conn.execute(f"describe select * from {dna}").fetchall()]
+        dna_select = ", ".join(f"first({column}) as \"{field}\"" for field, column in self.term_columns(conn, dna, GBIF_DNA_TERMS).items())
+
+        return f"""
+            select {select}, dna.target_gene, dna.DNA_sequence
+            from {core} core
+            left join (select "{dna_columns[dna_id]}" as coreid, {dna_select} from {dna} group by 1) dna
+            on dna.coreid = core."{core_columns[core_id]}"
+        """
+
+    def parquet_relation(self, conn: duckdb.DuckDBPyConnection, directory: str) -> str:
+        """Query for the Parquet files of a SIMPLE_PARQUET download, which has no DNA derived data."""
+
+        files = os.path.join(directory, "**", "*").replace("'", "''") if os.path.isdir(directory) else directory.replace("'", "''")
+        relation = f"read_parquet('{files}', union_by_name = true)"
+        select = ", ".join(f"{column} as \"{field}\"" for field, column in self.term_columns(conn, relation, GBIF_TERMS).items())
+        return f"select {select}, null as target_gene, null as DNA_sequence from {relation}"
+
+    def prepare(self, batch: pd.DataFrame, names: dict[str, int]) -> pd.DataFrame:
+        """Resolve AphiaIDs, H3 cells and days for a batch of download records."""
+
+        lsids = batch["scientificNameID"].map(lambda value: aphiaid_from_lsid(value) if isinstance(value, str) else None)
+        aphiaids = lsids.combine_first(batch["species"].map(names)).combine_first(batch["scientificName"].map(names)).combine_first(batch["verbatimScientificName"].map(names))
+
+        # intervals are stored with their start date, which is used for the day of detections
+
+        batch = batch.assign(
+            AphiaID=aphiaids,
+            eventDate=batch["eventDate"].str.split("/").str[0],
+            decimalLongitude=pd.to_numeric(batch["decimalLongitude"], errors="coerce"),
+            decimalLatitude=pd.to_numeric(batch["decimalLatitude"], errors="coerce"),
+            organismQuantity=pd.to_numeric(batch["organismQuantity"], errors="coerce")
+        )
+        batch = batch[batch["AphiaID"].notnull() & batch["decimalLongitude"].notnull() & batch["decimalLatitude"].notnull()]
+
+        return batch.assign(
+            AphiaID=batch["AphiaID"].astype(int),
+            h3=cells_for_points(batch["decimalLatitude"], batch["decimalLongitude"], self.resolution),
+            day=pd.to_datetime(batch["eventDate"].str[0:10], format="%Y-%m-%d", errors="coerce").dt.date,
+            dna=batch["DNA_sequence"].notnull() | batch["target_gene"].notnull() | (batch["basisOfRecord"] == "MATERIAL_SAMPLE")
+        ).drop(columns=["scientificNameID", "species", "verbatimScientificName", "basisOfRecord"])
+
+    def ingest(self, download: str) -> int:
+        """Ingest a GBIF occurrence download (zip file or unpacked directory) into the store, replacing records with the same gbifID."""
+
+        download = os.path.expanduser(download)
+        names = wrims_registry().name_index()
+        conn = self.connect()
+        stored = 0
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+
+            if zipfile.is_zipfile(download):
+                with zipfile.ZipFile(download) as archive:
+                    archive.extractall(temp_dir)
+                download = temp_dir
+
+            if os.path.exists(os.path.join(download, "meta.xml")):
+                relation = self.archive_relation(conn, download)
+            else:
+                relation = self.parquet_relation(conn, download)
+
+            reader = conn.cursor().execute(relation).fetch_record_batch(self.batch_size)
+
+            for batch in reader:
+                batch = self.prepare(batch.to_pandas(), names)
+                conn.register("batch", batch)
+                conn.execute("delete from occurrence where id in (select id from batch)")
+                conn.execute("insert into occurrence by name select * from batch")
+                conn.unregister("batch")
+                stored += len(batch)
+                logging.info(f"Stored {stored} GBIF occurrences")
+
+        conn.close()
+        return stored
+
+    def cells_for_shape(self, shape: Geometry) -> list[str]:
+
+        cells = set(polyfill_parts(shape, self.resolution))
+
+        # polyfill only returns cells with their center in the shape, neighbours cover the boundary and small shapes
+
+        if len(cells) == 0:
+            point = shape.representative_point()
+            cells = {geo_to_h3(point.y, point.x, self.resolution)}
+        return sorted(set(chain.from_iterable(k_ring(cell, 1) for cell in cells)))
+
+    def fetch(self, shape: Geometry, start_date, end_date) -> Generator[Occurrence, None, None]:
+
+        conn = duckdb.connect(self.path, read_only=True)
+        conn.register("cells", pd.DataFrame({"h3": self.cells_for_shape(shape)}))
+        reader = conn.execute(f"""
+            select {', '.join(field for field in PARQUET_COLUMNS)}
+            from occurrence
+            where h3 in (select h3 from cells) and day between ?::date and ?::date and dna
+        """, [str(start_date)[0:10], str(end_date)[0:10]]).fetch_record_batch(self.batch_size)
+
+        # the exact test uses the same parts as the cells, so records across the antimeridian are kept
+
+        exact = unwrap_antimeridian(shape)
+
+        for batch in reader:
+            data = batch.to_pydict()
+
+            # exact geometry test, cells were only a prefilter
+
+            inside = intersects_xy(exact, np.array(data["decimalLongitude"], dtype=float), np.array(data["decimalLatitude"], dtype=float))
+
+            for i in np.flatnonzero(inside):
+                yield occurrence_from_batch(data, i)
+
+        conn.close()
+
+    def __str__(self):
+        return f"GBIF ({self.path})"
@@ -0,0 +1,51 @@
+from pacmandetections.model import Detection
+from pacmandetections.util import SQLiteConnection
+import json
+import os
+import sqlite3
+
+
+class DetectionState:
+    """Local store of per-cell watermarks and previously generated detections for incremental runs."""
+
+    def __init__(self, path: str):
+        self.path = os.path.expanduser(path)
+        self.db = SQLiteConnection(self.path, [
+            "create table if not exists watermark (h3 text primary key, event_date text)",
+            "create table if not exists detection (h3 text, key text, scientificName text, data text, primary key (h3, key))"
+        ], timeout=30)
+
+    def connection(self) -> sqlite3.Connection:
+        return self.db.get()
+
+    def get_watermark(self, h3: str) -> str | None:
+        row = self.connection().execute("select event_date from watermark where h3 = ?", (h3,)).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, h3: str, event_date: str) -> None:
+        conn = self.connection()
+        conn.execute("insert or replace into watermark values (?, ?)", (h3, event_date))
+        conn.commit()
+
+    def get_detection(self, h3: str, key: str) -> Detection | None:
+        row = self.connection().execute("select scientificName, data from detection where h3 = ? and key = ?", (h3, key)).fetchone()
+        if row is None:
+            return None
+        return Detection.from_dict(json.loads(row[1]), scientificName=row[0])
+
+    def put_detection(self, h3: str, key: str, detection: Detection) -> bool:
+        """Store a detection, returning True if it is new or differs from the stored detection."""
+
+        data = detection.to_dict()
+        if data["media"] is not None:
+            data["media"] = sorted(data["media"], key=lambda media: media["thumbnail"])
+        serialized = json.dumps(data, sort_keys=True)
+
+        conn = self.connection()
+        row = conn.execute("select data from detection where h3 = ? and key = ?", (h3, key)).fetchone()
+        if row is not None and row[0] == serialized:
+            return False
+
+        conn.execute("insert or replace into detection values (?, ?, ?, ?)", (h3, key, detection.scientificName, serialized))
+        conn.commit()
+        return True
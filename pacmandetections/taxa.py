@@ -0,0 +1,149 @@
+from functools import lru_cache
+import argparse
+import importlib.resources
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+
+class WrimsRegistry:
+    """WRiMS taxa as a sorted AphiaID array with the names in a single UTF-8 blob.
+
+    The arrays are stored as .npy files in the package data and memory mapped, so worker processes share pages
+    instead of each building a dict. Lookups are binary searches, isin is vectorized.
+    """
+
+    def __init__(self, aphiaids: np.ndarray, names: np.ndarray, offsets: np.ndarray):
+        self.aphiaids = aphiaids
+        self.names = names
+        self.offsets = offsets
+
+    @staticmethod
+    def load(directory: str = None) -> "WrimsRegistry":
+        """Load the registry from a directory, by default the package data."""
+
+        directory = directory or str(importlib.resources.files("pacmandetections.data"))
+        return WrimsRegistry(
+            aphiaids=np.load(os.path.join(directory, "wrims_aphiaids.npy"), mmap_mode="r"),
+            names=np.load(os.path.join(directory, "wrims_names.npy"), mmap_mode="r"),
+            offsets=np.load(os.path.join(directory, "wrims_offsets.npy"), mmap_mode="r")
+        )
+
+    @staticmethod
+    def from_dict(taxa: dict[int, str]) -> "WrimsRegistry":
+
+        aphiaids = np.array(sorted(taxa), dtype=np.int64)
+        encoded = [taxa[aphiaid].encode("utf-8") for aphiaid in aphiaids.tolist()]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(name) for name in encoded])
+        names = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+
+        return WrimsRegistry(aphiaids=aphiaids, names=names, offsets=offsets)
+
+    def save(self, directory: str) -> None:
+        np.save(os.path.join(directory, "wrims_aphiaids.npy"), self.aphiaids)
+        np.save(os.path.join(directory, "wrims_names.npy"), self.names)
+        np.save(os.path.join(directory, "wrims_offsets.npy"), self.offsets)
+
+    def index(self, aphiaid) -> int | None:
+        if not isinstance(aphiaid, (int, np.integer)):
+            return None
+        i = int(np.searchsorted(self.aphiaids, aphiaid))
+        return i if i < len(self.aphiaids) and self.aphiaids[i] == aphiaid else None
+
+    def __contains__(self, aphiaid) -> bool:
+        return self.index(aphiaid) is not None
+
+    def __getitem__(self, aphiaid) -> str:
+        i = self.index(aphiaid)
+        if i is None:
+            raise KeyError(aphiaid)
+        return self.names[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def get(self, aphiaid, default: str = None) -> str | None:
+        return self[aphiaid] if aphiaid in self else default
+
+    def __len__(self) -> int:
+        return len(self.aphiaids)
+
+    def __iter__(self):
+        return iter(self.aphiaids.tolist())
+
+    def keys(self) -> list[int]:
+        return self.aphiaids.tolist()
+
+    def items(self) -> list[tuple[int, str]]:
+        return [(aphiaid, self[aphiaid]) for aphiaid in self]
+
+    def isin(self, aphiaids) -> np.ndarray:
+        """Vectorized membership test for an array of AphiaIDs."""
+
+        aphiaids = np.asarray(aphiaids, dtype=np.int64)
+        if len(self.aphiaids) == 0:
+            return np.zeros(len(aphiaids), dtype=bool)
+        positions = np.minimum(np.searchsorted(self.aphiaids, aphiaids), len(self.aphiaids) - 1)
+        return self.aphiaids[positions] == aphiaids
+
+    def name_index(self) -> dict[str, int]:
+        """Map names to AphiaIDs, for matching records without a WoRMS identifier."""
+        return {name: aphiaid for aphiaid, name in self.items()}
+
+
+@lru_cache(maxsize=None)
+def wrims_registry() -> WrimsRegistry:
+    """Get the process wide WRiMS registry, loaded lazily from the package data."""
+    return WrimsRegistry.load()
+
+
+def read_wrims_taxa(path: str) -> dict[int, str]:
+    """Read accepted species from the taxon file of the WRiMS DwC-A."""
+
+    taxon = pd.read_csv(path, sep="\t", quoting=3, dtype=str, keep_default_na=False, na_values=[""])
+    taxon["acceptedNameUsageID"] = taxon["acceptedNameUsageID"].fillna(taxon["taxonID"])
+    taxon = taxon[(taxon["taxonRank"] == "Species") & taxon["acceptedNameUsage"].notnull()]
+    taxon = taxon.assign(aphiaid=taxon["acceptedNameUsageID"].str.extract(r"([0-9]+)$", expand=False))
+    taxon = taxon[taxon["aphiaid"].notnull()].drop_duplicates(["aphiaid", "acceptedNameUsage"])
+
+    return {int(aphiaid): name for aphiaid, name in zip(taxon["aphiaid"], taxon["acceptedNameUsage"])}
+
+
+def rebuild(taxon_path: str, directory: str = None) -> WrimsRegistry:
+    """Rebuild the WRiMS list and registry files from the taxon file of the WRiMS DwC-A."""
+
+    directory = directory or str(importlib.resources.files("pacmandetections.data"))
+    taxa = read_wrims_taxa(taxon_path)
+
+    with open(os.path.join(directory, "wrims_aphiaids.txt"), "w") as f:
+        for aphiaid, name in taxa.items():
+            f.write(f"{aphiaid}\t{name}\n")
+
+    registry = WrimsRegistry.from_dict(taxa)
+    registry.save(directory)
+    logging.info(f"Stored {len(registry)} WRiMS taxa in {directory}")
+
+    return registry
+
+
+def main():
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(prog="pacmandetections.taxa", description="Rebuild the WRiMS taxon registry")
+    parser.add_argument("taxon", nargs="?", default=None, help="taxon.txt from the WRiMS DwC-A, by default the registry is rebuilt from wrims_aphiaids.txt")
+    parser.add_argument("--directory", default=None, help="output directory, by default the package data directory")
+    args = parser.parse_args()
+
+    if args.taxon:
+        rebuild(args.taxon, args.directory)
+    else:
+        directory = args.directory or str(importlib.resources.files("pacmandetections.data"))
+        with open(os.path.join(directory, "wrims_aphiaids.txt")) as f:
+            lines = [line.strip().split("\t") for line in f.readlines()]
+        registry = WrimsRegistry.from_dict({int(line[0].strip()): line[1] for line in lines})
+        registry.save(directory)
+        logging.info(f"Stored {len(registry)} WRiMS taxa in {directory}")
+
+
+if __name__ == "__main__":
+    main()
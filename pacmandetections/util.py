@@ -1,9 +1,33 @@
 import re
+import os
+import sys
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Callable
+import dateutil.parser
+from datetime import date, datetime, timedelta
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from shapely import Geometry, GeometryCollection, MultiPolygon, Polygon, box, get_parts, get_coordinates, transform, intersection
+from h3 import h3_to_geo_boundary, geo_to_h3
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
+
+lsid_pattern = re.compile(r"urn:lsid:marinespecies\.org:taxname:(\d+)")
+
+
+@lru_cache(maxsize=100000)
 def aphiaid_from_lsid(input: str) -> int | None:
-    pattern = r"urn:lsid:marinespecies\.org:taxname:(\d+)"
-    match = re.match(pattern, input)
+    match = lsid_pattern.match(input)
 
     if match:
         return int(match.group(1))
@@ -11,8 +35,203 @@ def aphiaid_from_lsid(input: str) -> int | None:
         return None
 
 
+def json_loads(value: str):
+    """Parse JSON with orjson when available, falling back to the standard library for input orjson rejects."""
+
+    if orjson is not None:
+        try:
+            return orjson.loads(value)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(value)
+
+
+@lru_cache(maxsize=100000)
+def parse_day(event_date: str) -> str:
+    """Get the day of an ISO 8601 date as YYYY-MM-DD."""
+
+    # fast path for plain dates and datetimes, other forms go through dateutil
+
+    if len(event_date) >= 10 and event_date[4] == "-" and event_date[7] == "-":
+        try:
+            if len(event_date) == 10:
+                date.fromisoformat(event_date)
+                return event_date
+            elif event_date[10] == "T":
+                datetime.fromisoformat(event_date)
+                return event_date[0:10]
+        except ValueError:
+            pass
+
+    return dateutil.parser.isoparse(event_date).strftime("%Y-%m-%d")
+
+
+def intern(value):
+    """Intern repeated categorical strings so records share a single copy."""
+    return sys.intern(value) if isinstance(value, str) else value
+
+
 def try_float(value) -> float:
     try:
         return float(value)
     except Exception:
         return None
+
+
+def split_antimeridian(shape: Geometry, wrap: bool = False) -> list[Geometry]:
+    """Split a shape with longitudes beyond -180 or 180 into parts with longitudes between -180 and 180.
+
+    With wrap, rings with edges longer than 180 degrees are taken to wrap around the antimeridian, as for H3 cell
+    boundaries. Without it such edges are valid wide polygons. Shapes which do not cross the antimeridian are
+    returned as is.
+    """
+
+    parts = []
+    crosses = False
+
+    for polygon in get_parts(shape):
+        if not isinstance(polygon, Polygon):
+            parts.append(polygon)
+            continue
+
+        # unwrap rings which jump across the antimeridian
+
+        longitudes = get_coordinates(polygon.exterior)[:, 0]
+        if wrap and np.any(np.abs(np.diff(longitudes)) > 180):
+            polygon = transform(polygon, lambda coords: np.column_stack([np.where(coords[:, 0] < 0, coords[:, 0] + 360, coords[:, 0]), coords[:, 1]]))
+            crosses = True
+
+        minx, _, maxx, _ = polygon.bounds
+        if minx >= -180 and maxx <= 180:
+            parts.append(polygon)
+            continue
+
+        crosses = True
+        for offset in (-360, 0, 360):
+            part = intersection(polygon, box(-180 - offset, -90, 180 - offset, 90))
+            part = transform(part, lambda coords: coords + np.array([offset, 0]))
+            parts.extend(part for part in get_parts(part) if isinstance(part, Polygon) and not part.is_empty)
+
+    # parts on both sides of the antimeridian are treated as crossing as well
+
+    if not crosses and len(parts) > 1:
+        longitudes = np.concatenate([get_coordinates(part)[:, 0] for part in parts])
+        crosses = longitudes.max() - longitudes.min() > 180
+
+    return parts if crosses else [shape]
+
+
+def unwrap_antimeridian(shape: Geometry) -> Geometry:
+    """Get the parts of a shape split at the antimeridian as a single geometry, for exact point tests."""
+
+    parts = split_antimeridian(shape)
+    if len(parts) == 1:
+        return parts[0]
+    if all(isinstance(part, Polygon) for part in parts):
+        return MultiPolygon(parts)
+    return GeometryCollection(parts)
+
+
+@lru_cache(maxsize=100000)
+def cell_polygon(h3: str) -> Polygon | MultiPolygon:
+    coords = h3_to_geo_boundary(h3)
+    flipped = tuple(coord[::-1] for coord in coords)
+
+    # cells crossing the antimeridian are split in a part on each side
+
+    longitudes = [coord[0] for coord in flipped]
+    if max(longitudes) - min(longitudes) > 180:
+        return MultiPolygon(split_antimeridian(Polygon(flipped), wrap=True))
+    return Polygon(flipped)
+
+
+def cells_for_points(latitudes, longitudes, resolution: int) -> np.ndarray:
+    """Assign H3 cells to arrays of coordinates, None where coordinates are missing."""
+
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    valid = ~(np.isnan(latitudes) | np.isnan(longitudes))
+
+    cells = np.full(len(latitudes), None, dtype=object)
+    if valid.any():
+        cells[valid] = np.frompyfunc(geo_to_h3, 3, 1)(latitudes[valid], longitudes[valid], resolution)
+    return cells
+
+
+def split_date_range(start_date, end_date) -> list[tuple[date, date]]:
+    """Split a date range into calendar month windows, with inclusive start and end days."""
+
+    start = start_date.date() if isinstance(start_date, datetime) else start_date
+    end = end_date.date() if isinstance(end_date, datetime) else end_date
+
+    windows = []
+    while start <= end:
+        next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+        window_end = min(next_month - timedelta(days=1), end)
+        windows.append((start, window_end))
+        start = next_month
+    return windows
+
+
+def create_session(pool_size: int = 10, retries: int = 3, backoff_factor: float = 0.5) -> requests.Session:
+    """Create a session with a connection pool and retries with backoff.
+
+    Error responses are only retried for idempotent methods, POST requests are only retried when the connection
+    could not be established, as the server may have processed a request which failed afterwards.
+    """
+
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=Retry.DEFAULT_ALLOWED_METHODS
+    )
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+@contextmanager
+def atomic_write(file: str, mode: str = "w", opener: Callable = open, **kwargs):
+    """Open a temporary file which replaces file when the block completes, so readers never see partial files."""
+
+    os.makedirs(os.path.dirname(file) or ".", exist_ok=True)
+    temp_file = f"{file}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with opener(temp_file, mode, **kwargs) as f:
+            yield f
+        os.replace(temp_file, file)
+    finally:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+
+
+class SQLiteConnection:
+    """SQLite connection which is opened lazily and reopened in forked worker processes.
+
+    Connections cannot be shared between processes, pickling keeps only the path and schema so objects holding a
+    connection can be passed to process pools. The setup function and schema statements run on every new connection.
+    """
+
+    def __init__(self, path: str, schema: list[str] = [], setup: Callable[[sqlite3.Connection], None] = None, **kwargs):
+        self.path = path
+        self.schema = schema
+        self.setup = setup
+        self.kwargs = kwargs
+        self.conn = None
+        self.pid = None
+
+    def __getstate__(self):
+        return {**self.__dict__, "conn": None, "pid": None}
+
+    def get(self) -> sqlite3.Connection:
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, **self.kwargs)
+            if self.setup is not None:
+                self.setup(self.conn)
+            for statement in self.schema:
+                self.conn.execute(statement)
+            self.pid = os.getpid()
+        return self.conn
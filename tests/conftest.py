@@ -0,0 +1,67 @@
+"""Shared fixtures, including a local HTTP server standing in for the portal and the OBIS API."""
+
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import threading
+import pytest
+
+
+@dataclass
+class StubRequest:
+    method: str
+    path: str
+    headers: dict
+    body: object
+
+
+class StubServer:
+    """HTTP server which records requests and answers them with handler(request) -> (status, headers, body)."""
+
+    def __init__(self):
+        self.requests = []
+        self.handler = lambda request: (200, {}, {})
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), self.request_handler())
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_port}/api"
+
+    def request_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def respond(self):
+                content = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                request = StubRequest(method=self.command, path=self.path, headers=dict(self.headers), body=json.loads(content) if content else None)
+                stub.requests.append(request)
+                status, headers, body = stub.handler(request)
+                data = body if isinstance(body, bytes) else json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = respond
+            do_POST = respond
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture()
+def stub():
+    server = StubServer()
+    yield server
+    server.close()
@@ -0,0 +1,57 @@
+from datetime import timedelta
+import os
+import time
+from pacmandetections.cache import PageCache
+
+
+PAGE = [{"id": "a", "eventDate": "2024-01-01"}]
+
+
+def age(cache: PageCache, key: str, seconds: float) -> None:
+    mtime = time.time() - seconds
+    os.utime(cache.file(key), (mtime, mtime))
+
+
+def test_put_and_get(tmp_path):
+    cache = PageCache(str(tmp_path))
+    key = cache.key("POLYGON ((0 0, 1 0, 1 1, 0 0))", "2024-01-01", "2024-01-31", None)
+    assert cache.get(key) is None
+    cache.put(key, PAGE)
+    assert cache.get(key) == PAGE
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_pages_expire_after_ttl(tmp_path):
+    cache = PageCache(str(tmp_path), ttl=timedelta(hours=12), closed_ttl=timedelta(days=14))
+    key = cache.key("wkt", "2024-01-01", "2024-01-31", None)
+    cache.put(key, PAGE)
+    age(cache, key, timedelta(days=1).total_seconds())
+    assert cache.get(key) is None
+    assert cache.get(key, closed=True) == PAGE
+    age(cache, key, timedelta(days=15).total_seconds())
+    assert cache.get(key, closed=True) is None
+
+
+def test_closed_pages_without_ttl_do_not_expire(tmp_path):
+    cache = PageCache(str(tmp_path), closed_ttl=None)
+    key = cache.key("wkt", "2020-01-01", "2020-01-31", None)
+    cache.put(key, PAGE)
+    age(cache, key, timedelta(days=365).total_seconds())
+    assert cache.get(key, closed=True) == PAGE
+
+
+def test_offline_serves_expired_pages(tmp_path):
+    cache = PageCache(str(tmp_path), offline=True)
+    key = cache.key("wkt", "2024-01-01", "2024-01-31", None)
+    cache.put(key, PAGE)
+    age(cache, key, timedelta(days=30).total_seconds())
+    assert cache.get(key) == PAGE
+
+
+def test_unreadable_pages_are_misses(tmp_path):
+    cache = PageCache(str(tmp_path))
+    key = cache.key("wkt", "2024-01-01", "2024-01-31", None)
+    cache.put(key, PAGE)
+    with open(cache.file(key), "wb") as f:
+        f.write(b"not gzip")
+    assert cache.get(key) is None
@@ -0,0 +1,103 @@
+from dataclasses import asdict, dataclass
+from pacmandetections.connectors import PortalRiskAnalysisConnector
+from pacmandetections.ledger import SubmissionLedger
+from pacmandetections.util import create_session
+
+
+@dataclass
+class Item:
+    area: int
+    taxon: int
+    date: str = "2024-01-01"
+    score: float = 0.5
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+
+def items(n: int) -> list[Item]:
+    return [Item(area=1, taxon=taxon) for taxon in range(n)]
+
+
+def connector(stub, **kwargs) -> PortalRiskAnalysisConnector:
+    return PortalRiskAnalysisConnector(endpoint=stub.url, **kwargs)
+
+
+def test_bulk_submission(stub):
+    stub.handler = lambda request: (201, {}, {})
+    summary = connector(stub, bulk=True, batch_size=2).submit(items(3))
+    assert summary.submitted == 3
+    assert [len(request.body) for request in stub.requests] == [2, 1]
+
+
+def test_bulk_falls_back_when_lists_are_not_accepted(stub):
+    stub.handler = lambda request: (405, {}, {}) if isinstance(request.body, list) else (201, {}, {})
+    portal = connector(stub, bulk=True)
+    summary = portal.submit(items(3))
+    assert summary.submitted == 3
+    assert not portal.bulk
+    assert [type(request.body) for request in stub.requests] == [list, dict, dict, dict]
+
+
+def test_bulk_falls_back_when_list_payload_is_rejected(stub):
+    rejected = {"non_field_errors": ["Invalid data. Expected a dictionary, but got list."]}
+    stub.handler = lambda request: (400, {}, rejected) if isinstance(request.body, list) else (201, {}, {})
+    portal = connector(stub, bulk=True)
+    summary = portal.submit(items(2))
+    assert summary.submitted == 2
+    assert not portal.bulk
+
+
+def test_validation_errors_are_failed_items(stub):
+
+    def handler(request):
+        errors = [{"score": ["invalid"]} if item["taxon"] == 1 else {} for item in request.body]
+        return (400, {}, errors) if any(errors) else (201, {}, {})
+
+    stub.handler = handler
+    portal = connector(stub, bulk=True)
+    batch = items(3)
+    summary = portal.submit(batch)
+    assert portal.bulk
+    assert summary.submitted == 2
+    assert summary.failed_items == [batch[1]]
+    assert [len(request.body) for request in stub.requests] == [3, 2]
+
+
+def test_post_is_not_retried_on_server_error(stub):
+    stub.handler = lambda request: (503, {}, {})
+    summary = connector(stub, retries=3).submit(items(1))
+    assert summary.failed == 1
+    assert len(stub.requests) == 1
+
+
+def test_get_is_retried_on_server_error(stub):
+    stub.handler = lambda request: (503, {}, {}) if len(stub.requests) < 3 else (200, {}, {})
+    res = create_session(retries=3, backoff_factor=0).get(f"{stub.url}/area/1/")
+    assert res.status_code == 200
+    assert len(stub.requests) == 3
+
+
+def test_ledger_skips_unchanged_items(stub, tmp_path):
+    stub.handler = lambda request: (201, {}, {})
+    portal = connector(stub, ledger=SubmissionLedger(str(tmp_path / "ledger.db")))
+
+    summary = portal.submit(items(3))
+    assert summary.submitted == 3 and summary.new == 3
+
+    changed = items(3)
+    changed[0].score = 0.9
+    changed[1].date = "2024-02-01"
+    summary = portal.submit(changed)
+    assert (summary.new, summary.changed, summary.unchanged) == (0, 1, 2)
+    assert summary.submitted == 1
+    assert len(stub.requests) == 4
+
+
+def test_failed_items_are_not_recorded(stub, tmp_path):
+    stub.handler = lambda request: (500, {}, {})
+    portal = connector(stub, ledger=SubmissionLedger(str(tmp_path / "ledger.db")))
+    portal.submit(items(1))
+    stub.handler = lambda request: (201, {}, {})
+    summary = portal.submit(items(1))
+    assert summary.submitted == 1 and summary.new == 1
@@ -0,0 +1,95 @@
+import os
+import time
+import h3
+import pandas as pd
+import pytest
+from pacmandetections.assessment import speedy_data_version, speedy_handles
+from pacmandetections.establishment import EstablishmentFlag, build_index, load_current_index
+from pacmandetections.model import EstablishmentMeans
+
+
+CELL = "859b41b3fffffff"
+NEIGHBOUR = sorted(h3.k_ring(CELL, 1) - {CELL})[0]
+TAXA = [100001, 100002]
+
+
+class FakeSpeedy:
+    """Speedy handle with the introduced taxa per cell, which records the taxa it was asked for."""
+
+    def __init__(self):
+        self.introduced = {CELL: set(TAXA)}
+        self.requested = []
+
+    def get_summary(self, aphiaid: int, resolution: int = 5, as_geopandas: bool = False) -> pd.DataFrame:
+        self.requested.append(aphiaid)
+        cells = [cell for cell, taxa in self.introduced.items() if aphiaid in taxa]
+        return pd.DataFrame({"h3": cells, "establishmentMeans_native": False, "establishmentMeans_introduced": True, "invasiveness_invasive": False, "invasiveness_concern": False})
+
+    def get_thermal_envelope(self, aphiaid: int, resolution: int = 5, as_geopandas: bool = False) -> pd.DataFrame | None:
+        return None
+
+
+def touch(file: str, mtime: float) -> None:
+    os.makedirs(os.path.dirname(file), exist_ok=True)
+    with open(file, "a"):
+        pass
+    os.utime(file, (mtime, mtime))
+
+
+@pytest.fixture()
+def speedy_data(tmp_path):
+    data_dir = str(tmp_path / "speedy_data")
+    for aphiaid in TAXA:
+        touch(os.path.join(data_dir, "summary", f"{aphiaid}.parquet"), 1000)
+    touch(os.path.join(data_dir, "grid.parquet"), 1000)
+    speedy = FakeSpeedy()
+    speedy_handles[(data_dir, 7)] = speedy
+    yield data_dir, speedy
+    del speedy_handles[(data_dir, 7)]
+
+
+def test_build_and_lookup(speedy_data, tmp_path):
+    data_dir, _ = speedy_data
+    index = build_index(data_dir, str(tmp_path / "index"), TAXA, resolutions=[5])
+    assert index.flags(CELL, TAXA[0]) == EstablishmentFlag.INTRODUCED
+    assert index.assess(CELL, TAXA[1]).establishmentMeans == EstablishmentMeans.INTRODUCED
+    assert index.assess(NEIGHBOUR, TAXA[0]).establishmentMeans == EstablishmentMeans.UNCERTAIN
+    assert index.indexed(TAXA[0], 5) and not index.indexed(100003, 5)
+
+
+def test_only_updated_taxa_are_reindexed(speedy_data, tmp_path):
+    data_dir, speedy = speedy_data
+    path = str(tmp_path / "index")
+    build_index(data_dir, path, TAXA, resolutions=[5])
+
+    speedy.requested = []
+    build_index(data_dir, path, TAXA, resolutions=[5])
+    assert speedy.requested == []
+
+    speedy.introduced = {CELL: {TAXA[1]}}
+    touch(os.path.join(data_dir, "summary", f"{TAXA[0]}.parquet"), 2000)
+    index = build_index(data_dir, path, TAXA, resolutions=[5])
+    assert speedy.requested == [TAXA[0]]
+    assert index.flags(CELL, TAXA[0]) == EstablishmentFlag(0)
+    assert index.flags(CELL, TAXA[1]) == EstablishmentFlag.INTRODUCED
+
+
+def test_shared_files_reindex_all_taxa(speedy_data, tmp_path):
+    data_dir, speedy = speedy_data
+    path = str(tmp_path / "index")
+    build_index(data_dir, path, TAXA, resolutions=[5])
+    speedy.requested = []
+    touch(os.path.join(data_dir, "grid.parquet"), 2000)
+    build_index(data_dir, path, TAXA, resolutions=[5])
+    assert sorted(speedy.requested) == TAXA
+
+
+def test_stale_index_is_not_used(speedy_data, tmp_path):
+    data_dir, _ = speedy_data
+    path = str(tmp_path / "index")
+    build_index(data_dir, path, TAXA, resolutions=[5])
+    assert load_current_index(path, speedy_data_version(data_dir, refresh=True)) is not None
+    touch(os.path.join(data_dir, "summary", f"{TAXA[0]}.parquet"), time.time())
+    assert load_current_index(path, speedy_data_version(data_dir, refresh=True)) is None
+    build_index(data_dir, path, TAXA, resolutions=[5])
+    assert load_current_index(path, speedy_data_version(data_dir, refresh=True)) is not None
@@ -0,0 +1,54 @@
+from datetime import timedelta
+import time
+from pacmandetections.jobs import JobStatus, JobStore
+
+
+def test_add_keeps_existing_units(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    assert store.add("run", ["a", "b"]) == 2
+    store.complete("run", store.lease("run", limit=1))
+    assert store.add("run", ["a", "b", "c"]) == 1
+    assert store.counts("run")[JobStatus.DONE] == 1
+    assert store.counts("run")[JobStatus.PENDING] == 2
+
+
+def test_lease_complete_and_fail(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    store.add("run", ["a", "b", "c"])
+    assert store.lease("run", limit=2, worker="w1") == ["a", "b"]
+    assert store.lease("run", limit=2, worker="w2") == ["c"]
+    assert store.lease("run", limit=2, worker="w3") == []
+    assert store.complete("run", ["a"], worker="w1") == 1
+    assert store.fail("run", ["b"], "error", worker="w1") == 1
+    counts = store.counts("run")
+    assert (counts[JobStatus.DONE], counts[JobStatus.FAILED], counts[JobStatus.LEASED]) == (1, 1, 1)
+
+
+def test_expired_leases_are_handed_out_again(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"), lease_timeout=timedelta(seconds=0.05))
+    store.add("run", ["a"])
+    assert store.lease("run", worker="w1") == ["a"]
+    time.sleep(0.1)
+    assert store.lease("run", worker="w2") == ["a"]
+
+    # the worker which lost the lease does not overwrite the result of the worker which took over
+
+    assert store.complete("run", ["a"], worker="w2") == 1
+    assert store.fail("run", ["a"], "late", worker="w1") == 0
+    assert store.counts("run")[JobStatus.DONE] == 1
+
+
+def test_retry_failed(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    store.add("run", ["a", "b"])
+    store.fail("run", store.lease("run", limit=2), "error")
+    assert store.retry_failed("run") == 2
+    assert store.lease("run", limit=2) == ["a", "b"]
+
+
+def test_runs_are_separate(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.db"))
+    store.add("one", ["a"])
+    store.add("two", ["a"])
+    store.complete("one", store.lease("one"))
+    assert store.counts("two")[JobStatus.PENDING] == 1
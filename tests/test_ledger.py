@@ -0,0 +1,26 @@
+from pacmandetections.ledger import SubmissionLedger, content_hash
+
+
+def test_content_hash_ignores_key_order():
+    assert content_hash({"a": 1, "b": [1, 2]}) == content_hash({"b": [1, 2], "a": 1})
+    assert content_hash({"a": 1}) != content_hash({"a": 2})
+
+
+def test_record_and_hashes(tmp_path):
+    ledger = SubmissionLedger(str(tmp_path / "ledger.db"))
+    assert ledger.hashes("detection", ["a", "b"]) == {}
+    ledger.record("detection", {"a": "1", "b": "2"})
+    ledger.record("detection", {"b": "3"})
+    assert ledger.hashes("detection", ["a", "b", "c"]) == {"a": "1", "b": "3"}
+    assert ledger.hashes("risk_analysis", ["a"]) == {}
+
+
+def test_hashes_in_batches(tmp_path):
+    ledger = SubmissionLedger(str(tmp_path / "ledger.db"))
+    ledger.record("detection", {str(i): str(i) for i in range(1200)})
+    assert len(ledger.hashes("detection", [str(i) for i in range(1500)])) == 1200
+
+
+def test_ledger_is_persistent(tmp_path):
+    SubmissionLedger(str(tmp_path / "ledger.db")).record("detection", {"a": "1"})
+    assert SubmissionLedger(str(tmp_path / "ledger.db")).hashes("detection", ["a"]) == {"a": "1"}
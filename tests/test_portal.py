@@ -0,0 +1,63 @@
+from datetime import timedelta
+import pytest
+from pacmandetections.portal import PortalMetadataClient
+
+
+AREA = {"id": 1, "name": "Fiji", "wkt": "POLYGON ((176 -19, 176 -15, 180 -15, 180 -19, 176 -19))"}
+
+
+def test_revalidates_with_etag(stub):
+    stub.handler = lambda request: (304, {}, b"") if request.headers.get("If-None-Match") == "v1" else (200, {"ETag": "v1"}, AREA)
+    client = PortalMetadataClient(endpoint=stub.url)
+    assert client.area(1) == AREA
+    assert client.area(1) == AREA
+    assert [request.path for request in stub.requests] == ["/api/area/1", "/api/area/1"]
+    assert stub.requests[1].headers["If-None-Match"] == "v1"
+
+
+def test_revalidates_with_last_modified(stub):
+    modified = "Mon, 01 Jan 2024 00:00:00 GMT"
+    stub.handler = lambda request: (304, {}, b"") if request.headers.get("If-Modified-Since") == modified else (200, {"Last-Modified": modified}, AREA)
+    client = PortalMetadataClient(endpoint=stub.url)
+    client.area(1)
+    assert client.area(1) == AREA
+    assert stub.requests[1].headers["If-Modified-Since"] == modified
+
+
+def test_changed_resource_replaces_snapshot(stub):
+    stub.handler = lambda request: (200, {"ETag": "v1"}, AREA)
+    client = PortalMetadataClient(endpoint=stub.url)
+    client.area(1)
+    stub.handler = lambda request: (200, {"ETag": "v2"}, {**AREA, "name": "Fiji and Tonga"})
+    assert client.area(1)["name"] == "Fiji and Tonga"
+    assert client.snapshots["area/1"]["etag"] == "v2"
+
+
+def test_snapshot_is_used_within_max_age(stub):
+    stub.handler = lambda request: (200, {}, AREA)
+    client = PortalMetadataClient(endpoint=stub.url, max_age=timedelta(hours=1))
+    client.area(1)
+    client.area(1)
+    assert len(stub.requests) == 1
+
+
+def test_snapshot_is_used_when_portal_fails(stub, tmp_path):
+    stub.handler = lambda request: (200, {}, AREA)
+    PortalMetadataClient(endpoint=stub.url, path=str(tmp_path)).area(1)
+    stub.handler = lambda request: (500, {}, {})
+    assert PortalMetadataClient(endpoint=stub.url, path=str(tmp_path)).area(1) == AREA
+
+
+def test_offline_uses_snapshot_on_disk(stub, tmp_path):
+    stub.handler = lambda request: (200, {}, [{"taxa": [1, 2]}, {"taxa": [2, 3]}])
+    PortalMetadataClient(endpoint=stub.url, path=str(tmp_path)).priority_lists(1)
+    client = PortalMetadataClient(endpoint=stub.url, path=str(tmp_path), offline=True)
+    assert client.priority_taxa(1) == {1, 2, 3}
+    assert len(stub.requests) == 1
+
+
+def test_offline_without_snapshot_raises(stub, tmp_path):
+    client = PortalMetadataClient(endpoint=stub.url, path=str(tmp_path), offline=True)
+    with pytest.raises(LookupError):
+        client.area(1)
+    assert len(stub.requests) == 0
@@ -0,0 +1,34 @@
+from datetime import datetime
+from h3 import geo_to_h3
+from shapely import from_wkt
+import pandas as pd
+from pacmandetections.sources import PARQUET_COLUMNS, GBIFSource, ParquetOccurrenceSource
+
+
+DATELINE = from_wkt("POLYGON((178 -18, 182 -18, 182 -16, 178 -16, 178 -18))")
+
+
+def records(points: dict[str, tuple[float, float]]) -> pd.DataFrame:
+    rows = []
+    for id, (lon, lat) in points.items():
+        row = {column: None for column in PARQUET_COLUMNS.values()}
+        row.update({"id": id, "scientificName": "Abra alba", "speciesid": 141433, "eventDate": "2024-01-01", "decimalLongitude": lon, "decimalLatitude": lat, "DNA_sequence": "ACGT", "genusid": 138474, "date_start": "2024-01-01", "date_end": "2024-01-01"})
+        rows.append(row)
+    return pd.DataFrame(rows).astype({"catalogNumber": str, "organismQuantity": float})
+
+
+def test_parquet_across_antimeridian(tmp_path):
+    path = str(tmp_path / "occurrence.parquet")
+    records({"a": (179, -17), "b": (-179, -17), "c": (0, -17)}).to_parquet(path)
+    occurrences = ParquetOccurrenceSource(path).fetch(DATELINE, datetime(2023, 1, 1), datetime(2025, 1, 1))
+    assert sorted(occurrence.id for occurrence in occurrences) == ["a", "b"]
+
+
+def test_gbif_across_antimeridian(tmp_path):
+    source = GBIFSource(str(tmp_path / "gbif.duckdb"))
+    conn = source.connect()
+    for id, lon in (("a", 179.5), ("b", -179.5), ("c", 0.0)):
+        conn.execute("insert into occurrence (id, scientificName, AphiaID, eventDate, decimalLongitude, decimalLatitude, h3, day, dna) values (?, 'Abra alba', 141433, '2024-01-01', ?, -17, ?, '2024-01-01', true)", [id, lon, geo_to_h3(-17, lon, source.resolution)])
+    conn.close()
+    occurrences = source.fetch(DATELINE, datetime(2023, 1, 1), datetime(2025, 1, 1))
+    assert sorted(occurrence.id for occurrence in occurrences) == ["a", "b"]
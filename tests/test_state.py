@@ -0,0 +1,74 @@
+from datetime import datetime
+import h3
+from pacmandetections import BatchDetectionEngine, DetectionEngine
+from pacmandetections.model import Confidence, Detection, Occurrence, Source
+from pacmandetections.state import DetectionState
+
+
+CELLS = sorted(h3.k_ring("859b41b3fffffff", 1))
+
+
+def occurrence(id: str, cell: str, event_date: str) -> Occurrence:
+    lat, lon = h3.h3_to_geo(cell)
+    return Occurrence(id=id, scientificName="Abra alba", AphiaID=141433, eventDate=event_date, decimalLongitude=lon, decimalLatitude=lat, catalogNumber=None, eventID=None, materialSampleID=None, establishmentMeans=None, occurrenceRemarks=None, associatedMedia=None, datasetID="d", datasetName="d", target_gene=None, DNA_sequence=None, identificationRemarks=None, organismQuantity=None)
+
+
+class RecordingSource(Source):
+    """Source which records the requested start dates."""
+
+    def __init__(self, occurrences: list[Occurrence]):
+        self.occurrences = occurrences
+        self.start_dates = []
+
+    def fetch(self, shape, start_date: datetime, end_date: datetime):
+        self.start_dates.append(start_date.date().isoformat())
+        return [occurrence for occurrence in self.occurrences if occurrence.get_day() >= start_date.date().isoformat()]
+
+    def __str__(self):
+        return "recording"
+
+
+def test_watermarks(tmp_path):
+    state = DetectionState(str(tmp_path / "state.db"))
+    assert state.get_watermark(CELLS[0]) is None
+    state.set_watermark(CELLS[0], "2024-01-01")
+    assert state.get_watermark(CELLS[0]) == "2024-01-01"
+    assert DetectionState(str(tmp_path / "state.db")).get_watermark(CELLS[0]) == "2024-01-01"
+
+
+def test_put_detection_reports_changes(tmp_path):
+    state = DetectionState(str(tmp_path / "state.db"))
+    detection = Detection(taxon=141433, scientificName="Abra alba", h3=CELLS[0], date="2024-01-01", occurrences=[occurrence("a", CELLS[0], "2024-01-01")], area=1, target_gene=None, confidence=Confidence.LOW, media=None, best_identity=None, best_organismQuantity=None, best_query_cover=None, best_alternatives=1)
+    assert state.put_detection(CELLS[0], detection.get_key(), detection)
+    assert not state.put_detection(CELLS[0], detection.get_key(), detection)
+    detection.confidence = Confidence.HIGH
+    assert state.put_detection(CELLS[0], detection.get_key(), detection)
+    assert state.get_detection(CELLS[0], detection.get_key()).confidence == Confidence.HIGH
+
+
+def test_batch_runs_fetch_from_watermarks(tmp_path):
+
+    # only the first cell has occurrences, the other cells must not force fetching the full window again
+
+    state = DetectionState(str(tmp_path / "state.db"))
+    source = RecordingSource([occurrence("a", CELLS[0], "2000-01-01")])
+    today = datetime.today().date().isoformat()
+
+    for _ in range(3):
+        BatchDetectionEngine(cells=CELLS, sources=[source], days=365 * 50).generate(state=state)
+
+    assert source.start_dates[1] == source.start_dates[2] == "2000-01-01"
+    assert state.get_watermark(CELLS[0]) == "2000-01-01"
+    assert all(state.get_watermark(cell) == today for cell in CELLS[1:])
+
+
+def test_incremental_runs_fetch_from_watermark(tmp_path):
+    state = DetectionState(str(tmp_path / "state.db"))
+    source = RecordingSource([])
+    today = datetime.today().date().isoformat()
+
+    for _ in range(2):
+        DetectionEngine(h3=CELLS[0], sources=[source], days=365).generate_incremental(state)
+
+    assert source.start_dates[1] == today
+    assert state.get_watermark(CELLS[0]) == today
@@ -0,0 +1,31 @@
+from shapely import MultiPolygon, Point, box, from_wkt
+from pacmandetections.util import cell_polygon, split_antimeridian, unwrap_antimeridian
+
+
+def test_shape_within_bounds_is_not_split():
+    shape = box(10, 10, 20, 20)
+    assert split_antimeridian(shape) == [shape]
+
+
+def test_wide_polygon_is_not_unwrapped():
+    shape = box(-170, -10, 170, 10)
+    assert split_antimeridian(shape) == [shape]
+
+
+def test_shape_beyond_antimeridian_is_split():
+    parts = split_antimeridian(from_wkt("POLYGON((178 -18, 182 -18, 182 -16, 178 -16, 178 -18))"))
+    assert sorted(part.bounds for part in parts) == [(-180, -18, -178, -16), (178, -18, 180, -16)]
+
+
+def test_unwrap_antimeridian():
+    shape = unwrap_antimeridian(from_wkt("POLYGON((178 -18, 182 -18, 182 -16, 178 -16, 178 -18))"))
+    assert isinstance(shape, MultiPolygon)
+    assert shape.intersects(Point(-179, -17)) and shape.intersects(Point(179, -17))
+    assert not shape.intersects(Point(0, -17))
+
+
+def test_cell_across_antimeridian():
+    shape = cell_polygon("859b4363fffffff")
+    assert isinstance(shape, MultiPolygon)
+    minx, _, maxx, _ = shape.bounds
+    assert minx >= -180 and maxx <= 180